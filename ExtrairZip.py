@@ -1,60 +1,62 @@
 from  datetime import datetime, timedelta
 import zipfile as z
 import os
-import shutil
-def SalvarZipURLCNES( tempDiretorio, datalakeDestino, listZips, data):
+
+from cnes_downloader import CnesDownloader, TLSOptions, open_remote_zip
+from cnes_sinks import extract_to_sink, sink_for
+
+# Store do sistema + cadeia Let's Encrypt de certificado/ (padrão de TLSOptions)
+TLS = TLSOptions()
+
+def SalvarZipURLCNES( tempDiretorio, datalakeDestino, listZips, data, url=None):
     """
-    Faz o download de um arquivo ZIP CNES, extrai os arquivos relacionados a 'estabelecimentos'
-    e envia os CSVs extraídos para o destino especificado no datalake.
+    Faz o download de um arquivo ZIP CNES e extrai os arquivos relacionados a
+    'estabelecimentos' direto no destino especificado no datalake (sem pasta
+    intermediária: cada CSV é gravado por streaming e publicado de forma atômica).
 
     Parâmetros
     ----------
     url : str
         URL base para formar o caminho do ZIP.
     tempDiretorio : str
-        Diretório temporário local para salvar e extrair os arquivos.
+        Diretório temporário local onde o ZIP baixado é procurado.
     datalakeDestino : str
-        Caminho no datalake onde os arquivos CSV extraídos devem ser copiados.
+        Caminho no datalake onde os arquivos CSV devem ser gravados: pasta local
+        ou URL fsspec (ex.: abfss://...), ou um `Sink` (ver `cnes_sinks`).
     listZips : str
         Nome base do arquivo ZIP, sem extensão.
     data : str
         Data no formato 'YYYYMM' para compor o nome do arquivo ZIP.
+    url : str, opcional
+        URL do ZIP no EstatisticasServlet. Usada quando o ZIP não existe em
+        `tempDiretorio`: o arquivo é lido remotamente via HTTP Range, baixando
+        apenas os membros selecionados.
     """
     nomeArquivo = listZips
 
-    diretorioZip = os.path.join(tempDiretorio, nomeArquivo, "ZIP")
-    #construcao do diretorio onde vai salvar
-    diretorioCSV = os.path.join(tempDiretorio, nomeArquivo, "CSV")
-
-    os.makedirs(diretorioZip, exist_ok=True)
-    os.makedirs(diretorioCSV, exist_ok=True)
     #Onde está o arquivo zip baixado
     pathZip = os.path.join(tempDiretorio, nomeArquivo + ".zip")
 
 
-    with z.ZipFile(pathZip, 'r') as root:
+    if os.path.exists(pathZip) or url is None:
+        root = z.ZipFile(pathZip, 'r')
+    else:
+        print(f"[INFO] Lendo ZIP remoto: {url}")
+        root = open_remote_zip(url, opener=CnesDownloader.session(TLS))
+
+    with root:
         arquivos_zip = root.namelist()
         encontrados = [a for a in arquivos_zip if "tbestabelecimento" in a.lower()]
 
         if not encontrados:
             print("⚠️ Nenhum arquivo com 'estabelecimentos' encontrado no ZIP.")
         else:
+            #pra onde ele vai: direto no datalake, sem cópia posterior
+            destino = sink_for(datalakeDestino)
+            print(f"[INFO] Extraindo para: {destino}")
             for arquivo in encontrados:
                 print(f"🗂️ Extraindo: {arquivo}")
-                #pra onde ele vai
-                root.extract(arquivo, diretorioCSV)
-
-    # Copiar para datalake (assumindo ambiente mssparkutils)
-    print(f"[INFO] Copiando arquivos extraídos para: {datalakeDestino}")
-    # Remove prefixo 'file:' se estiver presente
-    origem = diretorioCSV.replace("file:", "")
-    destino = datalakeDestino
-
-    # Cria diretório destino, se não existir
-    os.makedirs(destino, exist_ok=True)
-
-    # Copia todos os arquivos e subpastas
-    shutil.copytree(origem, destino, dirs_exist_ok=True)
+                extract_to_sink(root, destino, [arquivo])
 
 # ## APAGAR: Códigos auxiliares para execução interativa
 
@@ -73,4 +75,4 @@ pathBR = 'URL/CNES/Estabelecimentos'
 listaArquivo = f'BASE_DE_DADOS_CNES_{mesAno}'
 
 # Executar processo
-SalvarZipURLCNES(pathTemp, pathCSV, listaArquivo, mesAno)
\ No newline at end of file
+SalvarZipURLCNES(pathTemp, pathCSV, listaArquivo, mesAno, url=f"{urlBase}{listaArquivo}.ZIP")
\ No newline at end of file
@@ -1,10 +1,13 @@
 # baixar_cnes.py
-# Executável: baixa e extrai o ZIP do CNES usando a store do Windows.
+# Executável: baixa e extrai o ZIP do CNES usando a store do sistema (Windows ou não).
 
+import argparse
 import logging
+import os
 from pathlib import Path
 
 from cnes_downloader import (
+    CERTIFICADO_PEM,
     CnesDownloader,
     TLSOptions,
     ProxyOptions,
@@ -12,6 +15,22 @@ from cnes_downloader import (
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
 
+parser = argparse.ArgumentParser(description="Baixa e extrai o ZIP do CNES.")
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="cnes_profile",
+    default=os.environ.get("CNES_PROFILE"),
+    metavar="PASTA",
+    help="Perfil por fase (cProfile + tracemalloc) em PASTA (padrão: cnes_profile; ou CNES_PROFILE).",
+)
+args = parser.parse_args()
+if args.profile:
+    # só importado quando pedido: sem a opção, nenhum custo de perfil
+    from cnes_profile import enable_profiling
+
+    enable_profiling(args.profile)
+
 URL = (
     "https://cnes.datasus.gov.br/EstatisticasServlet?path=BASE_DE_DADOS_CNES_202508.ZIP"
 )
@@ -19,8 +38,8 @@ ARQ_ZIP = Path("BASE_DE_DADOS_CNES_202508.ZIP")
 SAIDA = Path("CNES_202508")
 
 tls = TLSOptions(
-    use_windows_store=True,  # <- agora funciona porque você instalou wincertstore
-    extra_certs_pem=(),  # opcional: PEMs corporativos extras, se houver
+    use_windows_store=True,  # store nativa do sistema (não requer wincertstore)
+    extra_certs_pem=(CERTIFICADO_PEM,),  # cadeia Let's Encrypt + PEMs corporativos extras
     cafile=None,
     allow_insecure_fallback=False,
     pin_sha256_hex=None,
@@ -33,19 +52,18 @@ proxy = ProxyOptions(
 )
 
 try:
-    # 1) Download com retomada
-    arq = CnesDownloader.download_with_resume(
+    # 1) Download com retomada (SHA-256 calculado durante o download)
+    arq, sha = CnesDownloader.download_with_resume(
         URL, ARQ_ZIP, tls=tls, proxy=proxy, max_retries=6, backoff_factor=1.5
     )
 
-    # 2) Verificação rápida do ZIP
-    CnesDownloader.test_zip_integrity(arq)
+    # 2) Verificação rápida do ZIP (só o diretório central)
+    CnesDownloader.check_zip_structure(arq)
 
-    # 3) Extração com progresso
+    # 3) Extração com progresso (CRC conferido durante a extração)
     CnesDownloader.extract_zip(arq, SAIDA)
 
     # 4) Hash do arquivo para auditoria (opcional)
-    sha = CnesDownloader.sha256_file(arq)
     print(f"SHA-256 do ZIP: {sha}")
 
 except Exception as e:
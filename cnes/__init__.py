@@ -0,0 +1,7 @@
+# cnes/__init__.py
+# -*- coding: utf-8 -*-
+"""
+Ponto de entrada único do pipeline do CNES (`python -m cnes <subcomando>`).
+Importar o pacote não importa nada pesado: cada subcomando importa os módulos
+`cnes_*` de que precisa só quando é executado (ver `cnes.cli`).
+"""
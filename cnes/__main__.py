@@ -0,0 +1,8 @@
+# cnes/__main__.py
+# -*- coding: utf-8 -*-
+"""`python -m cnes ...`"""
+
+from cnes.cli import main
+
+if __name__ == "__main__":
+    main()
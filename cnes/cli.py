@@ -0,0 +1,283 @@
+# cnes/cli.py
+# -*- coding: utf-8 -*-
+"""
+CLI do pipeline do CNES: `python -m cnes {discover,download,verify,extract,convert,shard,backfill}`.
+
+O parser usa só `argparse`; os módulos `cnes_*` (e, com eles, `ssl`,
+`http.client`, pyarrow, fsspec...) são importados dentro de cada subcomando.
+Assim `python -m cnes download --help` não paga import de rede nem de Spark, e
+nenhum subcomando depende de pyspark, BeautifulSoup ou `get_ipython()`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import re
+import sys
+from typing import List, Optional
+
+URL_BASE = "https://cnes.datasus.gov.br/EstatisticasServlet?path="
+PAGINA_ARQUIVOS = "https://cnes.datasus.gov.br/pages/downloads/arquivosBaseDados.jsp"
+_COMPETENCIA_RE = re.compile(r"^\d{6}$")
+
+
+def _url(alvo: str) -> str:
+    """AAAAMM vira a URL do ZIP da competência; URL passa direto."""
+    if _COMPETENCIA_RE.match(alvo):
+        return f"{URL_BASE}BASE_DE_DADOS_CNES_{alvo}.ZIP"
+    return alvo
+
+
+def _tls(args: argparse.Namespace):
+    from cnes_downloader import TLSOptions
+
+    return TLSOptions(
+        pin_sha256_hex=args.pin,
+        cafile=args.cafile,
+        allow_insecure_fallback=args.inseguro,
+    )
+
+
+# =================== Subcomandos ===================
+
+
+def _discover(args: argparse.Namespace) -> int:
+    from cnes_catalog import discover_catalog, latest
+    from cnes_downloader import CnesDownloader, ProxyOptions
+
+    entries = discover_catalog(
+        args.pagina,
+        opener=CnesDownloader.session(_tls(args), ProxyOptions.from_env()),
+        ttl=args.ttl,
+    )
+    for e in entries if args.todas else latest(entries):
+        print(f"{e.competencia}\t{e.url}")
+    return 0
+
+
+def _download(args: argparse.Namespace) -> int:
+    from cnes_downloader import CnesDownloader, ProxyOptions
+
+    url = _url(args.alvo)
+    destino = args.destino or url.rsplit("=", 1)[-1].rsplit("/", 1)[-1]
+    arq, sha256 = CnesDownloader.download_with_resume(
+        url,
+        destino,
+        tls=_tls(args),
+        proxy=ProxyOptions.from_env(),
+        segments=args.segmentos,
+        max_retries=args.tentativas,
+    )
+    print(f"{arq}\t{sha256}")
+    return 0
+
+
+def _verify(args: argparse.Namespace) -> int:
+    from cnes_downloader import check_zip_structure, sha256_file, test_zip_integrity
+
+    membros = check_zip_structure(args.zip)
+    if args.completo:
+        test_zip_integrity(args.zip)
+    print(f"{args.zip}\t{membros} membro(s)\t{'CRC ok' if args.completo else 'estrutura ok'}")
+    if args.sha256:
+        print(sha256_file(args.zip))
+    return 0
+
+
+def _extract(args: argparse.Namespace) -> int:
+    # Com --manifesto a extração passa pelo sink (hardlink/cópia no servidor
+    # dos membros repetidos), num processo só
+    if args.manifesto or ("://" in args.destino and not args.destino.startswith("file:")):
+        import zipfile
+
+        from cnes_sinks import MemberManifest, extract_to_sink
+
+        manifest = MemberManifest(args.manifesto) if args.manifesto else None
+        with zipfile.ZipFile(args.zip, "r") as zf:
+            for nome in extract_to_sink(zf, args.destino, args.membros or None, manifest=manifest):
+                print(nome)
+        return 0
+
+    from cnes_downloader import extract_zip_parallel
+
+    report = extract_zip_parallel(
+        args.zip, args.destino, workers=args.workers, members=args.membros or None
+    )
+    for nome in sorted(report.extracted):
+        print(nome)
+    for nome, erro in sorted(report.failed.items()):
+        print(f"ERRO\t{nome}\t{erro}", file=sys.stderr)
+    return 1 if report.failed else 0
+
+
+def _convert(args: argparse.Namespace) -> int:
+    from cnes_parquet import convert_zip_to_parquet
+
+    reports = convert_zip_to_parquet(
+        args.zip,
+        args.saida,
+        members=args.membros or None,
+        engine=args.engine,
+        compression=args.compressao,
+    )
+    for r in reports:
+        print(f"{r.table}\t{r.rows}\t{r.engine}\t{r.path}")
+    return 0
+
+
+def _shard(args: argparse.Namespace) -> int:
+    from cnes_shards import shard_directory
+
+    for r in shard_directory(
+        args.entrada,
+        args.saida,
+        shards=args.fatias,
+        shard_bytes=args.mb_por_fatia * 1024 * 1024,
+        workers=args.workers,
+    ):
+        print(f"{r.source}\t{len(r.shards)}\t{r.bytes}")
+    return 0
+
+
+def _backfill(args: argparse.Namespace) -> int:
+    from cnes_backfill import (
+        backfill,
+        competencias_do_catalogo,
+        competencias_do_intervalo,
+        url_da_competencia,
+    )
+    from cnes_downloader import ProxyOptions
+
+    if args.catalogo:
+        competencias = competencias_do_catalogo(
+            args.catalogo, tls=_tls(args), proxy=ProxyOptions.from_env(), ttl=args.ttl
+        )
+    else:
+        competencias = competencias_do_intervalo(args.inicio, args.fim)
+    urls = [url_da_competencia(c) for c in competencias]
+    resultados = backfill(
+        urls,
+        args.raiz,
+        somente_faltantes=not args.todas,
+        max_connections=args.max_conexoes,
+        max_bytes_per_second=args.max_mbps * 1024 * 1024 if args.max_mbps else None,
+        segments=args.segmentos,
+        extract_workers=args.extracao_workers,
+        deduplicar=args.deduplicar,
+        tls=_tls(args),
+        proxy=ProxyOptions.from_env(),
+    )
+    for r in resultados:
+        print(f"{r.competencia}\t{r.status}\t{r.detalhe}")
+    return 1 if any(r.status == "erro" for r in resultados) else 0
+
+
+# =================== Parser ===================
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cnes", description="Pipeline de arquivos do CNES.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log em nível DEBUG.")
+    parser.add_argument("--metricas-json", help="Relatório JSON de métricas da execução.")
+    parser.add_argument("--metricas-prom", help="Textfile do Prometheus (node_exporter).")
+    parser.add_argument(
+        "--profile", metavar="PASTA", help="Perfil por fase (cProfile + tracemalloc, pstats e pilhas) em PASTA."
+    )
+    sub = parser.add_subparsers(dest="comando", required=True, metavar="subcomando")
+
+    rede = argparse.ArgumentParser(add_help=False)
+    rede.add_argument("--pin", help="SHA-256 do certificado leaf (pinning; ignora a cadeia).")
+    rede.add_argument("--cafile", help="Bundle de CAs adicional.")
+    rede.add_argument(
+        "--inseguro", action="store_true", help="Se a verificação da cadeia falhar, segue sem verificar."
+    )
+
+    p = sub.add_parser("discover", parents=[rede], help="Lista as competências publicadas.")
+    p.add_argument("--pagina", default=PAGINA_ARQUIVOS, help="Página com os links dos ZIPs.")
+    p.add_argument("--todas", action="store_true", help="Todas as competências (padrão: só a mais recente).")
+    p.add_argument("--ttl", type=float, default=6 * 3600, help="Validade do memo em disco (s); 0 = sempre buscar.")
+    p.set_defaults(func=_discover)
+
+    p = sub.add_parser("download", parents=[rede], help="Baixa o ZIP de uma competência.")
+    p.add_argument("alvo", help="Competência (AAAAMM) ou URL do ZIP.")
+    p.add_argument("--destino", help="Arquivo de saída (padrão: nome do ZIP na pasta atual).")
+    p.add_argument("--segmentos", type=int, default=4)
+    p.add_argument("--tentativas", type=int, default=8)
+    p.set_defaults(func=_download)
+
+    p = sub.add_parser("verify", help="Confere a estrutura (e, opcionalmente, o CRC) de um ZIP.")
+    p.add_argument("zip")
+    p.add_argument("--completo", action="store_true", help="Descompacta tudo e confere o CRC.")
+    p.add_argument("--sha256", action="store_true", help="Mostra o SHA-256 do arquivo.")
+    p.set_defaults(func=_verify)
+
+    p = sub.add_parser("extract", help="Extrai um ZIP numa pasta ou URL fsspec (abfss://...).")
+    p.add_argument("zip")
+    p.add_argument("destino")
+    p.add_argument("membros", nargs="*", help="Membros a extrair (padrão: todos).")
+    p.add_argument("--workers", type=int, help="Processos de extração (pasta local).")
+    p.add_argument(
+        "--manifesto",
+        help="JSON (caminho ou URL) dos membros já extraídos: os repetidos são reaproveitados.",
+    )
+    p.set_defaults(func=_extract)
+
+    p = sub.add_parser("convert", help="Converte os CSVs do ZIP para Parquet.")
+    p.add_argument("zip")
+    p.add_argument("saida", help="Pasta de saída.")
+    p.add_argument("membros", nargs="*", help="Membros a converter (padrão: tb*.csv).")
+    p.add_argument("--engine", choices=("auto", "pyarrow", "python"), default="auto")
+    p.add_argument("--compressao", help="Codec do Parquet (padrão: zstd/gzip conforme o engine).")
+    p.set_defaults(func=_convert)
+
+    p = sub.add_parser("shard", help="Fatia os tb*.csv extraídos em CSVs UTF-8 para o Spark.")
+    p.add_argument("entrada", help="Pasta com os tb*.csv extraídos.")
+    p.add_argument("saida", help="Pasta das fatias.")
+    p.add_argument("--fatias", type=int, help="Fatias por CSV (padrão: uma a cada --mb-por-fatia).")
+    p.add_argument("--mb-por-fatia", type=int, default=128)
+    p.add_argument("--workers", type=int)
+    p.set_defaults(func=_shard)
+
+    p = sub.add_parser("backfill", parents=[rede], help="Baixa e extrai um intervalo de competências.")
+    faixa = p.add_mutually_exclusive_group(required=True)
+    faixa.add_argument("--inicio", help="Primeira competência (AAAAMM).")
+    faixa.add_argument(
+        "--catalogo",
+        nargs="?",
+        const=PAGINA_ARQUIVOS,
+        metavar="PAGINA",
+        help="Todas as competências publicadas no catálogo (padrão: página de arquivos).",
+    )
+    p.add_argument("--fim", help="Última competência (AAAAMM); padrão: mês atual.")
+    p.add_argument("--ttl", type=float, default=6 * 3600, help="Validade do memo do catálogo (s); 0 = sempre buscar.")
+    p.add_argument("--raiz", default="CNES", help="Pasta de saída.")
+    p.add_argument("--todas", action="store_true", help="Reprocessa também as já presentes.")
+    p.add_argument("--max-conexoes", type=int, default=8)
+    p.add_argument("--max-mbps", type=float, help="Teto global de banda em MB/s.")
+    p.add_argument("--segmentos", type=int, default=2)
+    p.add_argument("--extracao-workers", type=int, default=1)
+    p.add_argument(
+        "--deduplicar", action="store_true", help="Hardlink dos membros iguais aos de competências já extraídas."
+    )
+    p.set_defaults(func=_backfill)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO, format="%(levelname)s %(message)s"
+    )
+    if args.profile:
+        from cnes_profile import enable_profiling
+
+        enable_profiling(args.profile)
+    try:
+        code = args.func(args)
+    finally:
+        if args.metricas_json or args.metricas_prom:
+            from cnes_metrics import METRICS
+
+            METRICS.export(args.metricas_json, args.metricas_prom)
+    raise SystemExit(code)
@@ -0,0 +1,265 @@
+# cnes_backfill.py
+# -*- coding: utf-8 -*-
+"""
+Backfill de várias competências do CNES (download, verificação e extração) em
+paralelo, com limite global de conexões, limite global de banda e prioridade
+para os meses mais recentes.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Union
+
+from cnes_catalog import DEFAULT_TTL, discover_catalog
+from cnes_downloader import (
+    BandwidthLimiter,
+    CnesDownloader,
+    DownloadCache,
+    ProxyOptions,
+    TLSOptions,
+    check_zip_structure,
+    extract_zip,
+)
+from cnes_metrics import METRICS
+from cnes_sinks import MemberManifest
+
+LOGGER = logging.getLogger("CNES_BACKFILL")
+
+URL_BASE = "https://cnes.datasus.gov.br/EstatisticasServlet?path="
+PAGINA_ARQUIVOS = "https://cnes.datasus.gov.br/pages/downloads/arquivosBaseDados.jsp"
+_COMPETENCIA_RE = re.compile(r"BASE_DE_DADOS_CNES_(\d{6})\.ZIP", re.IGNORECASE)
+
+# Marca gravada em <raiz>/<AAAAMM>/ quando a competência terminou sem erro
+MARCA_CONCLUIDO = ".concluido.json"
+# Membros já extraídos (nome sem AAAAMM, CRC-32, tamanho) -> cópia em disco
+MANIFESTO_MEMBROS = "_membros.json"
+
+
+class BackfillResult(NamedTuple):
+    """Resultado por competência: `status` é "ok", "presente" ou "erro"."""
+
+    competencia: str
+    status: str
+    detalhe: str
+
+
+def competencia_da_url(url: str) -> str:
+    match = _COMPETENCIA_RE.search(url)
+    if not match:
+        raise ValueError(f"URL sem competência BASE_DE_DADOS_CNES_AAAAMM.ZIP: {url}")
+    return match.group(1)
+
+
+def competencias_do_intervalo(inicio: str, fim: Optional[str] = None) -> List[str]:
+    """Lista AAAAMM de `inicio` até `fim` (padrão: mês atual), inclusive."""
+    if fim is None:
+        fim = date.today().strftime("%Y%m")
+    ano, mes = int(inicio[:4]), int(inicio[4:])
+    resultado = []
+    while f"{ano:04d}{mes:02d}" <= fim:
+        resultado.append(f"{ano:04d}{mes:02d}")
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return resultado
+
+
+def url_da_competencia(competencia: str, url_base: str = URL_BASE) -> str:
+    return f"{url_base}BASE_DE_DADOS_CNES_{competencia}.ZIP"
+
+
+def competencias_do_catalogo(
+    pagina: str = PAGINA_ARQUIVOS,
+    *,
+    tls: Optional[TLSOptions] = None,
+    proxy: Optional[ProxyOptions] = None,
+    ttl: float = DEFAULT_TTL,
+) -> List[str]:
+    """
+    Todas as competências (AAAAMM) publicadas em `pagina`, via `discover_catalog`.
+    Com `backfill(..., somente_faltantes=True)`, baixa tudo o que falta localmente.
+    """
+    entries = discover_catalog(
+        pagina, opener=CnesDownloader.session(tls or TLSOptions(), proxy), ttl=ttl
+    )
+    return sorted({e.competencia for e in entries}, reverse=True)
+
+
+def competencia_presente(raiz: Union[str, Path], competencia: str) -> bool:
+    return (Path(raiz) / competencia / MARCA_CONCLUIDO).exists()
+
+
+def _processar(
+    url: str,
+    competencia: str,
+    raiz: Path,
+    *,
+    tls: TLSOptions,
+    proxy: Optional[ProxyOptions],
+    cache: DownloadCache,
+    connection_slots: threading.Semaphore,
+    bandwidth: Optional[BandwidthLimiter],
+    segments: int,
+    extract_workers: int,
+    manifest: Optional[MemberManifest] = None,
+) -> BackfillResult:
+    zip_path = raiz / "zips" / f"BASE_DE_DADOS_CNES_{competencia}.ZIP"
+    pasta = raiz / competencia
+    arq, sha256 = CnesDownloader.download_with_resume(
+        url,
+        zip_path,
+        tls=tls,
+        proxy=proxy,
+        cache=cache,
+        connection_slots=connection_slots,
+        bandwidth=bandwidth,
+        segments=segments,
+    )
+    check_zip_structure(arq)
+    extract_zip(arq, pasta, workers=extract_workers, manifest=manifest)
+    (pasta / MARCA_CONCLUIDO).write_text(
+        json.dumps({"url": url, "sha256": sha256}), encoding="utf-8"
+    )
+    return BackfillResult(competencia, "ok", sha256)
+
+
+def backfill(
+    urls: Iterable[str],
+    raiz: Union[str, Path],
+    *,
+    somente_faltantes: bool = True,
+    max_connections: int = 8,
+    max_bytes_per_second: Optional[float] = None,
+    segments: int = 2,
+    extract_workers: int = 1,
+    deduplicar: bool = False,
+    tls: Optional[TLSOptions] = None,
+    proxy: Optional[ProxyOptions] = None,
+) -> List[BackfillResult]:
+    """
+    Baixa, verifica e extrai várias competências ao mesmo tempo em `<raiz>/<AAAAMM>`.
+
+    - `max_connections`: teto global de requisições simultâneas (todas as
+      competências e segmentos compartilham o mesmo semáforo).
+    - `max_bytes_per_second`: teto global de banda (token bucket compartilhado).
+    - Competências mais recentes entram primeiro na fila.
+    - Com `somente_faltantes`, pula as que já têm a marca de conclusão.
+    - Com `deduplicar`, membros iguais (CRC-32 e tamanho no diretório central)
+      aos de uma competência já extraída viram hardlink da cópia anterior
+      (manifesto em `<raiz>/_membros.json`).
+    Falhas de uma competência não interrompem as demais.
+    """
+    raiz = Path(raiz)
+    raiz.mkdir(parents=True, exist_ok=True)
+    tls = tls or TLSOptions()
+    cache = DownloadCache(raiz / ".cache")
+    slots = threading.BoundedSemaphore(max_connections)
+    bandwidth = BandwidthLimiter(max_bytes_per_second) if max_bytes_per_second else None
+    manifest = MemberManifest(raiz / MANIFESTO_MEMBROS) if deduplicar else None
+
+    pendentes = sorted(
+        ((competencia_da_url(u), u) for u in set(urls)), reverse=True
+    )
+    resultados: List[BackfillResult] = []
+    fila = []
+    for competencia, url in pendentes:
+        if somente_faltantes and competencia_presente(raiz, competencia):
+            resultados.append(BackfillResult(competencia, "presente", str(raiz / competencia)))
+        else:
+            fila.append((competencia, url))
+
+    # Cada job usa até `segments` conexões; mais jobs que isso só esperariam no semáforo
+    max_jobs = max(1, max_connections // max(1, segments))
+    with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+        futures = {
+            pool.submit(
+                _processar,
+                url,
+                competencia,
+                raiz,
+                tls=tls,
+                proxy=proxy,
+                cache=cache,
+                connection_slots=slots,
+                bandwidth=bandwidth,
+                segments=segments,
+                extract_workers=extract_workers,
+                manifest=manifest,
+            ): competencia
+            for competencia, url in fila  # ordem de submissão = prioridade
+        }
+        for fut in as_completed(futures):
+            competencia = futures[fut]
+            try:
+                resultados.append(fut.result())
+                LOGGER.info("Competência %s concluída.", competencia)
+            except Exception as exc:
+                LOGGER.error("Competência %s falhou: %s", competencia, exc)
+                resultados.append(BackfillResult(competencia, "erro", str(exc)))
+
+    resultados.sort(key=lambda r: r.competencia, reverse=True)
+    return resultados
+
+
+# =================== Execução ===================
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Backfill de competências do CNES.")
+    faixa = parser.add_mutually_exclusive_group(required=True)
+    faixa.add_argument("--inicio", help="Primeira competência (AAAAMM).")
+    faixa.add_argument(
+        "--catalogo",
+        nargs="?",
+        const=PAGINA_ARQUIVOS,
+        metavar="PAGINA",
+        help="Todas as competências publicadas no catálogo (padrão: página de arquivos do CNES).",
+    )
+    parser.add_argument("--fim", help="Última competência (AAAAMM); padrão: mês atual.")
+    parser.add_argument("--raiz", default="CNES", help="Pasta de saída.")
+    parser.add_argument(
+        "--todas", action="store_true", help="Reprocessa também as já presentes."
+    )
+    parser.add_argument("--max-conexoes", type=int, default=8)
+    parser.add_argument("--max-mbps", type=float, help="Teto global de banda em MB/s.")
+    parser.add_argument("--segmentos", type=int, default=2)
+    parser.add_argument("--extracao-workers", type=int, default=1)
+    parser.add_argument(
+        "--deduplicar",
+        action="store_true",
+        help="Reaproveita (hardlink) membros iguais aos de competências já extraídas.",
+    )
+    parser.add_argument("--metricas-json", help="Relatório JSON de métricas da execução.")
+    parser.add_argument("--metricas-prom", help="Textfile do Prometheus (node_exporter).")
+    args = parser.parse_args(argv)
+
+    proxy = ProxyOptions.from_env()
+    if args.catalogo:
+        competencias = competencias_do_catalogo(args.catalogo, proxy=proxy)
+    else:
+        competencias = competencias_do_intervalo(args.inicio, args.fim)
+    urls = [url_da_competencia(c) for c in competencias]
+    resultados = backfill(
+        urls,
+        args.raiz,
+        somente_faltantes=not args.todas,
+        max_connections=args.max_conexoes,
+        max_bytes_per_second=args.max_mbps * 1024 * 1024 if args.max_mbps else None,
+        segments=args.segmentos,
+        extract_workers=args.extracao_workers,
+        deduplicar=args.deduplicar,
+        proxy=proxy,
+    )
+    for r in resultados:
+        print(f"{r.competencia}\t{r.status}\t{r.detalhe}")
+    METRICS.export(args.metricas_json, args.metricas_prom)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,674 @@
+# cnes_bench.py
+# -*- coding: utf-8 -*-
+"""
+Benchmark offline do pipeline do CNES contra um servidor HTTPS local que imita o
+EstatisticasServlet: ZIP sintético no formato do CNES (tamanho configurável),
+Range, ETag, limite de banda por conexão, quedas no meio do corpo e rotação do
+certificado (para exercitar falhas de pinning). Mede MB/s, tempo de CPU,
+page faults menores (pressão do alocador: buffers grandes novos a cada chunk
+viram mmap/munmap), handshakes, retries e pico de RSS por fase e grava o
+resultado em JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import http.server
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from cnes_downloader import (
+    BandwidthLimiter,
+    PinMismatch,
+    PinnedSession,
+    check_zip_structure,
+    download_with_resume_pigitnned,
+    extract_zip,
+    head_request,
+    leaf_sha256_hex,
+    open_remote_zip,
+    sha256_file,
+)
+from cnes_metrics import METRICS
+from cnes_streaming import download_and_extract
+
+try:
+    import resource
+except ImportError:  # Windows: sem getrusage (RSS e page faults ficam em 0)
+    resource = None
+
+LOGGER = logging.getLogger("CNES_BENCH")
+
+COMPETENCIA = "209901"
+CAMINHO_ZIP = f"/EstatisticasServlet?path=BASE_DE_DADOS_CNES_{COMPETENCIA}.ZIP"
+
+
+# =================== ZIP sintético ===================
+
+
+# Membros com o formato (nome, separador ";", aspas, latin1) dos arquivos do CNES
+_MEMBROS = (
+    (
+        "tbEstabelecimento",
+        ("CO_UNIDADE", "CO_CNES", "NU_CNPJ_MANTENEDORA", "NO_RAZAO_SOCIAL",
+         "NO_FANTASIA", "CO_MUNICIPIO_GESTOR", "NU_LATITUDE", "NU_LONGITUDE",
+         "TO_CHAR(DT_ATUALIZACAO,'DD/MM/YYYY')"),
+        0.6,
+    ),
+    (
+        "rlEstabProfissional",
+        ("CO_UNIDADE", "CO_PROFISSIONAL_SUS", "CO_CBO", "QT_CARGA_HORARIA_AMBULATORIAL"),
+        0.3,
+    ),
+    ("tbMunicipio", ("CO_MUNICIPIO", "NO_MUNICIPIO", "CO_SIGLA_ESTADO"), 0.1),
+)
+
+_NOMES = ("HOSPITAL", "UNIDADE BASICA", "CLINICA", "POSTO DE SAUDE", "LABORATORIO",
+          "SÃO JOSÉ", "SANTA LÚCIA", "CORAÇÃO DE JESUS", "MUNICIPAL", "REGIONAL")
+
+
+def _linha(tabela: str, rng: random.Random) -> str:
+    if tabela == "tbEstabelecimento":
+        nome = f"{rng.choice(_NOMES)} {rng.choice(_NOMES)}"
+        campos = (
+            f"{rng.randrange(10**12, 10**13)}", f"{rng.randrange(10**6, 10**7)}",
+            f"{rng.randrange(10**13, 10**14)}", nome, nome.title(),
+            f"{rng.randrange(110000, 530000)}", f"{rng.uniform(-33, 5):.6f}",
+            f"{rng.uniform(-73, -34):.6f}",
+            f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2000, 2025)}",
+        )
+    elif tabela == "rlEstabProfissional":
+        campos = (
+            f"{rng.randrange(10**12, 10**13)}", f"{rng.randrange(10**14, 10**15)}",
+            f"{rng.randrange(220000, 520000)}", f"{rng.randint(0, 60)}",
+        )
+    else:
+        campos = (f"{rng.randrange(110000, 530000)}", rng.choice(_NOMES), "SP")
+    return ";".join(f'"{c}"' for c in campos) + "\n"
+
+
+def gerar_zip_sintetico(
+    destino: Union[str, Path], tamanho: int, *, seed: int = 2099
+) -> Path:
+    """
+    Gera `BASE_DE_DADOS_CNES_AAAAMM.ZIP` com ~`tamanho` bytes (comprimidos),
+    repartidos entre os membros de `_MEMBROS`. Mesma `seed`, mesmo arquivo.
+    """
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    tmp = destino.with_name(destino.name + ".part")
+    with tmp.open("wb") as raw, zipfile.ZipFile(raw, "w", zipfile.ZIP_DEFLATED) as zf:
+        for tabela, colunas, fracao in _MEMBROS:
+            alvo = raw.tell() + int(tamanho * fracao)
+            with zf.open(f"{tabela}{COMPETENCIA}.csv", "w", force_zip64=True) as membro:
+                membro.write((";".join(f'"{c}"' for c in colunas) + "\n").encode("latin1"))
+                while raw.tell() < alvo:
+                    bloco = "".join(_linha(tabela, rng) for _ in range(2000))
+                    membro.write(bloco.encode("latin1"))
+    os.replace(tmp, destino)
+    return destino
+
+
+def gerar_certificado(pasta: Union[str, Path], nome: str = "cert") -> Tuple[Path, Path]:
+    """Certificado autoassinado (CN=localhost) via `openssl`; retorna (cert, key)."""
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+    cert, key = pasta / f"{nome}.pem", pasta / f"{nome}.key"
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        raise RuntimeError("`openssl` não encontrado: informe --cert/--key.")
+    subprocess.run(
+        [openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+         "-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+# =================== Servidor local (stand-in do DATASUS) ===================
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_TLSServer"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        # Uma instância por conexão: o limite de banda vale por conexão
+        bps = self.server.owner.bytes_per_second
+        self._limiter = BandwidthLimiter(bps, burst=64 * 1024) if bps else None
+
+    def do_HEAD(self) -> None:
+        self._responder(corpo=False)
+
+    def do_GET(self) -> None:
+        self._responder(corpo=True)
+
+    def _responder(self, corpo: bool) -> None:
+        owner = self.server.owner
+        owner._contar("requests")
+        if self.path != CAMINHO_ZIP:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        total = owner.payload.stat().st_size
+        if self.headers.get("If-None-Match") == owner.etag:
+            self.send_response(304)
+            self.send_header("ETag", owner.etag)
+            self.end_headers()
+            return
+
+        inicio, fim, status = 0, total - 1, 200
+        faixa = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if faixa and faixa.group(1) + faixa.group(2):
+            if faixa.group(1):
+                inicio = int(faixa.group(1))
+                fim = min(int(faixa.group(2)), total - 1) if faixa.group(2) else total - 1
+            else:
+                inicio = max(0, total - int(faixa.group(2)))
+            if inicio >= total or inicio > fim:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{total}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {inicio}-{fim}/{total}")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(fim - inicio + 1))
+        self.send_header("ETag", owner.etag)
+        self.send_header("Last-Modified", self.date_time_string(owner.payload.stat().st_mtime))
+        self.end_headers()
+        if not corpo:
+            return
+
+        corte = owner._reservar_corte()
+        enviado = 0
+        with owner.payload.open("rb") as f:
+            f.seek(inicio)
+            restante = fim - inicio + 1
+            while restante > 0:
+                bloco = f.read(min(64 * 1024, restante))
+                if corte is not None and enviado + len(bloco) >= corte:
+                    # Queda no meio do corpo: envia parte e derruba a conexão
+                    self.wfile.write(bloco[: corte - enviado])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if self._limiter is not None:
+                    self._limiter.consume(len(bloco))
+                self.wfile.write(bloco)
+                enviado += len(bloco)
+                restante -= len(bloco)
+        owner._contar("bytes_sent", enviado)
+
+
+class _TLSServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, owner: "StandInServer", address: Tuple[str, int]) -> None:
+        self.owner = owner
+        super().__init__(address, _Handler)
+
+    def finish_request(self, sock, client_address) -> None:
+        # Handshake na thread da conexão, com o certificado vigente no momento
+        try:
+            tls = self.owner._context.wrap_socket(sock, server_side=True)
+        except (ssl.SSLError, OSError):
+            sock.close()
+            return
+        self.owner._contar("tls_connections")
+        if tls.session_reused:
+            self.owner._contar("tls_resumed")
+        try:
+            super().finish_request(tls, client_address)
+        finally:
+            tls.close()
+
+    def shutdown_request(self, request) -> None:
+        with contextlib.suppress(OSError):
+            request.close()
+
+
+class StandInServer:
+    """
+    Servidor HTTPS local que serve `payload` em `CAMINHO_ZIP`, como o DATASUS.
+
+    - `bytes_per_second`: limite de banda por conexão.
+    - `drop_after`/`drops`: as próximas `drops` respostas GET são cortadas após
+      `drop_after` bytes do corpo (conexão derrubada); ajustável em execução.
+    - `rotate_certificate()`: passa ao próximo par (cert, key) de `certificates`;
+      conexões novas recebem o novo leaf, o que quebra pins antigos.
+    `counters` acumula requests, conexões TLS, retomadas de sessão, quedas e bytes.
+    """
+
+    def __init__(
+        self,
+        payload: Union[str, Path],
+        certificates: Sequence[Tuple[Union[str, Path], Union[str, Path]]],
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        bytes_per_second: Optional[float] = None,
+        drop_after: Optional[int] = None,
+        drops: int = 0,
+    ) -> None:
+        self.host = host
+        self.payload = Path(payload)
+        st = self.payload.stat()
+        self.etag = f'"{st.st_size:x}-{int(st.st_mtime):x}"'
+        self.certificates = list(certificates)
+        self.bytes_per_second = bytes_per_second
+        self.drop_after = drop_after
+        self.drops = drops
+        self.counters: Dict[str, int] = dict.fromkeys(
+            ("requests", "tls_connections", "tls_resumed", "drops", "bytes_sent"), 0
+        )
+        self._lock = threading.Lock()
+        self._cert_index = 0
+        self._context = self._make_context()
+        self._httpd = _TLSServer(self, (host, port))
+        self._thread: Optional[threading.Thread] = None
+
+    def _make_context(self) -> ssl.SSLContext:
+        cert, key = self.certificates[self._cert_index]
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(str(cert), str(key))
+        return ctx
+
+    def _contar(self, nome: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[nome] += n
+
+    def _reservar_corte(self) -> Optional[int]:
+        with self._lock:
+            if self.drops > 0 and self.drop_after is not None:
+                self.drops -= 1
+                self.counters["drops"] += 1
+                return self.drop_after
+        return None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"https://{self.host}:{self.port}{CAMINHO_ZIP}"
+
+    def rotate_certificate(self) -> None:
+        self._cert_index = (self._cert_index + 1) % len(self.certificates)
+        self._context = self._make_context()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            for nome in self.counters:
+                self.counters[nome] = 0
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+# =================== Medição por fase ===================
+
+
+class PhaseResult(NamedTuple):
+    phase: str
+    ok: bool
+    seconds: float
+    bytes: int
+    mb_per_s: float
+    handshakes: int
+    retries: int
+    requests: int
+    peak_rss_bytes: int
+    cpu_seconds: float
+    minor_faults: int
+    detail: str
+
+
+def _retries_total() -> int:
+    """Soma de `cnes_retries_total` (todas as fases) no registro do processo."""
+    series = METRICS.snapshot()["counters"].get("cnes_retries_total", [])
+    return int(sum(s["value"] for s in series))
+
+
+def _uso() -> Tuple[float, int]:
+    """(CPU do processo em segundos, page faults menores); sem `resource`, faults = 0."""
+    if resource is None:
+        t = os.times()
+        return t.user + t.system, 0
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return uso.ru_utime + uso.ru_stime, uso.ru_minflt
+
+
+def _reset_peak_rss() -> bool:
+    """Zera o pico de RSS do processo (Linux >= 4.0); False se não suportado."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss(resetado: bool) -> int:
+    if resetado:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) * 1024
+    if resource is None:
+        return 0
+    # Sem reset, é o pico desde o início do processo (ru_maxrss em KiB no Linux)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+@contextlib.contextmanager
+def _medir(
+    nome: str,
+    resultados: List[PhaseResult],
+    server: StandInServer,
+    *,
+    session: Optional[PinnedSession] = None,
+) -> Iterator[Dict[str, object]]:
+    """
+    Mede a fase `nome` e anexa um `PhaseResult` a `resultados`. O bloco preenche
+    `info["bytes"]` (e, se quiser, `info["detail"]`); exceções viram `ok=False`.
+    """
+    info: Dict[str, object] = {"bytes": 0, "detail": "", "handshakes": 0}
+    retries_antes = _retries_total()
+    server.reset_counters()
+    handshakes_antes = session.handshakes if session is not None else 0
+    resetado = _reset_peak_rss()
+    # CPU do processo inteiro (as threads do servidor local entram na conta)
+    cpu_antes, faults_antes = _uso()
+    ok = True
+    inicio = time.perf_counter()
+    try:
+        yield info
+    except Exception as exc:
+        ok = False
+        info["detail"] = f"{type(exc).__name__}: {exc}"
+    finally:
+        segundos = time.perf_counter() - inicio
+        cpu, faults = _uso()
+    handshakes = (
+        session.handshakes - handshakes_antes if session is not None else int(info["handshakes"])
+    )
+    n = int(info["bytes"])
+    resultados.append(
+        PhaseResult(
+            phase=nome,
+            ok=ok,
+            seconds=round(segundos, 4),
+            bytes=n,
+            mb_per_s=round(n / segundos / 1e6, 3) if segundos > 0 else 0.0,
+            handshakes=handshakes,
+            retries=_retries_total() - retries_antes,
+            requests=server.counters["requests"],
+            peak_rss_bytes=_peak_rss(resetado),
+            cpu_seconds=round(cpu - cpu_antes, 4),
+            minor_faults=faults - faults_antes,
+            detail=str(info["detail"]),
+        )
+    )
+    LOGGER.info("Fase %s: %s", nome, resultados[-1])
+
+
+# =================== Fases ===================
+
+
+def run_benchmark(
+    workdir: Union[str, Path],
+    *,
+    size: int = 50 * 1024 * 1024,
+    segments: int = 4,
+    bytes_per_second: Optional[float] = None,
+    drop_after: int = 256 * 1024,
+    drops: int = 2,
+    extract_workers: int = 1,
+    certificates: Optional[Sequence[Tuple[Union[str, Path], Union[str, Path]]]] = None,
+) -> Dict[str, object]:
+    """
+    Executa as fases contra o servidor local e devolve o relatório (dict JSON):
+
+    - download: `download_with_resume_pigitnned` com pin, `segments` faixas;
+    - download_interrompido: fluxo único com `drops` quedas de conexão;
+    - sha256_file, check_zip_structure, extract_zip: sobre o ZIP baixado;
+    - download_extract_streaming: download com extração em paralelo
+      (`download_and_extract`); comparar com download + extract_zip;
+    - remote_zip: leitura do CSV de estabelecimentos direto do ZIP remoto
+      (`open_remote_zip`, caminho do `SalvarZipURLCNES`);
+    - pin_rotacionado: após a rotação do certificado, o pin antigo deve falhar.
+    """
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    payload = workdir / f"BASE_DE_DADOS_CNES_{COMPETENCIA}.ZIP"
+    if not payload.exists() or abs(payload.stat().st_size - size) > size * 0.1 + 1024 * 1024:
+        LOGGER.info("Gerando ZIP sintético de ~%s bytes em %s", size, payload)
+        gerar_zip_sintetico(payload, size)
+    if certificates is None:
+        certificates = [gerar_certificado(workdir, "cert_a"), gerar_certificado(workdir, "cert_b")]
+
+    resultados: List[PhaseResult] = []
+    saida = workdir / "saida"
+    shutil.rmtree(saida, ignore_errors=True)
+    baixado = saida / payload.name
+
+    with StandInServer(payload, certificates, bytes_per_second=bytes_per_second) as server:
+        pin = leaf_sha256_hex(server.host, server.port)
+
+        session = PinnedSession(pin)
+        with _medir("download", resultados, server, session=session) as info:
+            res_download = download_with_resume_pigitnned(
+                server.url, baixado, opener=session, segments=segments, backoff_factor=0.05
+            )
+            info["bytes"] = res_download.path.stat().st_size
+            info["detail"] = res_download.sha256
+        session.close()
+
+        interrompido = saida / "interrompido" / payload.name
+        server.drop_after, server.drops = drop_after, drops
+        session = PinnedSession(pin)
+        with _medir("download_interrompido", resultados, server, session=session) as info:
+            res = download_with_resume_pigitnned(
+                server.url, interrompido, opener=session, segments=1, backoff_factor=0.05
+            )
+            info["bytes"] = res.path.stat().st_size
+        session.close()
+        server.drops = 0
+
+        with _medir("sha256_file", resultados, server) as info:
+            info["detail"] = sha256_file(baixado)
+            info["bytes"] = baixado.stat().st_size
+
+        with _medir("check_zip_structure", resultados, server) as info:
+            info["detail"] = f"{check_zip_structure(baixado)} membros"
+            info["bytes"] = baixado.stat().st_size
+
+        with _medir("extract_zip", resultados, server) as info:
+            pasta = extract_zip(baixado, saida / "csv", workers=extract_workers)
+            info["bytes"] = sum(p.stat().st_size for p in pasta.iterdir() if p.is_file())
+
+        session = PinnedSession(pin)
+        with _medir("download_extract_streaming", resultados, server, session=session) as info:
+            rep = download_and_extract(
+                server.url,
+                saida / "streaming" / payload.name,
+                saida / "streaming" / "csv",
+                opener=session,
+                segments=segments,
+                backoff_factor=0.05,
+            )
+            info["bytes"] = rep.download.path.stat().st_size
+            info["detail"] = (
+                f"{len(rep.streamed)} membro(s) no streaming, {len(rep.fallback)} pelo diretório central"
+            )
+            if rep.failed or rep.download.sha256 != res_download.sha256:
+                raise AssertionError(f"extração em streaming divergente: {rep.failed}")
+        session.close()
+
+        with _medir("remote_zip", resultados, server) as info:
+            with open_remote_zip(server.url, pin_hex=pin) as zf:
+                nome = next(n for n in zf.namelist() if n.startswith("tbEstabelecimento"))
+                with zf.open(nome) as src, (saida / f"remoto_{nome}").open("wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                info["bytes"] = zf.fp.bytes_fetched
+                info["handshakes"] = server.counters["tls_connections"]
+
+        server.rotate_certificate()
+        session = PinnedSession(pin)
+        with _medir("pin_rotacionado", resultados, server, session=session) as info:
+            try:
+                head_request(server.url, session)
+            except PinMismatch as exc:
+                info["detail"] = f"rejeitado: {exc}"
+            else:
+                raise AssertionError("pin antigo aceito após a rotação do certificado")
+        session.close()
+
+    return {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "size": payload.stat().st_size,
+            "segments": segments,
+            "bytes_per_second": bytes_per_second,
+            "drop_after": drop_after,
+            "drops": drops,
+            "extract_workers": extract_workers,
+        },
+        "phases": [r._asdict() for r in resultados],
+        "metrics": METRICS.snapshot(),
+    }
+
+
+def compare(
+    atual: Dict[str, object], base: Dict[str, object], tolerancia: float = 0.2
+) -> List[str]:
+    """
+    Regressões de `atual` em relação a `base`: fase que deixou de passar, MB/s
+    abaixo de `(1 - tolerancia)` ou pico de RSS / tempo de CPU acima de
+    `(1 + tolerancia)`. Bases sem `cpu_seconds` (versões antigas) não comparam CPU.
+    """
+    anteriores = {f["phase"]: f for f in base["phases"]}
+    regressoes = []
+    for fase in atual["phases"]:
+        antes = anteriores.get(fase["phase"])
+        if antes is None:
+            continue
+        if antes["ok"] and not fase["ok"]:
+            regressoes.append(f"{fase['phase']}: falhou ({fase['detail']})")
+        if antes["mb_per_s"] and fase["mb_per_s"] < antes["mb_per_s"] * (1 - tolerancia):
+            regressoes.append(
+                f"{fase['phase']}: {fase['mb_per_s']} MB/s (base {antes['mb_per_s']})"
+            )
+        if antes["peak_rss_bytes"] and fase["peak_rss_bytes"] > antes["peak_rss_bytes"] * (1 + tolerancia):
+            regressoes.append(
+                f"{fase['phase']}: RSS {fase['peak_rss_bytes']} (base {antes['peak_rss_bytes']})"
+            )
+        if antes.get("cpu_seconds") and fase["cpu_seconds"] > antes["cpu_seconds"] * (1 + tolerancia):
+            regressoes.append(
+                f"{fase['phase']}: CPU {fase['cpu_seconds']}s (base {antes['cpu_seconds']}s)"
+            )
+    return regressoes
+
+
+# =================== Execução ===================
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline do download/extração do CNES.")
+    parser.add_argument("--dir", help="Pasta de trabalho (padrão: temporária).")
+    parser.add_argument("--tamanho-mb", type=float, default=50, help="Tamanho do ZIP sintético.")
+    parser.add_argument("--segmentos", type=int, default=4)
+    parser.add_argument("--mbps-por-conexao", type=float, help="Limite de banda por conexão (MB/s).")
+    parser.add_argument("--cortar-apos-kb", type=int, default=256, help="Queda após N KiB do corpo.")
+    parser.add_argument("--quedas", type=int, default=2, help="Respostas cortadas na fase interrompida.")
+    parser.add_argument("--extracao-workers", type=int, default=1)
+    parser.add_argument("--cert", action="append", default=[], help="PEM do servidor (2x para rotação).")
+    parser.add_argument("--key", action="append", default=[], help="Chave de cada --cert.")
+    parser.add_argument("--saida", help="Grava o JSON aqui (padrão: stdout).")
+    parser.add_argument("--comparar", help="JSON de referência para detectar regressões.")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    certificados = list(zip(args.cert, args.key)) or None
+    with contextlib.ExitStack() as stack:
+        workdir = args.dir or stack.enter_context(tempfile.TemporaryDirectory(prefix="cnes_bench_"))
+        relatorio = run_benchmark(
+            workdir,
+            size=int(args.tamanho_mb * 1024 * 1024),
+            segments=args.segmentos,
+            bytes_per_second=args.mbps_por_conexao * 1024 * 1024 if args.mbps_por_conexao else None,
+            drop_after=args.cortar_apos_kb * 1024,
+            drops=args.quedas,
+            extract_workers=args.extracao_workers,
+            certificates=certificados,
+        )
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        Path(args.saida).write_text(texto, encoding="utf-8")
+    else:
+        print(texto)
+
+    falhas = [f["phase"] for f in relatorio["phases"] if not f["ok"]]
+    regressoes = []
+    if args.comparar:
+        base = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+        regressoes = compare(relatorio, base, args.tolerancia)
+    for linha in [f"{f}: falhou" for f in falhas] + regressoes:
+        LOGGER.error("Regressão: %s", linha)
+    return 1 if falhas or regressoes else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
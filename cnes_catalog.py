@@ -0,0 +1,236 @@
+# cnes_catalog.py
+# -*- coding: utf-8 -*-
+"""
+Descoberta das competências publicadas do CNES. A página é lida em streaming e
+varrida por partes com padrões pré-compilados, nos dois formatos conhecidos:
+`arquivos.push({...});` (script da página de arquivos) e
+`href="/EstatisticasServlet?path=BASE_DE_DADOS_CNES_AAAAMM.ZIP"` (dropdown).
+A leitura para assim que a listagem termina, as falhas de rede têm backoff
+exponencial limitado e o resultado fica memorizado em disco por um TTL, de modo
+que execuções seguidas não buscam a página de novo.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+from urllib import request
+from urllib.parse import urljoin
+
+from cnes_downloader import CnesDownloader, TLSOptions, is_retryable
+from cnes_metrics import METRICS
+
+LOGGER = logging.getLogger("CNES_CATALOG")
+
+DEFAULT_TTL = float(os.environ.get("CNES_CATALOG_TTL", 6 * 3600))
+
+_PUSH_RE = re.compile(rb"arquivos\.push\((\{.*?\})\);", re.DOTALL)
+_HREF_RE = re.compile(rb'href="(/EstatisticasServlet\?path=BASE_DE_DADOS_CNES_(\d{6})\.ZIP)"')
+# Onde cada listagem termina: o script do `arquivos.push` / a lista do dropdown
+_END_RE = {"push": re.compile(rb"</script>", re.IGNORECASE), "href": re.compile(rb"</(?:ul|select)>", re.IGNORECASE)}
+# Bytes não varridos guardados entre chunks: maior que qualquer item da listagem
+_OVERLAP = 4096
+
+
+class CatalogEntry(NamedTuple):
+    """Um arquivo publicado: competência (AAAAMM), URL completa e nome/origem."""
+
+    competencia: str
+    url: str
+    nome: str
+
+
+# =================== Varredura ===================
+
+
+class CatalogScanner:
+    """
+    Varredura incremental: `feed(chunk)` devolve True quando a listagem terminou
+    (houve itens e apareceu o fechamento do bloco depois do último). Só os bytes
+    após o último item (no máximo `_OVERLAP`) ficam guardados entre chunks.
+
+    - `arquivos.push`: URL = `base_url + ano + mes + "_" + origem` (como na página).
+    - `href`: URL = `urljoin(base_url, caminho)`.
+    """
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        self.entries: List[CatalogEntry] = []
+        self.format: Optional[str] = None
+        self._buf = b""
+
+    def _push(self, raw: bytes) -> None:
+        try:
+            obj = json.loads(raw.decode("latin1"))
+            competencia = f"{obj['ano']}{obj['mes']}"
+            origem = obj["origem"]
+        except (ValueError, KeyError, TypeError) as exc:
+            LOGGER.debug("arquivos.push ignorado (%s): %r", exc, raw[:200])
+            return
+        self.entries.append(CatalogEntry(competencia, f"{self.base_url}{competencia}_{origem}", origem))
+
+    def _href(self, path: bytes, competencia: bytes) -> None:
+        caminho = path.decode("latin1")
+        self.entries.append(
+            CatalogEntry(competencia.decode("ascii"), urljoin(self.base_url, caminho), caminho.rsplit("=", 1)[-1])
+        )
+
+    def feed(self, chunk: bytes) -> bool:
+        buf = self._buf + chunk
+        fim = 0
+        if self.format != "href":
+            for m in _PUSH_RE.finditer(buf):
+                self._push(m.group(1))
+                self.format, fim = "push", m.end()
+        if self.format != "push":
+            for m in _HREF_RE.finditer(buf, fim):
+                self._href(m.group(1), m.group(2))
+                self.format, fim = "href", m.end()
+        if self.format and _END_RE[self.format].search(buf, fim):
+            self._buf = b""
+            return True
+        self._buf = buf[max(fim, len(buf) - _OVERLAP):]
+        return False
+
+    def close(self) -> List[CatalogEntry]:
+        """Itens únicos, da competência mais recente para a mais antiga."""
+        vistos = set()
+        unicos = []
+        for e in self.entries:
+            if e.url not in vistos:
+                vistos.add(e.url)
+                unicos.append(e)
+        return sorted(unicos, key=lambda e: e.competencia, reverse=True)
+
+
+def parse_catalog(html: Union[str, bytes], base_url: str) -> List[CatalogEntry]:
+    """Itens da listagem de uma página já carregada (mesma varredura do streaming)."""
+    scanner = CatalogScanner(base_url)
+    scanner.feed(html.encode("latin1", "replace") if isinstance(html, str) else html)
+    return scanner.close()
+
+
+def latest(entries: List[CatalogEntry]) -> List[CatalogEntry]:
+    """Só os itens da competência mais recente."""
+    if not entries:
+        return []
+    topo = max(e.competencia for e in entries)
+    return [e for e in entries if e.competencia == topo]
+
+
+# =================== Memo em disco ===================
+
+
+class CatalogMemo:
+    """Listagens já lidas, por URL, em `<root>/catalog.json`; valem por `ttl` segundos."""
+
+    def __init__(self, root: Union[str, Path], ttl: float = DEFAULT_TTL) -> None:
+        self.path = Path(root) / "catalog.json"
+        self.ttl = ttl
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, url: str) -> Optional[List[CatalogEntry]]:
+        item = self._load().get(url)
+        if item is None or time.time() - item["fetched"] > self.ttl:
+            return None
+        return [CatalogEntry(*e) for e in item["entries"]]
+
+    def put(self, url: str, entries: List[CatalogEntry]) -> None:
+        dados = self._load()
+        dados[url] = {"fetched": time.time(), "entries": [list(e) for e in entries]}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.part")
+        tmp.write_text(json.dumps(dados, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+# =================== Busca ===================
+
+
+def _scan_remote(url: str, base_url: str, opener, chunk_size: int, early_exit: bool) -> List[CatalogEntry]:
+    scanner = CatalogScanner(base_url)
+    req = request.Request(url, headers={"Accept-Encoding": "identity"})
+    lidos = 0
+    with opener.open(req, timeout=30) as resp:
+        while True:
+            chunk = resp.read(chunk_size)
+            if not chunk:
+                break
+            lidos += len(chunk)
+            METRICS.inc("cnes_bytes_total", len(chunk), phase="catalog")
+            if scanner.feed(chunk) and early_exit:
+                LOGGER.debug("Listagem completa após %s bytes; leitura interrompida.", lidos)
+                break
+    return scanner.close()
+
+
+def discover_catalog(
+    url: str,
+    *,
+    base_url: Optional[str] = None,
+    opener=None,
+    ttl: float = DEFAULT_TTL,
+    cache_dir: Optional[Union[str, Path]] = None,
+    max_retries: int = 6,
+    backoff_factor: float = 1.0,
+    max_backoff: float = 30.0,
+    chunk_size: int = 16 * 1024,
+    early_exit: bool = True,
+) -> List[CatalogEntry]:
+    """
+    Competências publicadas em `url` (da mais recente para a mais antiga).
+
+    - `base_url`: prefixo das URLs montadas (padrão: a própria `url`).
+    - `opener`: sessão HTTP (padrão: `CnesDownloader.session(TLSOptions())`).
+    - Memo em `cache_dir` (padrão: `CNES_CACHE_DIR` ou `.cnes_cache`) por `ttl`
+      segundos; `ttl=0` sempre busca.
+    - Falhas transitórias: até `max_retries` novas tentativas, esperando
+      `backoff_factor * 2**(n-1)` segundos, no máximo `max_backoff`. Erros 4xx e
+      de confiança (pin/cadeia) propagam na hora.
+    Levanta `ValueError` se a página não tiver nenhum item.
+    """
+    base_url = base_url or url
+    memo = CatalogMemo(cache_dir or os.environ.get("CNES_CACHE_DIR", ".cnes_cache"), ttl) if ttl > 0 else None
+    chave = f"{url} {base_url}"
+    if memo is not None:
+        entries = memo.get(chave)
+        if entries is not None:
+            METRICS.inc("cnes_catalog_requests_total", result="memo")
+            LOGGER.info("Catálogo de %s lido do memo (%s itens).", url, len(entries))
+            return entries
+
+    opener = opener or CnesDownloader.session(TLSOptions())
+    attempt = 0
+    with METRICS.phase("catalog", label="Catálogo"):
+        while True:
+            try:
+                entries = _scan_remote(url, base_url, opener, chunk_size, early_exit)
+                break
+            except Exception as exc:
+                attempt += 1
+                if not is_retryable(exc) or attempt > max_retries:
+                    raise
+                sleep_for = min(max_backoff, backoff_factor * 2 ** (attempt - 1))
+                METRICS.retry("catalog", sleep_for)
+                LOGGER.warning(
+                    "Falha ao ler o catálogo (%s). Tentativa %s/%s em %.1fs.", exc, attempt, max_retries, sleep_for
+                )
+                time.sleep(sleep_for)
+    METRICS.inc("cnes_catalog_requests_total", result="fetch")
+
+    if not entries:
+        raise ValueError(f"Nenhum arquivo do CNES encontrado em {url}")
+    if memo is not None:
+        memo.put(chave, entries)
+    LOGGER.info("Catálogo de %s: %s itens, mais recente %s.", url, len(entries), entries[0].competencia)
+    return entries
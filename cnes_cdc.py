@@ -0,0 +1,330 @@
+# cnes_cdc.py
+# -*- coding: utf-8 -*-
+"""
+Captura de mudanças (CDC) entre duas competências de uma tabela do CNES
+(padrão: `tbEstabelecimento`). Os dois membros CSV são lidos em streaming do
+ZIP, cada linha é identificada pela chave (CO_UNIDADE) e resumida por um hash do
+conteúdo; a saída é um delta compacto (CSV gzip) só com as linhas incluídas (I),
+alteradas (U) e excluídas (D). Se a competência anterior não couber no limite de
+memória, as duas entradas são espalhadas em partições por hash da chave em disco
+e comparadas partição a partição.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple, Union
+
+from cnes_metrics import METRICS
+from cnes_parquet import CSV_DELIMITER, CSV_ENCODING, normalize_column_name, table_name
+
+LOGGER = logging.getLogger("CNES_CDC")
+
+DEFAULT_TABLE = "tbEstabelecimento"
+# Chaves candidatas, em ordem de preferência (a primeira presente no cabeçalho vale)
+DEFAULT_KEYS: Tuple[Tuple[str, ...], ...] = (("CO_UNIDADE",), ("CO_CNES",))
+OP_COLUMN = "CDC_OP"
+INSERT, UPDATE, DELETE = "I", "U", "D"
+
+_SEP = "\x1f"  # separador de campos no hash e nas chaves (não aparece nos CSVs do CNES)
+
+
+class DeltaReport(NamedTuple):
+    """Resumo de um delta: contagens por operação e como a comparação foi feita."""
+
+    path: Path
+    table: str
+    key: Tuple[str, ...]
+    inserted: int
+    updated: int
+    deleted: int
+    unchanged: int
+    partitions: int  # 1 = tudo em memória
+
+
+# =================== Leitura ===================
+
+
+def find_member(zf: zipfile.ZipFile, table: str) -> str:
+    """Nome do membro `<table>AAAAMM.csv` dentro do ZIP."""
+    for name in zf.namelist():
+        if name.lower().endswith(".csv") and table_name(name).lower() == table.lower():
+            return name
+    raise FileNotFoundError(f"{table} não encontrado em {zf.filename}")
+
+
+def _read_rows(zf: zipfile.ZipFile, member: str) -> Tuple[List[str], Iterator[List[str]]]:
+    raw = zf.open(member)
+    text = io.TextIOWrapper(raw, encoding=CSV_ENCODING, newline="")
+    reader = csv.reader(text, delimiter=CSV_DELIMITER)
+    header = [normalize_column_name(c) for c in next(reader, [])]
+
+    def rows() -> Iterator[List[str]]:
+        with text:
+            for row in reader:
+                if row:
+                    yield row
+
+    return header, rows()
+
+
+def resolve_key(header: Sequence[str], key: Optional[Sequence[str]] = None) -> Tuple[str, ...]:
+    """Colunas da chave: `key` se informada; senão a primeira de `DEFAULT_KEYS` presente."""
+    candidatas = [tuple(key)] if key else list(DEFAULT_KEYS)
+    for cand in candidatas:
+        if all(c in header for c in cand):
+            return cand
+    raise KeyError(f"Chave {' / '.join(map('+'.join, candidatas))} ausente do cabeçalho.")
+
+
+class _Projection:
+    """
+    Alinha as linhas de um lado ao cabeçalho da competência nova: coluna nova
+    ausente na anterior vira "", coluna removida é ignorada. Assim uma mudança de
+    layout não marca todas as linhas como alteradas.
+    """
+
+    def __init__(self, header: Sequence[str], target: Sequence[str], key: Sequence[str]) -> None:
+        pos = {c: i for i, c in enumerate(header)}
+        self.index = [pos.get(c) for c in target]
+        self.key_index = [pos[c] for c in key]
+
+    def key(self, row: Sequence[str]) -> str:
+        return _SEP.join(row[i].strip() if i < len(row) else "" for i in self.key_index)
+
+    def values(self, row: Sequence[str]) -> List[str]:
+        n = len(row)
+        return [row[i] if i is not None and i < n else "" for i in self.index]
+
+
+def row_digest(values: Sequence[str]) -> bytes:
+    """Hash (BLAKE2b de 128 bits) do conteúdo de uma linha já projetada."""
+    return hashlib.blake2b(_SEP.join(values).encode("utf-8"), digest_size=16).digest()
+
+
+# =================== Partições em disco ===================
+
+
+def _partition(key: str, partitions: int) -> int:
+    return zlib.crc32(key.encode("utf-8")) % partitions
+
+
+class _Spill:
+    """
+    `partitions` arquivos temporários por lado. O lado anterior grava só
+    `chave<US>hash`; o novo grava a linha projetada inteira (é o que vai ao delta).
+    """
+
+    def __init__(self, root: Path, side: str, partitions: int) -> None:
+        self.paths = [root / f"{side}-{i:04d}.csv" for i in range(partitions)]
+        self._files: List[TextIO] = [
+            p.open("w", encoding="utf-8", newline="") for p in self.paths
+        ]
+        self._writers = [csv.writer(f, delimiter=_SEP, quoting=csv.QUOTE_MINIMAL) for f in self._files]
+        self.partitions = partitions
+
+    def write(self, key: str, fields: Sequence[str]) -> None:
+        self._writers[_partition(key, self.partitions)].writerow(fields)
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+    def read(self, i: int) -> Iterator[List[str]]:
+        with self.paths[i].open("r", encoding="utf-8", newline="") as f:
+            yield from csv.reader(f, delimiter=_SEP)
+        self.paths[i].unlink()
+
+
+# =================== Comparação ===================
+
+
+class _DeltaWriter:
+    def __init__(self, out: TextIO, header: Sequence[str], proj_key: Sequence[int]) -> None:
+        self._writer = csv.writer(out, delimiter=CSV_DELIMITER)
+        self._writer.writerow([OP_COLUMN, *header])
+        self._width = len(header)
+        self._key_index = list(proj_key)
+        self.counts = {INSERT: 0, UPDATE: 0, DELETE: 0}
+
+    def row(self, op: str, values: Sequence[str]) -> None:
+        self._writer.writerow([op, *values])
+        self.counts[op] += 1
+
+    def delete(self, key: str) -> None:
+        # exclusão leva só a chave: as demais colunas ficam vazias
+        values = [""] * self._width
+        for i, v in zip(self._key_index, key.split(_SEP)):
+            values[i] = v
+        self.row(DELETE, values)
+
+
+def _diff(
+    anteriores: Dict[str, bytes],
+    novas: Iterator[Tuple[str, List[str]]],
+    delta: _DeltaWriter,
+) -> int:
+    """Compara um lado novo em streaming com o mapa chave → hash do anterior; consome o mapa."""
+    iguais = 0
+    for key, values in novas:
+        antigo = anteriores.pop(key, None)
+        if antigo is None:
+            delta.row(INSERT, values)
+        elif antigo != row_digest(values):
+            delta.row(UPDATE, values)
+        else:
+            iguais += 1
+    for key in anteriores:
+        delta.delete(key)
+    anteriores.clear()
+    return iguais
+
+
+def diff_members(
+    zf_anterior: zipfile.ZipFile,
+    zf_atual: zipfile.ZipFile,
+    destino: Union[str, Path],
+    *,
+    table: str = DEFAULT_TABLE,
+    key: Optional[Sequence[str]] = None,
+    max_rows_in_memory: int = 2_000_000,
+    partitions: int = 64,
+    tmp_dir: Optional[Union[str, Path]] = None,
+) -> DeltaReport:
+    """
+    Gera em `destino` (CSV gzip, latin1, `;`) o delta de `table` entre duas
+    competências. Colunas: `CDC_OP` (I/U/D) + cabeçalho da competência atual.
+    I e U levam a linha nova inteira; D leva só a chave.
+
+    A competência anterior vira um mapa chave → hash em memória; passando de
+    `max_rows_in_memory` linhas, as duas entradas são espalhadas em `partitions`
+    arquivos por hash da chave (em `tmp_dir`) e cada par é comparado sozinho.
+    Chave repetida: na anterior vale a última ocorrência; na atual, cada uma vai ao delta.
+    O arquivo é escrito em `<destino>.part` e publicado por rename atômico.
+    """
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    header_ant, linhas_ant = _read_rows(zf_anterior, find_member(zf_anterior, table))
+    header, linhas = _read_rows(zf_atual, find_member(zf_atual, table))
+    chave = resolve_key(header, key)
+    resolve_key(header_ant, chave)
+    p_ant = _Projection(header_ant, header, chave)
+    p_atual = _Projection(header, header, chave)
+
+    tmp = destino.with_name(destino.name + ".part")
+    with tempfile.TemporaryDirectory(prefix="cnes-cdc-", dir=tmp_dir) as spill_dir, \
+            METRICS.phase("cdc", label="Comparando"):
+        try:
+            with gzip.open(tmp, "wt", encoding=CSV_ENCODING, newline="") as out:
+                delta = _DeltaWriter(out, header, p_atual.key_index)
+                anteriores: Dict[str, bytes] = {}
+                spill_ant: Optional[_Spill] = None
+                for row in linhas_ant:
+                    k = p_ant.key(row)
+                    h = row_digest(p_ant.values(row))
+                    if spill_ant is None:
+                        anteriores[k] = h
+                        if len(anteriores) > max_rows_in_memory:
+                            LOGGER.info(
+                                "%s: mais de %s linhas; comparando em %s partições em disco.",
+                                table, max_rows_in_memory, partitions,
+                            )
+                            spill_ant = _Spill(Path(spill_dir), "anterior", partitions)
+                            for k2, h2 in anteriores.items():
+                                spill_ant.write(k2, (k2, h2.hex()))
+                            anteriores.clear()
+                    else:
+                        spill_ant.write(k, (k, h.hex()))
+                    METRICS.inc("cnes_cdc_rows_total", side="anterior")
+
+                def novas(rows: Iterator[List[str]]) -> Iterator[Tuple[str, List[str]]]:
+                    for row in rows:
+                        METRICS.inc("cnes_cdc_rows_total", side="atual")
+                        yield p_atual.key(row), p_atual.values(row)
+
+                if spill_ant is None:
+                    n_partes = 1
+                    iguais = _diff(anteriores, novas(linhas), delta)
+                else:
+                    n_partes = partitions
+                    spill_ant.close()
+                    spill_novo = _Spill(Path(spill_dir), "atual", partitions)
+                    for k, values in novas(linhas):
+                        spill_novo.write(k, values)
+                    spill_novo.close()
+                    iguais = 0
+                    for i in range(partitions):
+                        anteriores = {k: bytes.fromhex(h) for k, h in spill_ant.read(i)}
+                        parte = ((p_atual.key(v), v) for v in spill_novo.read(i))
+                        iguais += _diff(anteriores, parte, delta)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+    os.replace(tmp, destino)
+
+    for op, n in delta.counts.items():
+        METRICS.inc("cnes_cdc_changes_total", n, op=op)
+    report = DeltaReport(
+        destino, table, chave,
+        delta.counts[INSERT], delta.counts[UPDATE], delta.counts[DELETE], iguais, n_partes,
+    )
+    LOGGER.info(
+        "Delta %s: %s incluída(s), %s alterada(s), %s excluída(s), %s igual(is) -> %s",
+        table, report.inserted, report.updated, report.deleted, report.unchanged, destino,
+    )
+    return report
+
+
+def diff_zips(
+    zip_anterior: Union[str, Path],
+    zip_atual: Union[str, Path],
+    destino: Union[str, Path],
+    **kwargs,
+) -> DeltaReport:
+    """`diff_members` a partir dos caminhos dos dois ZIPs."""
+    with zipfile.ZipFile(zip_anterior, "r") as anterior, zipfile.ZipFile(zip_atual, "r") as atual:
+        return diff_members(anterior, atual, destino, **kwargs)
+
+
+# =================== Execução ===================
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Delta (I/U/D) entre duas competências do CNES.")
+    parser.add_argument("anterior", help="ZIP da competência anterior.")
+    parser.add_argument("atual", help="ZIP da competência atual.")
+    parser.add_argument("saida", help="Arquivo do delta (.csv.gz).")
+    parser.add_argument("--tabela", default=DEFAULT_TABLE)
+    parser.add_argument("--chave", help="Colunas da chave separadas por vírgula (padrão: CO_UNIDADE).")
+    parser.add_argument("--max-linhas-memoria", type=int, default=2_000_000)
+    parser.add_argument("--particoes", type=int, default=64)
+    parser.add_argument("--tmp", help="Pasta para as partições em disco.")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    r = diff_zips(
+        args.anterior,
+        args.atual,
+        args.saida,
+        table=args.tabela,
+        key=args.chave.split(",") if args.chave else None,
+        max_rows_in_memory=args.max_linhas_memoria,
+        partitions=args.particoes,
+        tmp_dir=args.tmp,
+    )
+    print(f"{r.table}\tI={r.inserted}\tU={r.updated}\tD={r.deleted}\t={r.unchanged}\t{r.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# cnes_index.py
+# -*- coding: utf-8 -*-
+"""
+Índice ordenado em disco para buscar linhas de um CSV extraído do CNES pelo
+código CNES sem carregar a tabela. O índice (`<csv>.idx`) é um array binário de
+registros de tamanho fixo (código, offset, tamanho) ordenado pelo código; a busca
+faz `mmap` do índice e do CSV, busca binária e decodifica só as linhas achadas.
+Abrir é instantâneo e a memória não cresce com a tabela (as páginas vêm do cache
+do sistema). Serve para `tbEstabelecimento` e para tabelas com várias linhas por
+estabelecimento (vínculos, carga horária...), em que a busca devolve todas.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import io
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from cnes_parquet import CSV_DELIMITER, CSV_ENCODING, normalize_column_name
+
+LOGGER = logging.getLogger("CNES_INDEX")
+
+MAGIC = b"CNESIDX1"
+# magic, largura da chave, nº de registros, tamanho e mtime do CSV indexado, coluna da chave
+_HEADER = struct.Struct(">8sHQQQ32s")
+# Colunas de onde sai o código CNES, em ordem de preferência. CO_UNIDADE é
+# município (6) + CNES (7): nas tabelas sem CO_CNES o código são os 7 últimos.
+KEY_SOURCES: Tuple[Tuple[str, Optional[slice]], ...] = (
+    ("CO_CNES", None),
+    ("CO_UNIDADE", slice(-7, None)),
+)
+DEFAULT_KEY_WIDTH = 16
+
+
+class IndexInfo(NamedTuple):
+    """Resultado da construção de um índice."""
+
+    path: Path
+    csv_path: Path
+    column: str
+    records: int
+
+
+def index_path_for(csv_path: Union[str, Path]) -> Path:
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.name + ".idx")
+
+
+def _record_struct(key_width: int) -> struct.Struct:
+    # big-endian: a ordem dos bytes do registro = ordem de (chave, offset)
+    return struct.Struct(f">{key_width}sQI")
+
+
+def _encode_key(code: str, key_width: int) -> bytes:
+    raw = code.strip().encode(CSV_ENCODING)
+    if len(raw) > key_width:
+        raise ValueError(f"Código {code!r} maior que a largura do índice ({key_width}).")
+    return raw.ljust(key_width, b"\0")
+
+
+def _resolve_key(header: Sequence[str], key: Optional[str]) -> Tuple[str, int, Optional[slice]]:
+    if key:
+        if key not in header:
+            raise KeyError(f"Coluna {key} ausente do cabeçalho.")
+        return key, header.index(key), None
+    for column, part in KEY_SOURCES:
+        if column in header:
+            return column, header.index(column), part
+    raise KeyError("Nenhuma coluna de código CNES (CO_CNES / CO_UNIDADE) no cabeçalho.")
+
+
+def _parse_line(line: bytes) -> List[str]:
+    return next(csv.reader([line.decode(CSV_ENCODING)], delimiter=CSV_DELIMITER), [])
+
+
+def _records(f: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """(offset, linha) de cada registro; campo entre aspas com quebra de linha continua o registro."""
+    offset = f.tell()
+    pendente = b""
+    inicio = offset
+    for line in f:
+        if not pendente:
+            inicio = offset
+        offset += len(line)
+        pendente += line
+        if pendente.count(b'"') % 2:
+            continue
+        yield inicio, pendente
+        pendente = b""
+    if pendente:
+        yield inicio, pendente
+
+
+# =================== Construção ===================
+
+
+def _write_run(records: List[bytes], root: Path, n: int) -> Path:
+    records.sort()
+    path = root / f"run-{n:05d}.bin"
+    with path.open("wb") as f:
+        f.write(b"".join(records))
+    return path
+
+
+def _read_run(path: Path, size: int) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        while True:
+            rec = f.read(size)
+            if len(rec) < size:
+                return
+            yield rec
+
+
+def build_index(
+    csv_path: Union[str, Path],
+    index_path: Optional[Union[str, Path]] = None,
+    *,
+    key: Optional[str] = None,
+    key_width: int = DEFAULT_KEY_WIDTH,
+    run_records: int = 1_000_000,
+    tmp_dir: Optional[Union[str, Path]] = None,
+) -> IndexInfo:
+    """
+    Indexa `csv_path` (latin1, `;`, com cabeçalho) pelo código CNES (ou pela
+    coluna `key`) e grava `<csv>.idx`. Registros vazios ou sem código são pulados.
+
+    A ordenação é externa: blocos de `run_records` registros são ordenados em
+    memória, gravados em `tmp_dir` e intercalados, então a memória fica limitada
+    ao bloco mesmo em tabelas de dezenas de milhões de linhas.
+    O índice é escrito em `<idx>.part` e publicado por rename atômico.
+    """
+    csv_path = Path(csv_path)
+    index_path = Path(index_path) if index_path else index_path_for(csv_path)
+    rec = _record_struct(key_width)
+    stat = csv_path.stat()
+
+    with csv_path.open("rb") as f, tempfile.TemporaryDirectory(prefix="cnes-idx-", dir=tmp_dir) as tmp:
+        header = [normalize_column_name(c) for c in _parse_line(f.readline())]
+        column, pos, part = _resolve_key(header, key)
+        runs: List[Path] = []
+        bloco: List[bytes] = []
+        total = 0
+        for offset, line in _records(f):
+            campos = _parse_line(line)
+            if pos >= len(campos) or not campos[pos].strip():
+                continue
+            code = campos[pos].strip()
+            if part is not None:
+                code = code[part]
+            bloco.append(rec.pack(_encode_key(code, key_width), offset, len(line)))
+            total += 1
+            if len(bloco) == run_records:
+                runs.append(_write_run(bloco, Path(tmp), len(runs)))
+                bloco = []
+
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = index_path.with_name(index_path.name + ".part")
+        try:
+            with part_path.open("wb") as out:
+                out.write(
+                    _HEADER.pack(
+                        MAGIC, key_width, total, stat.st_size, stat.st_mtime_ns,
+                        column.encode("ascii")[:32],
+                    )
+                )
+                if not runs:
+                    bloco.sort()
+                    out.write(b"".join(bloco))
+                else:
+                    if bloco:
+                        runs.append(_write_run(bloco, Path(tmp), len(runs)))
+                    bloco = []
+                    for r in heapq.merge(*(_read_run(p, rec.size) for p in runs)):
+                        out.write(r)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        os.replace(part_path, index_path)
+
+    LOGGER.info("Índice %s: %s registros por %s (%s blocos).", index_path, total, column, max(1, len(runs)))
+    return IndexInfo(index_path, csv_path, column, total)
+
+
+# =================== Busca ===================
+
+
+class CnesIndex:
+    """
+    Busca por código CNES via `mmap` do índice e do CSV. Levanta `ValueError` se
+    o CSV mudou desde a construção do índice (tamanho ou mtime diferentes).
+
+        with CnesIndex("tbEstabelecimento202508.csv") as idx:
+            idx.get("2077485")       # dict da linha, ou None
+            idx.find("2077485")      # todas as linhas do código
+    """
+
+    def __init__(
+        self,
+        csv_path: Union[str, Path],
+        index_path: Optional[Union[str, Path]] = None,
+        *,
+        check: bool = True,
+    ) -> None:
+        self.csv_path = Path(csv_path)
+        self.index_path = Path(index_path) if index_path else index_path_for(self.csv_path)
+        self._idx_file = self.index_path.open("rb")
+        self._csv_file = self.csv_path.open("rb")
+        try:
+            self._idx = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.key_width, self.records, size, mtime, column = _HEADER.unpack_from(self._idx, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{self.index_path} não é um índice do CNES.")
+            stat = self.csv_path.stat()
+            if check and (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                raise ValueError(f"Índice desatualizado para {self.csv_path}: reconstrua com build_index.")
+            self.column = column.rstrip(b"\0").decode("ascii")
+            self._rec = _record_struct(self.key_width)
+            # mmap de arquivo vazio não é permitido
+            self._csv = (
+                mmap.mmap(self._csv_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            )
+            fim = self._csv.find(b"\n")
+            primeira = self._csv[: fim + 1 if fim >= 0 else len(self._csv)]
+            self.header = [normalize_column_name(c) for c in _parse_line(primeira)]
+        except BaseException:
+            self.close()
+            raise
+
+    def _key_at(self, i: int) -> bytes:
+        inicio = _HEADER.size + i * self._rec.size
+        return self._idx[inicio : inicio + self.key_width]
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self.records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def locate(self, code: str) -> List[Tuple[int, int]]:
+        """(offset, tamanho) de cada linha com o código, na ordem do arquivo."""
+        try:
+            key = _encode_key(code, self.key_width)
+        except ValueError:
+            return []
+        saida = []
+        i = self._lower_bound(key)
+        while i < self.records:
+            k, offset, length = self._rec.unpack_from(self._idx, _HEADER.size + i * self._rec.size)
+            if k != key:
+                break
+            saida.append((offset, length))
+            i += 1
+        return saida
+
+    def find(self, code: str) -> List[Dict[str, str]]:
+        """Todas as linhas com o código, como dicts coluna → valor."""
+        return [
+            dict(zip(self.header, _parse_line(self._csv[offset : offset + length])))
+            for offset, length in self.locate(code)
+        ]
+
+    def get(self, code: str) -> Optional[Dict[str, str]]:
+        """Primeira linha com o código, ou None."""
+        linhas = self.find(code)
+        return linhas[0] if linhas else None
+
+    def __len__(self) -> int:
+        return self.records
+
+    def close(self) -> None:
+        for m in ("_idx", "_csv"):
+            obj = getattr(self, m, None)
+            if isinstance(obj, mmap.mmap):
+                obj.close()
+        self._idx_file.close()
+        self._csv_file.close()
+
+    def __enter__(self) -> "CnesIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# =================== Execução ===================
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Índice por código CNES de CSVs extraídos.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_build = sub.add_parser("construir", help="Gera <csv>.idx para cada CSV.")
+    p_build.add_argument("csvs", nargs="+")
+    p_build.add_argument("--coluna", help="Coluna da chave (padrão: CO_CNES ou CO_UNIDADE).")
+    p_build.add_argument("--tmp", help="Pasta para os blocos da ordenação externa.")
+    p_find = sub.add_parser("buscar", help="Mostra as linhas de um código CNES.")
+    p_find.add_argument("csv")
+    p_find.add_argument("codigo")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.comando == "construir":
+        for caminho in args.csvs:
+            info = build_index(caminho, key=args.coluna, tmp_dir=args.tmp)
+            print(f"{info.csv_path}\t{info.column}\t{info.records}\t{info.path}")
+    else:
+        with CnesIndex(args.csv) as idx:
+            linhas = idx.find(args.codigo)
+        if not linhas:
+            raise SystemExit(f"Código {args.codigo} não encontrado.")
+        for linha in linhas:
+            print(linha)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# cnes_metrics.py
+# -*- coding: utf-8 -*-
+"""
+Métricas do pipeline do CNES: contadores, histogramas e tempo por fase
+(download, hash, extração, ...), exportados como relatório JSON e como textfile
+do Prometheus (node_exporter). O laço de dados só incrementa contadores; a barra
+de progresso é um renderizador opcional que lê esses contadores em outra thread,
+no máximo uma vez por intervalo.
+
+Os bytes são contados por nome de fase, não por execução: execuções simultâneas
+da mesma fase (meses do backfill, segmentos) formam um só período ativo, e a
+vazão é a desse período inteiro, sem creditar os mesmos bytes a cada execução.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Buckets (segundos) para latências de rede: handshake TLS, TTFB
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets (segundos) para esperas de backoff
+BACKOFF_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_HELP = {
+    "cnes_bytes_total": "Bytes processados por fase.",
+    "cnes_phase_seconds_total": "Tempo acumulado em cada fase (soma entre threads).",
+    "cnes_phase_wall_seconds_total": "Tempo de relógio com ao menos uma execução da fase aberta.",
+    "cnes_phase_throughput_bytes_per_second": "Vazão do último período ativo de cada fase (execuções simultâneas somadas).",
+    "cnes_tls_handshake_seconds": "Duração dos handshakes TLS.",
+    "cnes_tls_resumed_total": "Handshakes com retomada de sessão TLS.",
+    "cnes_ttfb_seconds": "Tempo até o primeiro byte (envio da requisição até o status).",
+    "cnes_retries_total": "Novas tentativas após falha de rede.",
+    "cnes_backoff_seconds": "Esperas de backoff antes de cada nova tentativa.",
+    "cnes_profile_peak_traced_bytes": "Pico de memória rastreada pelo tracemalloc na fase (--profile).",
+}
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pares = list(labels) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+
+class Histogram:
+    """Histograma cumulativo no formato do Prometheus (buckets fixos, soma, contagem)."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # último = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total, saida = 0, []
+        for limite, n in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += n
+            saida.append((limite, total))
+        return saida
+
+
+class _FaseAtiva:
+    """Período em que há ao menos uma execução aberta de uma fase."""
+
+    __slots__ = ("label", "total", "execucoes", "inicio", "bytes_antes")
+
+    def __init__(self, label: str, total: Optional[int], bytes_antes: float) -> None:
+        self.label = label
+        self.total = total
+        self.execucoes = 0
+        self.inicio = time.perf_counter()
+        self.bytes_antes = bytes_antes
+
+
+class MetricsRegistry:
+    """
+    Registro thread-safe de contadores, gauges e histogramas com labels.
+    `phase()` mede o tempo e os bytes de uma fase e, se `progress` estiver ligado,
+    mostra o `ProgressRenderer` do processo (um só, com todas as fases abertas)
+    enquanto houver fase aberta. Com `profiler` (ver
+    `cnes_profile.enable_profiling`), cada fase também roda sob cProfile e
+    tracemalloc; desligado, não custa nada além de conferir o atributo.
+    """
+
+    def __init__(self, *, progress: Optional[bool] = None, interval: float = 1.0) -> None:
+        if progress is None:
+            flag = os.environ.get("CNES_PROGRESS")
+            progress = flag == "1" if flag is not None else sys.stderr.isatty()
+        self.progress = progress
+        self.interval = interval
+        self.started = time.time()
+        self.profiler = None  # cnes_profile.PhaseProfiler, só com --profile
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+        self._ativas: Dict[str, _FaseAtiva] = {}
+        self._renderer: Optional[ProgressRenderer] = None
+
+    # ----- escrita -----
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            serie = self._counters.setdefault(name, {})
+            serie[key] = serie.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(
+        self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: str
+    ) -> None:
+        key = _labels(labels)
+        with self._lock:
+            serie = self._histograms.setdefault(name, {})
+            hist = serie.get(key)
+            if hist is None:
+                hist = serie[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def retry(self, phase: str, sleep_for: float) -> None:
+        """Registra uma nova tentativa e a espera de backoff que a precede."""
+        self.inc("cnes_retries_total", phase=phase)
+        self.observe("cnes_backoff_seconds", sleep_for, BACKOFF_BUCKETS, phase=phase)
+
+    # ----- leitura -----
+
+    def value(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def active_phases(self) -> List[Tuple[str, str, Optional[int], float, float]]:
+        """(fase, rótulo, total, bytes, segundos) de cada fase aberta agora."""
+        agora = time.perf_counter()
+        with self._lock:
+            bytes_total = self._counters.get("cnes_bytes_total", {})
+            return [
+                (nome, a.label, a.total, bytes_total.get(_labels({"phase": nome}), 0) - a.bytes_antes, agora - a.inicio)
+                for nome, a in self._ativas.items()
+            ]
+
+    @contextlib.contextmanager
+    def phase(
+        self, name: str, *, total: Optional[int] = None, label: Optional[str] = None
+    ) -> Iterator[None]:
+        """
+        Cronometra a fase `name`: ao sair, soma o tempo em `cnes_phase_seconds_total`.
+        Quando fecha a última execução aberta de `name`, grava a vazão do período
+        (bytes de `cnes_bytes_total{phase=name}` desde que a primeira abriu / tempo
+        desde então): execuções simultâneas não recebem os bytes umas das outras.
+        """
+        with self._lock:
+            ativa = self._ativas.get(name)
+            if ativa is None:
+                antes = self._counters.get("cnes_bytes_total", {}).get(_labels({"phase": name}), 0)
+                ativa = self._ativas[name] = _FaseAtiva(label or name, total, antes)
+            elif total and ativa.total is not None:
+                ativa.total += total
+            else:
+                ativa.total = None  # alguma execução sem total: progresso sem %
+            ativa.execucoes += 1
+            if self.progress and self._renderer is None:
+                self._renderer = ProgressRenderer(self, interval=self.interval).start()
+        inicio = time.perf_counter()
+        try:
+            if self.profiler is None:
+                yield
+            else:
+                with self.profiler.phase(name, self):
+                    yield
+        finally:
+            fim = time.perf_counter()
+            self.inc("cnes_phase_seconds_total", fim - inicio, phase=name)
+            renderer = self._renderer
+            if renderer is not None:
+                renderer.render()  # estado final desta execução
+            parar = None
+            with self._lock:
+                ativa.execucoes -= 1
+                if ativa.execucoes == 0:
+                    del self._ativas[name]
+                    periodo = fim - ativa.inicio
+                    n = self._counters.get("cnes_bytes_total", {}).get(_labels({"phase": name}), 0) - ativa.bytes_antes
+                    parede = self._counters.setdefault("cnes_phase_wall_seconds_total", {})
+                    parede[_labels({"phase": name})] = parede.get(_labels({"phase": name}), 0) + periodo
+                    if periodo > 0:
+                        self._gauges.setdefault("cnes_phase_throughput_bytes_per_second", {})[
+                            _labels({"phase": name})
+                        ] = n / periodo
+                if not self._ativas and self._renderer is not None:
+                    parar, self._renderer = self._renderer, None
+            if parar is not None:
+                parar.stop()
+
+    # ----- exportação -----
+
+    def snapshot(self) -> Dict[str, object]:
+        """Relatório da execução: séries por métrica e resumo (MB/s) por fase."""
+        with self._lock:
+            def serie(d, conv):
+                return {
+                    nome: [{"labels": dict(k), **conv(v)} for k, v in sorted(valores.items())]
+                    for nome, valores in sorted(d.items())
+                }
+
+            report: Dict[str, object] = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "counters": serie(self._counters, lambda v: {"value": v}),
+                "gauges": serie(self._gauges, lambda v: {"value": v}),
+                "histograms": serie(
+                    self._histograms,
+                    lambda h: {"count": h.count, "sum": h.sum, "buckets": dict(h.cumulative())},
+                ),
+            }
+            # MB/s pelo tempo de relógio dos períodos ativos, não pela soma entre
+            # threads: execuções simultâneas não diluem a vazão
+            fases = {}
+            for key, segundos in self._counters.get("cnes_phase_seconds_total", {}).items():
+                fase = dict(key)["phase"]
+                n = self._counters.get("cnes_bytes_total", {}).get(key, 0)
+                parede = self._counters.get("cnes_phase_wall_seconds_total", {}).get(key, 0)
+                fases[fase] = {
+                    "seconds": round(segundos, 4),
+                    "wall_seconds": round(parede, 4),
+                    "bytes": int(n),
+                    "mb_per_s": round(n / parede / 1e6, 3) if parede > 0 else None,
+                }
+            report["phases"] = fases
+        return report
+
+    def prometheus(self) -> str:
+        """Texto no formato de exposição do Prometheus (para o textfile collector)."""
+        linhas: List[str] = []
+        with self._lock:
+            for tipo, dados in (("counter", self._counters), ("gauge", self._gauges)):
+                for nome, valores in sorted(dados.items()):
+                    linhas.append(f"# HELP {nome} {_HELP.get(nome, nome)}")
+                    linhas.append(f"# TYPE {nome} {tipo}")
+                    for key, v in sorted(valores.items()):
+                        linhas.append(f"{nome}{_fmt_labels(key)} {v:g}")
+            for nome, valores in sorted(self._histograms.items()):
+                linhas.append(f"# HELP {nome} {_HELP.get(nome, nome)}")
+                linhas.append(f"# TYPE {nome} histogram")
+                for key, hist in sorted(valores.items()):
+                    for limite, n in hist.cumulative():
+                        linhas.append(f"{nome}_bucket{_fmt_labels(key, [('le', limite)])} {n}")
+                    linhas.append(f"{nome}_sum{_fmt_labels(key)} {hist.sum:g}")
+                    linhas.append(f"{nome}_count{_fmt_labels(key)} {hist.count}")
+        return "\n".join(linhas) + "\n"
+
+    def write_json(self, path: Union[str, Path]) -> Path:
+        return _write_atomic(Path(path), json.dumps(self.snapshot(), indent=2, ensure_ascii=False))
+
+    def write_prometheus(self, path: Union[str, Path]) -> Path:
+        return _write_atomic(Path(path), self.prometheus())
+
+    def export(
+        self, json_path: Optional[Union[str, Path]] = None, prom_path: Optional[Union[str, Path]] = None
+    ) -> None:
+        """Grava os relatórios pedidos (padrão: `CNES_METRICS_JSON` / `CNES_METRICS_PROM`)."""
+        json_path = json_path or os.environ.get("CNES_METRICS_JSON")
+        prom_path = prom_path or os.environ.get("CNES_METRICS_PROM")
+        if json_path:
+            self.write_json(json_path)
+        if prom_path:
+            self.write_prometheus(prom_path)
+
+
+def _write_atomic(path: Path, texto: str) -> Path:
+    # O textfile collector pode ler a qualquer momento: nunca expor arquivo pela metade
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(texto, encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+
+def _human(n: float) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} PB"
+
+
+class ProgressRenderer:
+    """
+    Barra de progresso em thread própria, uma por registro: a cada `interval`
+    segundos lê `active_phases()` e reescreve uma única linha em `stream` com
+    todas as fases abertas ("Baixando: ... | Extraindo: ..."). Não participa do
+    laço de dados.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        *,
+        interval: float = 1.0,
+        stream: Optional[TextIO] = None,
+    ) -> None:
+        self.registry = registry
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._largura = 0
+
+    def render(self) -> None:
+        partes = []
+        for _, label, total, done, elapsed in self.registry.active_phases():
+            rate = f" {_human(done / elapsed)}/s" if elapsed > 0 else ""
+            if total:
+                pct = min(100.0, done / total * 100)
+                partes.append(f"{label}: {_human(done)} / {_human(total)} ({pct:5.1f}%){rate}")
+            else:
+                partes.append(f"{label}: {_human(done)}{rate}")
+        if not partes:
+            return
+        linha = " | ".join(partes)
+        # Apaga o resto da linha anterior, se era mais longa
+        self.stream.write("\r" + linha.ljust(self._largura))
+        self._largura = len(linha)
+        self.stream.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def start(self) -> "ProgressRenderer":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._largura:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+# Registro padrão do processo (usado por cnes_downloader e cnes_backfill)
+METRICS = MetricsRegistry()
@@ -0,0 +1,554 @@
+# cnes_parquet.py
+# -*- coding: utf-8 -*-
+"""
+Conversão em streaming dos membros `tb*.csv` do ZIP do CNES (latin1, `;`) para
+Parquet tipado, lendo direto do `ZipFile`, sem CSV intermediário em disco.
+Usa pyarrow quando instalado; senão, um escritor Parquet em Python puro
+(PLAIN + GZIP, um row group por lote). A memória fica limitada ao lote.
+"""
+
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import logging
+import os
+import re
+import struct
+import sys
+import zipfile
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional
+    pa = None
+
+LOGGER = logging.getLogger("CNES_PARQUET")
+
+CSV_ENCODING = "latin1"
+CSV_DELIMITER = ";"
+
+# Tipos explícitos por tabela (nome do membro sem competência/extensão).
+# Colunas não listadas seguem `_NAME_CONVENTIONS` e, por fim, ficam como string:
+# códigos (CO_*, TP_*, NU_CNPJ...) têm zeros à esquerda e não devem virar número.
+TABLE_SCHEMAS: Dict[str, Dict[str, str]] = {
+    "tbEstabelecimento": {
+        "NU_LATITUDE": "double",
+        "NU_LONGITUDE": "double",
+        "TP_UNIDADE": "int32",
+        "CO_ESTADO_GESTOR": "int32",
+    },
+}
+
+# Convenções de nomes de coluna do CNES (regex sobre o nome normalizado)
+_NAME_CONVENTIONS: Tuple[Tuple[re.Pattern, str], ...] = (
+    (re.compile(r"(^|_)DT_"), "date"),
+    (re.compile(r"^QT_"), "int64"),
+    (re.compile(r"^NU_(LATITUDE|LONGITUDE)$"), "double"),
+)
+
+_INT_RE = re.compile(r"^-?\d{1,18}$")  # cabe em int64
+_INT32_MIN, _INT32_MAX = -(2**31), 2**31 - 1
+_DOUBLE_RE = re.compile(r"^-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+_TO_CHAR_RE = re.compile(r"TO_CHAR\(\s*(\w+)\s*,", re.IGNORECASE)
+
+
+class ConversionReport(NamedTuple):
+    """Resultado de uma conversão: linhas escritas e valores inválidos (→ nulo) por coluna."""
+
+    path: Path
+    table: str
+    rows: int
+    engine: str
+    invalid: Dict[str, int]
+
+
+def table_name(member: str) -> str:
+    """`tbEstabelecimento202508.csv` → `tbEstabelecimento`."""
+    stem = Path(member).stem
+    return re.sub(r"\d{6}$", "", stem)
+
+
+def normalize_column_name(name: str) -> str:
+    """
+    Nomes válidos para Parquet/Spark: `TO_CHAR(DT_X,'DD/MM/YYYY')` → `DT_X`;
+    demais caracteres fora de [A-Za-z0-9_] viram `_`.
+    """
+    name = name.strip().strip('"')
+    match = _TO_CHAR_RE.search(name)
+    if match:
+        return match.group(1)
+    return re.sub(r"\W+", "_", name).strip("_") or "COLUNA"
+
+
+def resolve_schema(table: str, columns: List[str]) -> List[Tuple[str, str]]:
+    """Tipo de cada coluna: explícito da tabela > convenção de nome > string."""
+    explicit = TABLE_SCHEMAS.get(table, {})
+    schema = []
+    for col in columns:
+        kind = explicit.get(col)
+        if kind is None:
+            kind = next((k for rx, k in _NAME_CONVENTIONS if rx.search(col)), "string")
+        schema.append((col, kind))
+    return schema
+
+
+# =================== Conversores (Python puro) ===================
+
+
+def _to_int(value: str) -> Optional[int]:
+    value = value.strip()
+    if not _INT_RE.match(value):
+        raise ValueError(value)
+    return int(value)
+
+
+def _to_int32(value: str) -> Optional[int]:
+    number = _to_int(value)
+    if not _INT32_MIN <= number <= _INT32_MAX:
+        raise ValueError(value)
+    return number
+
+
+def _to_double(value: str) -> Optional[float]:
+    value = value.strip().replace(",", ".")
+    if not _DOUBLE_RE.match(value):
+        raise ValueError(value)
+    return float(value)
+
+
+def _to_date(value: str) -> Optional[date]:
+    value = value.strip()
+    if len(value) == 10 and value[2] == "/" and value[5] == "/":
+        return date(int(value[6:]), int(value[3:5]), int(value[:2]))
+    if len(value) == 10 and value[4] == "-" and value[7] == "-":
+        return date(int(value[:4]), int(value[5:7]), int(value[8:]))
+    raise ValueError(value)
+
+
+_CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    "string": lambda v: v,
+    "int32": _to_int32,
+    "int64": _to_int,
+    "double": _to_double,
+    "date": _to_date,
+}
+
+
+# =================== Escritor Parquet em Python puro ===================
+
+# Thrift compact protocol (subconjunto usado pelos metadados do Parquet)
+_T_I32, _T_I64, _T_BINARY, _T_LIST, _T_STRUCT = 5, 6, 8, 9, 12
+
+# Parquet: tipo físico e converted_type por tipo lógico
+_PHYSICAL = {
+    "string": (6, 0),  # BYTE_ARRAY, UTF8
+    "int32": (1, None),  # INT32
+    "int64": (2, None),  # INT64
+    "double": (5, None),  # DOUBLE
+    "date": (1, 6),  # INT32, DATE (dias desde 1970-01-01)
+}
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_CODEC = {None: 0, "none": 0, "gzip": 2}
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _thrift_value(ftype: int, value: Any) -> bytes:
+    if ftype in (_T_I32, _T_I64):
+        return _varint(_zigzag(value))
+    if ftype == _T_BINARY:
+        data = value.encode("utf-8") if isinstance(value, str) else value
+        return _varint(len(data)) + data
+    if ftype == _T_STRUCT:
+        return value  # já serializado por `_thrift_struct`
+    if ftype == _T_LIST:
+        elem_type, items = value
+        header = (
+            bytes([(len(items) << 4) | elem_type])
+            if len(items) < 15
+            else bytes([0xF0 | elem_type]) + _varint(len(items))
+        )
+        return header + b"".join(_thrift_value(elem_type, i) for i in items)
+    raise ValueError(f"Tipo thrift não suportado: {ftype}")
+
+
+def _thrift_struct(fields: List[Tuple[int, int, Any]]) -> bytes:
+    """Serializa `(id, tipo, valor)` em ordem crescente de id; `None` é omitido."""
+    out = bytearray()
+    last = 0
+    for fid, ftype, value in fields:
+        if value is None:
+            continue
+        delta = fid - last
+        if 0 < delta <= 15:
+            out.append((delta << 4) | ftype)
+        else:
+            out.append(ftype)
+            out += _varint(_zigzag(fid))
+        out += _thrift_value(ftype, value)
+        last = fid
+    out.append(0)  # STOP
+    return bytes(out)
+
+
+def _definition_levels(values: List[Any]) -> bytes:
+    """Níveis de definição (bit width 1) em um único run bit-packed do híbrido RLE."""
+    groups = (len(values) + 7) // 8
+    packed = bytearray(groups)
+    for i, v in enumerate(values):
+        if v is not None:
+            packed[i >> 3] |= 1 << (i & 7)
+    body = _varint((groups << 1) | 1) + bytes(packed)
+    return struct.pack("<I", len(body)) + body
+
+
+def _plain(kind: str, values: List[Any]) -> bytes:
+    present = [v for v in values if v is not None]
+    if kind == "string":
+        out = bytearray()
+        for v in present:
+            data = v.encode("utf-8")
+            out += struct.pack("<I", len(data))
+            out += data
+        return bytes(out)
+    if kind == "date":
+        present = [d.toordinal() - _EPOCH_ORDINAL for d in present]
+    fmt = {"int32": "i", "date": "i", "int64": "q", "double": "d"}[kind]
+    return struct.pack(f"<{len(present)}{fmt}", *present)
+
+
+class PurePythonParquetWriter:
+    """
+    Escritor Parquet mínimo: colunas OPTIONAL, encoding PLAIN, uma página por
+    coluna por row group, compressão GZIP (ou nenhuma). Suficiente para o
+    Spark/pyarrow lerem os arquivos como colunares e tipados.
+    """
+
+    def __init__(
+        self, path: Union[str, Path], schema: List[Tuple[str, str]], compression: Optional[str] = "gzip"
+    ) -> None:
+        if compression not in _CODEC:
+            raise ValueError(f"Compressão não suportada sem pyarrow: {compression}")
+        self.schema = schema
+        self.codec = _CODEC[compression]
+        self.compression = compression
+        self._f = open(path, "wb")
+        self._f.write(b"PAR1")
+        self._row_groups: List[bytes] = []
+        self._rows = 0
+
+    def write_batch(self, columns: List[List[Any]], num_rows: int) -> None:
+        chunks = []
+        total = 0
+        for (name, kind), values in zip(self.schema, columns):
+            raw = _definition_levels(values) + _plain(kind, values)
+            data = gzip.compress(raw, mtime=0) if self.codec == 2 else raw
+            header = _thrift_struct(
+                [
+                    (1, _T_I32, 0),  # DATA_PAGE
+                    (2, _T_I32, len(raw)),
+                    (3, _T_I32, len(data)),
+                    (5, _T_STRUCT, _thrift_struct(
+                        [(1, _T_I32, num_rows), (2, _T_I32, 0), (3, _T_I32, 3), (4, _T_I32, 3)]
+                    )),
+                ]
+            )
+            offset = self._f.tell()
+            self._f.write(header)
+            self._f.write(data)
+            physical, _ = _PHYSICAL[kind]
+            meta = _thrift_struct(
+                [
+                    (1, _T_I32, physical),
+                    (2, _T_LIST, (_T_I32, [0, 3])),  # PLAIN, RLE
+                    (3, _T_LIST, (_T_BINARY, [name])),
+                    (4, _T_I32, self.codec),
+                    (5, _T_I64, num_rows),
+                    (6, _T_I64, len(header) + len(raw)),
+                    (7, _T_I64, len(header) + len(data)),
+                    (9, _T_I64, offset),
+                ]
+            )
+            chunks.append(_thrift_struct([(2, _T_I64, offset), (3, _T_STRUCT, meta)]))
+            total += len(header) + len(raw)
+        self._row_groups.append(
+            _thrift_struct(
+                [(1, _T_LIST, (_T_STRUCT, chunks)), (2, _T_I64, total), (3, _T_I64, num_rows)]
+            )
+        )
+        self._rows += num_rows
+
+    def close(self) -> None:
+        elements = [_thrift_struct([(4, _T_BINARY, "schema"), (5, _T_I32, len(self.schema))])]
+        for name, kind in self.schema:
+            physical, converted = _PHYSICAL[kind]
+            elements.append(
+                _thrift_struct(
+                    [(1, _T_I32, physical), (3, _T_I32, 1), (4, _T_BINARY, name), (6, _T_I32, converted)]
+                )
+            )
+        footer = _thrift_struct(
+            [
+                (1, _T_I32, 1),
+                (2, _T_LIST, (_T_STRUCT, elements)),
+                (3, _T_I64, self._rows),
+                (4, _T_LIST, (_T_STRUCT, self._row_groups)),
+                (6, _T_BINARY, "cnes_parquet (python puro)"),
+            ]
+        )
+        self._f.write(footer)
+        self._f.write(struct.pack("<I", len(footer)))
+        self._f.write(b"PAR1")
+        self._f.close()
+
+
+# =================== Conversão ===================
+
+
+def _read_header(zf: zipfile.ZipFile, member: str) -> List[str]:
+    with zf.open(member) as raw:
+        text = io.TextIOWrapper(raw, encoding=CSV_ENCODING, newline="")
+        return next(csv.reader(text, delimiter=CSV_DELIMITER), [])
+
+
+def _python_batches(
+    zf: zipfile.ZipFile,
+    member: str,
+    schema: List[Tuple[str, str]],
+    batch_rows: int,
+    invalid: Dict[str, int],
+) -> Iterator[Tuple[List[List[Any]], int]]:
+    converters = [_CONVERTERS[kind] for _, kind in schema]
+    names = [name for name, _ in schema]
+    width = len(schema)
+    with zf.open(member) as raw:
+        text = io.TextIOWrapper(raw, encoding=CSV_ENCODING, newline="")
+        reader = csv.reader(text, delimiter=CSV_DELIMITER)
+        next(reader, None)  # cabeçalho
+        columns: List[List[Any]] = [[] for _ in range(width)]
+        n = 0
+        for row in reader:
+            if not row:
+                continue
+            for i in range(width):
+                value = row[i] if i < len(row) else ""
+                if value == "":
+                    columns[i].append(None)
+                    continue
+                try:
+                    columns[i].append(converters[i](value))
+                except ValueError:
+                    invalid[names[i]] = invalid.get(names[i], 0) + 1
+                    columns[i].append(None)
+            n += 1
+            if n == batch_rows:
+                yield columns, n
+                columns = [[] for _ in range(width)]
+                n = 0
+        if n:
+            yield columns, n
+
+
+def _convert_python(
+    zf: zipfile.ZipFile,
+    member: str,
+    schema: List[Tuple[str, str]],
+    destino: Path,
+    batch_rows: int,
+    compression: Optional[str],
+) -> Tuple[int, Dict[str, int]]:
+    invalid: Dict[str, int] = {}
+    writer = PurePythonParquetWriter(destino, schema, compression or "gzip")
+    rows = 0
+    try:
+        for columns, n in _python_batches(zf, member, schema, batch_rows, invalid):
+            writer.write_batch(columns, n)
+            rows += n
+    finally:
+        writer.close()
+    return rows, invalid
+
+
+def _arrow_type(kind: str):
+    return {
+        "string": pa.string(),
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "double": pa.float64(),
+        "date": pa.date32(),
+    }[kind]
+
+
+def _arrow_column(array, kind: str):
+    """Converte uma coluna string; valores fora do formato viram nulo."""
+    if kind == "string":
+        return array
+    trimmed = pc.utf8_trim_whitespace(array)
+    if kind == "date":
+        parsed = pc.coalesce(
+            pc.strptime(trimmed, format="%d/%m/%Y", unit="s", error_is_null=True),
+            pc.strptime(trimmed, format="%Y-%m-%d", unit="s", error_is_null=True),
+        )
+        return pc.cast(parsed, pa.date32())
+    if kind == "double":
+        trimmed = pc.replace_substring(trimmed, ",", ".")
+        pattern = _DOUBLE_RE.pattern
+    else:
+        pattern = _INT_RE.pattern
+    valid = pc.match_substring_regex(trimmed, pattern)
+    kept = pc.if_else(valid, trimmed, pa.scalar(None, pa.string()))
+    if kind != "int32":
+        return pc.cast(kept, _arrow_type(kind))
+    wide = pc.cast(kept, pa.int64())
+    in_range = pc.and_(pc.greater_equal(wide, _INT32_MIN), pc.less_equal(wide, _INT32_MAX))
+    return pc.cast(pc.if_else(in_range, wide, pa.scalar(None, pa.int64())), pa.int32())
+
+
+def _convert_pyarrow(
+    zf: zipfile.ZipFile,
+    member: str,
+    schema: List[Tuple[str, str]],
+    destino: Path,
+    block_size: int,
+    compression: Optional[str],
+) -> Tuple[int, Dict[str, int]]:
+    names = [name for name, _ in schema]
+    invalid: Dict[str, int] = {}
+    arrow_schema = pa.schema([(name, _arrow_type(kind)) for name, kind in schema])
+    rows = 0
+    with zf.open(member) as raw:
+        reader = pacsv.open_csv(
+            raw,
+            read_options=pacsv.ReadOptions(
+                encoding=CSV_ENCODING, block_size=block_size, column_names=names, skip_rows=1
+            ),
+            parse_options=pacsv.ParseOptions(delimiter=CSV_DELIMITER),
+            convert_options=pacsv.ConvertOptions(
+                column_types={name: pa.string() for name in names},
+                strings_can_be_null=True,
+                null_values=[""],
+            ),
+        )
+        with pq.ParquetWriter(destino, arrow_schema, compression=compression or "zstd") as writer:
+            for batch in reader:
+                arrays = []
+                for (name, kind), column in zip(schema, batch.columns):
+                    converted = _arrow_column(column, kind)
+                    lost = converted.null_count - column.null_count
+                    if lost:
+                        invalid[name] = invalid.get(name, 0) + lost
+                    arrays.append(converted)
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=arrow_schema))
+                rows += batch.num_rows
+    return rows, invalid
+
+
+def convert_member_to_parquet(
+    zf: zipfile.ZipFile,
+    member: str,
+    destino: Union[str, Path],
+    *,
+    engine: str = "auto",
+    compression: Optional[str] = None,
+    batch_rows: int = 50_000,
+    block_size: int = 16 * 1024 * 1024,
+) -> ConversionReport:
+    """
+    Converte o membro CSV `member` de `zf` em Parquet tipado em `destino`.
+
+    - `engine`: "pyarrow", "python" ou "auto" (pyarrow se instalado).
+    - `compression`: padrão "zstd" no pyarrow e "gzip" no escritor Python puro.
+    - O lote é de `block_size` bytes de CSV (pyarrow) ou `batch_rows` linhas (Python).
+    O arquivo é escrito em `<destino>.part` e publicado por rename atômico.
+    """
+    if engine == "auto":
+        engine = "pyarrow" if pa is not None else "python"
+    if engine == "pyarrow" and pa is None:
+        raise RuntimeError("engine='pyarrow' requer o pacote pyarrow instalado.")
+
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    table = table_name(member)
+    columns = [normalize_column_name(c) for c in _read_header(zf, member)]
+    schema = resolve_schema(table, columns)
+
+    tmp = destino.with_name(destino.name + ".part")
+    try:
+        if engine == "pyarrow":
+            rows, invalid = _convert_pyarrow(zf, member, schema, tmp, block_size, compression)
+        else:
+            rows, invalid = _convert_python(zf, member, schema, tmp, batch_rows, compression)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, destino)
+
+    for name, count in invalid.items():
+        LOGGER.warning("%s.%s: %s valor(es) fora do tipo gravado(s) como nulo.", table, name, count)
+    LOGGER.info("Parquet gerado (%s, %s linhas): %s", engine, rows, destino)
+    return ConversionReport(destino, table, rows, engine, invalid)
+
+
+def convert_zip_to_parquet(
+    zip_path: Union[str, Path],
+    out_dir: Union[str, Path],
+    *,
+    members: Optional[List[str]] = None,
+    **kwargs,
+) -> List[ConversionReport]:
+    """
+    Converte os membros `tb*.csv` do ZIP (ou só `members`) para
+    `<out_dir>/<membro>.parquet`. `kwargs` vão para `convert_member_to_parquet`.
+    """
+    out_dir = Path(out_dir)
+    reports = []
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        if members is None:
+            members = [
+                n for n in zf.namelist()
+                if Path(n).name.lower().startswith("tb") and n.lower().endswith(".csv")
+            ]
+        for member in members:
+            destino = out_dir / (Path(member).stem + ".parquet")
+            reports.append(convert_member_to_parquet(zf, member, destino, **kwargs))
+    return reports
+
+
+# =================== Execução ===================
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("uso: python cnes_parquet.py ARQUIVO.ZIP PASTA_SAIDA [membro ...]")
+        raise SystemExit(2)
+    reports = convert_zip_to_parquet(argv[0], argv[1], members=argv[2:] or None)
+    for r in reports:
+        print(f"{r.table}\t{r.rows}\t{r.engine}\t{r.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# cnes_profile.py
+# -*- coding: utf-8 -*-
+"""
+Perfil opcional por fase do pipeline do CNES (`--profile`). Cada
+`METRICS.phase(...)` (download, hash, extract, ...) roda sob cProfile e
+tracemalloc e gera, em `<pasta>`:
+
+- `NN-<fase>.pstats`: estatísticas do cProfile (`python -m pstats`, snakeviz);
+- `NN-<fase>.collapsed`: pilhas no formato "a;b;c <µs>" (flamegraph.pl, speedscope);
+- `profile.json`: resumo por fase (tempo, chamadas, pico de memória rastreada).
+
+O pico do tracemalloc também vai para o gauge `cnes_profile_peak_traced_bytes`.
+Sem `enable_profiling`, este módulo nem é importado e `phase()` só confere um
+atributo `None`. Processos filhos (`extract_zip_parallel`, `cnes_shards`) não
+entram no perfil.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+LOGGER = logging.getLogger("CNES_PROFILE")
+
+# Até o 3.11 o cProfile só vê a thread que o ligou; as threads criadas durante a
+# fase (segmentos do download) ganham um perfil próprio via threading.setprofile.
+# Do 3.12 em diante ele usa sys.monitoring, que já cobre todas as threads.
+_POR_THREAD = sys.version_info < (3, 12)
+# Pilhas com menos que isso (segundos) ficam fora do .collapsed
+_MIN_SEGUNDOS = 1e-6
+_MAX_PROFUNDIDADE = 128
+
+
+class PhaseProfile(NamedTuple):
+    """Uma execução perfilada de uma fase."""
+
+    phase: str
+    seconds: float
+    calls: int
+    peak_traced_bytes: int
+    pstats: str
+    collapsed: str
+
+
+# =================== Pilhas colapsadas ===================
+
+
+def _rotulo(func: Tuple[str, int, str]) -> str:
+    arquivo, linha, nome = func
+    if arquivo == "~":  # built-in: "<built-in method zlib.crc32>"
+        rotulo = nome
+    else:
+        rotulo = f"{nome} ({os.path.basename(arquivo)}:{linha})"
+    return rotulo.replace(";", ",")
+
+
+def collapsed_stacks(stats: pstats.Stats) -> Dict[str, float]:
+    """
+    Pilhas colapsadas (segundos de tempo próprio por pilha) a partir do grafo
+    chamador→chamado do cProfile. O cProfile não guarda pilhas completas: o
+    tempo de cada função é repartido entre os chamadores na proporção do tempo
+    acumulado vindo de cada um, o que é exato para funções com um só chamador.
+    """
+    dados = stats.stats  # func -> (cc, nc, tt, ct, callers{caller: (cc, nc, tt, ct)})
+    filhos: Dict[Tuple, List[Tuple]] = defaultdict(list)
+    for func, (_, _, _, _, callers) in dados.items():
+        for caller in callers:
+            filhos[caller].append(func)
+    pilhas: Dict[str, float] = defaultdict(float)
+
+    def visitar(func: Tuple, pilha: Tuple[str, ...], vistos: frozenset, parcela: float) -> None:
+        _, _, tt, ct, _ = dados[func]
+        pilha = pilha + (_rotulo(func),)
+        fracao = parcela / ct if ct > 0 else 0.0
+        if tt * fracao >= _MIN_SEGUNDOS:
+            pilhas[";".join(pilha)] += tt * fracao
+        if len(pilha) >= _MAX_PROFUNDIDADE:
+            return
+        for filho in filhos.get(func, ()):
+            if filho in vistos:  # recursão: o tempo já está no ancestral
+                continue
+            ct_filho = dados[filho][4][func][3] * fracao
+            if ct_filho >= _MIN_SEGUNDOS:
+                visitar(filho, pilha, vistos | {filho}, ct_filho)
+
+    for func, (_, _, _, ct, callers) in dados.items():
+        if not callers:
+            visitar(func, (), frozenset({func}), ct)
+    return dict(pilhas)
+
+
+def write_collapsed(stats: pstats.Stats, path: Union[str, Path]) -> Path:
+    """Grava `collapsed_stacks` em microssegundos inteiros, uma pilha por linha."""
+    path = Path(path)
+    linhas = [
+        f"{pilha} {round(segundos * 1e6)}"
+        for pilha, segundos in sorted(collapsed_stacks(stats).items())
+        if round(segundos * 1e6) > 0
+    ]
+    path.write_text("\n".join(linhas) + "\n", encoding="utf-8")
+    return path
+
+
+# =================== Perfil por fase ===================
+
+
+class PhaseProfiler:
+    """
+    Liga cProfile + tracemalloc em volta de cada fase. Só uma fase é perfilada
+    por vez: fases aninhadas ou simultâneas (ex.: extração em streaming durante
+    o download) entram no perfil da que começou antes.
+    """
+
+    def __init__(self, out_dir: Union[str, Path], *, tracemalloc_frames: int = 1) -> None:
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.tracemalloc_frames = tracemalloc_frames
+        self.profiles: List[PhaseProfile] = []
+        self._ativo = threading.Lock()
+        self._perfis_threads: List[cProfile.Profile] = []
+
+    def _nova_thread(self, frame, event, arg) -> None:
+        # Primeiro evento de uma thread criada durante a fase: troca o gancho
+        # de Python pelo perfil em C, só dessa thread
+        sys.setprofile(None)
+        perfil = cProfile.Profile()
+        self._perfis_threads.append(perfil)
+        perfil.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name: str, registry=None) -> Iterator[None]:
+        if not self._ativo.acquire(blocking=False):
+            LOGGER.debug("Fase %s dentro de outra fase perfilada; sem perfil próprio.", name)
+            yield
+            return
+        iniciou_tracemalloc = not tracemalloc.is_tracing()
+        if iniciou_tracemalloc:
+            tracemalloc.start(self.tracemalloc_frames)
+        tracemalloc.reset_peak()
+        perfil = cProfile.Profile()
+        self._perfis_threads = []
+        if _POR_THREAD:
+            threading.setprofile(self._nova_thread)
+        inicio = time.perf_counter()
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+            segundos = time.perf_counter() - inicio
+            if _POR_THREAD:
+                threading.setprofile(None)
+            pico = tracemalloc.get_traced_memory()[1]
+            if iniciou_tracemalloc:
+                tracemalloc.stop()
+            try:
+                self._salvar(name, perfil, segundos, pico, registry)
+            finally:
+                self._ativo.release()
+
+    def _salvar(self, name: str, perfil: cProfile.Profile, segundos: float, pico: int, registry) -> None:
+        stats = pstats.Stats(perfil)
+        for extra in self._perfis_threads:
+            stats.add(extra)
+        self._perfis_threads = []
+        base = self.out_dir / f"{len(self.profiles) + 1:02d}-{name}"
+        pstats_path = base.with_suffix(".pstats")
+        stats.dump_stats(pstats_path)
+        collapsed_path = write_collapsed(stats, base.with_suffix(".collapsed"))
+        self.profiles.append(
+            PhaseProfile(name, round(segundos, 4), stats.total_calls, pico, str(pstats_path), str(collapsed_path))
+        )
+        if registry is not None:
+            registry.set("cnes_profile_peak_traced_bytes", pico, phase=name)
+        self.write_summary()
+        LOGGER.info(
+            "Perfil da fase %s: %.2fs, pico rastreado %s bytes -> %s", name, segundos, pico, pstats_path
+        )
+
+    def write_summary(self) -> Path:
+        """Grava `profile.json` (atômico) com todas as fases perfiladas até agora."""
+        path = self.out_dir / "profile.json"
+        tmp = path.with_name(path.name + ".part")
+        tmp.write_text(
+            json.dumps([p._asdict() for p in self.profiles], indent=2, ensure_ascii=False), encoding="utf-8"
+        )
+        os.replace(tmp, path)
+        return path
+
+
+def enable_profiling(out_dir: Union[str, Path], registry=None) -> PhaseProfiler:
+    """Liga o perfil por fase em `registry` (padrão: `cnes_metrics.METRICS`)."""
+    if registry is None:
+        from cnes_metrics import METRICS as registry
+    registry.profiler = PhaseProfiler(out_dir)
+    LOGGER.info("Perfil por fase ligado; saída em %s", registry.profiler.out_dir.resolve())
+    return registry.profiler
+
+
+def disable_profiling(registry=None) -> Optional[PhaseProfiler]:
+    """Desliga o perfil e devolve o `PhaseProfiler` que estava ativo (se havia)."""
+    if registry is None:
+        from cnes_metrics import METRICS as registry
+    profiler, registry.profiler = registry.profiler, None
+    return profiler
@@ -0,0 +1,233 @@
+# cnes_shards.py
+# -*- coding: utf-8 -*-
+"""
+Pré-ingestão dos CSVs grandes do CNES para o Spark: cada `tb*.csv` (latin1) é
+dividido em N fatias alinhadas a registros, sem cortar campo entre aspas com
+quebra de linha, e cada fatia é transcodificada para UTF-8 num processo à parte,
+com o cabeçalho repetido. O Spark lê as fatias com o leitor UTF-8 padrão (mais
+rápido que o caminho com `encoding=latin1`) e as tarefas ficam de tamanho
+parecido, sem um arquivo gigante concentrando o trabalho.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import math
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from cnes_metrics import METRICS
+from cnes_parquet import CSV_ENCODING
+
+LOGGER = logging.getLogger("CNES_SHARDS")
+
+DEFAULT_SHARD_BYTES = 128 * 1024 * 1024
+_SCAN_BLOCK = 8 * 1024 * 1024
+
+
+class ShardReport(NamedTuple):
+    """Fatias geradas a partir de um CSV (na ordem do arquivo) e bytes lidos dele."""
+
+    source: Path
+    shards: List[Path]
+    bytes: int
+
+
+# =================== Fronteiras ===================
+
+
+def _count_quotes(mm: mmap.mmap, start: int, end: int) -> int:
+    total = 0
+    for i in range(start, end, _SCAN_BLOCK):
+        total += mm[i : min(end, i + _SCAN_BLOCK)].count(b'"')
+    return total
+
+
+def record_boundaries(path: Union[str, Path], shards: int) -> Tuple[bytes, List[int]]:
+    """
+    Cabeçalho (bytes) e offsets de início/fim das `shards` fatias de registros.
+    Cada corte avança do alvo (tamanho / shards) até o primeiro `\\n` fora de
+    aspas; a paridade das aspas é contada desde o início dos dados, então um
+    campo com quebra de linha nunca é partido. Fatias vazias são descartadas.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    if size == 0:
+        return b"", [0, 0]
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        inicio = pos = _next_record(mm, 0, 0, size)
+        header = mm[:inicio]
+        cortes = [inicio]
+        aspas = 0  # aspas em [inicio, pos)
+        passo = (size - inicio) / max(1, shards)
+        for n in range(1, shards):
+            alvo = int(inicio + passo * n)
+            if alvo <= pos:
+                continue
+            aspas += _count_quotes(mm, pos, alvo)
+            pos = _next_record(mm, alvo, aspas, size)
+            aspas = 0
+            if pos >= size:
+                break
+            cortes.append(pos)
+        cortes.append(size)
+    return header, sorted(set(cortes))
+
+
+def _next_record(mm: mmap.mmap, pos: int, aspas: int, size: int) -> int:
+    """Início do próximo registro a partir de `pos`, sabendo as aspas já vistas antes dele."""
+    while True:
+        nl = mm.find(b"\n", pos)
+        if nl < 0:
+            return size
+        aspas += mm[pos:nl].count(b'"')
+        pos = nl + 1
+        if aspas % 2 == 0:
+            return pos
+
+
+# =================== Transcodificação ===================
+
+
+def _transcode_range(
+    src: str, start: int, end: int, dst: str, header: bytes, chunk_size: int = 4 * 1024 * 1024
+) -> int:
+    """Executa no processo filho: cabeçalho + [start, end) de `src` em UTF-8 em `dst`."""
+    tmp = dst + ".part"
+    try:
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            # latin1 é um byte por caractere: qualquer corte de chunk decodifica certo
+            fout.write(header.decode(CSV_ENCODING).encode("utf-8"))
+            fin.seek(start)
+            restante = end - start
+            while restante > 0:
+                chunk = fin.read(min(chunk_size, restante))
+                if not chunk:
+                    raise EOFError(f"{src} terminou antes do esperado ({restante} bytes a ler).")
+                fout.write(chunk.decode(CSV_ENCODING).encode("utf-8"))
+                restante -= len(chunk)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    os.replace(tmp, dst)
+    return end - start
+
+
+def shard_plan(
+    path: Union[str, Path],
+    out_dir: Union[str, Path],
+    *,
+    shards: Optional[int] = None,
+    shard_bytes: int = DEFAULT_SHARD_BYTES,
+) -> Tuple[bytes, List[Tuple[int, int, Path]]]:
+    """
+    Cabeçalho e (início, fim, destino) de cada fatia de `path`. Sem `shards`,
+    usa uma fatia a cada `shard_bytes`. As fatias são
+    `<out_dir>/<nome>-00000-of-00008.csv` (o nome da tabela continua no início).
+    """
+    path = Path(path)
+    if shards is None:
+        shards = max(1, math.ceil(path.stat().st_size / shard_bytes))
+    header, cortes = record_boundaries(path, shards)
+    faixas = list(zip(cortes, cortes[1:])) or [(cortes[0], cortes[0])]  # só cabeçalho
+    n = len(faixas)
+    plano = [
+        (a, b, Path(out_dir) / f"{path.stem}-{i:05d}-of-{n:05d}.csv")
+        for i, (a, b) in enumerate(faixas)
+    ]
+    return header, plano
+
+
+def shard_csvs(
+    paths: List[Union[str, Path]],
+    out_dir: Union[str, Path],
+    *,
+    shards: Optional[int] = None,
+    shard_bytes: int = DEFAULT_SHARD_BYTES,
+    workers: Optional[int] = None,
+) -> List[ShardReport]:
+    """
+    Divide e transcodifica vários CSVs num único pool de processos (maiores
+    fatias primeiro). Cada fatia é publicada por rename atômico; se alguma falhar,
+    a exceção propaga depois que as demais terminam.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    planos: Dict[Path, Tuple[bytes, List[Tuple[int, int, Path]]]] = {
+        Path(p): shard_plan(p, out_dir, shards=shards, shard_bytes=shard_bytes) for p in paths
+    }
+    tarefas = sorted(
+        ((src, a, b, dst, header) for src, (header, plano) in planos.items() for a, b, dst in plano),
+        key=lambda t: t[1] - t[2],
+    )
+    total = sum(b - a for _, a, b, _, _ in tarefas)
+    erros: List[BaseException] = []
+    with METRICS.phase("shard", total=total, label="Fatiando"), ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1
+    ) as pool:
+        futures = {
+            pool.submit(_transcode_range, str(src), a, b, str(dst), header): dst
+            for src, a, b, dst, header in tarefas
+        }
+        for fut in as_completed(futures):
+            try:
+                METRICS.inc("cnes_bytes_total", fut.result(), phase="shard")
+            except Exception as exc:
+                LOGGER.error("Falha ao gerar %s: %s", futures[fut], exc)
+                erros.append(exc)
+    if erros:
+        raise erros[0]
+
+    reports = [
+        ShardReport(src, [dst for _, _, dst in plano], sum(b - a for a, b, _ in plano) + len(header))
+        for src, (header, plano) in planos.items()
+    ]
+    for r in reports:
+        LOGGER.info("%s: %s fatia(s) UTF-8 em %s", r.source.name, len(r.shards), out_dir)
+    return reports
+
+
+def shard_directory(
+    pasta: Union[str, Path],
+    out_dir: Union[str, Path],
+    *,
+    pattern: str = "tb*.csv",
+    **kwargs,
+) -> List[ShardReport]:
+    """`shard_csvs` para os CSVs de `pasta` que casam com `pattern`."""
+    paths = sorted(p for p in Path(pasta).glob(pattern) if p.is_file())
+    if not paths:
+        raise FileNotFoundError(f"Nenhum {pattern} em {pasta}")
+    return shard_csvs(paths, out_dir, **kwargs)
+
+
+# =================== Execução ===================
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Fatias UTF-8 dos CSVs do CNES para o Spark.")
+    parser.add_argument("entrada", help="Pasta com os tb*.csv extraídos.")
+    parser.add_argument("saida", help="Pasta das fatias.")
+    parser.add_argument("--fatias", type=int, help="Fatias por CSV (padrão: uma a cada --mb-por-fatia).")
+    parser.add_argument("--mb-por-fatia", type=int, default=DEFAULT_SHARD_BYTES // (1024 * 1024))
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    for r in shard_directory(
+        args.entrada,
+        args.saida,
+        shards=args.fatias,
+        shard_bytes=args.mb_por_fatia * 1024 * 1024,
+        workers=args.workers,
+    ):
+        print(f"{r.source}\t{len(r.shards)}\t{r.bytes}")
+
+
+if __name__ == "__main__":
+    main()
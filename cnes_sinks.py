@@ -0,0 +1,439 @@
+# cnes_sinks.py
+# -*- coding: utf-8 -*-
+"""
+Destinos ("sinks") para a extração do CNES: pasta local, sistema de arquivos
+remoto no estilo fsspec (abfss://, s3://, ...) ou memória (testes). Cada membro
+do ZIP é gravado por streaming direto no destino final e publicado de forma
+atômica; não há pasta de staging nem cópia posterior (`copytree`, `fs.cp`).
+
+Membros idênticos entre competências (mesmo CRC-32 e tamanho no diretório
+central) podem ser reaproveitados com um `MemberManifest`: em vez de inflar e
+enviar de novo, o destino ganha um hardlink (pasta local) ou uma cópia feita
+pelo próprio servidor (fsspec) da cópia já publicada.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from cnes_metrics import METRICS
+
+try:
+    import fsspec
+except ImportError:  # fsspec é opcional (só para destinos remotos)
+    fsspec = None
+
+LOGGER = logging.getLogger("CNES_SINKS")
+
+
+class Sink:
+    """
+    Destino de arquivos por caminho relativo. `open_write(nome)` devolve um
+    arquivo binário: se o bloco terminar sem erro, o conteúdo é publicado em
+    `nome` de uma vez; se houver exceção, nada aparece no destino.
+    """
+
+    def open_write(self, name: str) -> "contextlib.AbstractContextManager[BinaryIO]":
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def location(self, name: str) -> str:
+        """Endereço absoluto de `nome` (gravado no `MemberManifest`)."""
+        raise NotImplementedError
+
+    def copy_from(self, location: str, name: str, size: int) -> bool:
+        """
+        Publica em `nome` uma cópia do arquivo em `location` sem reescrever os
+        bytes pelo cliente. False se não for possível (origem ausente, com
+        outro tamanho ou em outro sistema de arquivos): o chamador extrai.
+        """
+        return False
+
+
+class LocalSink(Sink):
+    """Pasta local: grava `<nome>.part` e publica com `os.replace`."""
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(str(root).replace("file:", "", 1))
+
+    def path(self, name: str) -> Path:
+        return self.root / name
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        target = self.path(name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".part")
+        try:
+            with tmp.open("wb") as f:
+                yield f
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, target)
+
+    def exists(self, name: str) -> bool:
+        return self.path(name).exists()
+
+    def location(self, name: str) -> str:
+        return str(self.path(name).resolve())
+
+    def copy_from(self, location: str, name: str, size: int) -> bool:
+        """Hardlink (mesmo volume) ou, se não der, cópia pelo kernel; publicado com `os.replace`."""
+        origem = Path(location)
+        if "://" in location or not origem.is_file() or origem.stat().st_size != size:
+            return False
+        target = self.path(name)
+        if target.exists() and os.path.samefile(origem, target):
+            return True
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".part")
+        tmp.unlink(missing_ok=True)
+        try:
+            try:
+                os.link(origem, tmp)
+            except OSError:  # outro volume ou sem suporte a hardlink
+                shutil.copyfile(origem, tmp)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, target)
+        return True
+
+    def __repr__(self) -> str:
+        return f"LocalSink({str(self.root)!r})"
+
+
+class FsspecSink(Sink):
+    """
+    Sistema de arquivos fsspec (ex.: `abfss://container@conta.dfs.core.windows.net/...`).
+    Grava `<nome>.part` e publica com `fs.mv` (rename atômico no ADLS Gen2 com
+    namespace hierárquico). Com `rename=False`, grava direto no nome final: em
+    object stores o objeto só passa a existir quando o upload é concluído.
+    """
+
+    def __init__(self, url: str, *, rename: bool = True, **storage_options) -> None:
+        if fsspec is None:
+            raise RuntimeError("fsspec não instalado: necessário para destinos remotos.")
+        self.fs, self.root = fsspec.core.url_to_fs(url, **storage_options)
+        self.root = self.root.rstrip("/")
+        self.rename = rename
+
+    def path(self, name: str) -> str:
+        return f"{self.root}/{name}"
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        target = self.path(name)
+        self.fs.makedirs(target.rsplit("/", 1)[0], exist_ok=True)
+        tmp = target + ".part" if self.rename else target
+        try:
+            with self.fs.open(tmp, "wb") as f:
+                yield f
+        except BaseException:
+            with contextlib.suppress(Exception):
+                self.fs.rm(tmp)
+            raise
+        if self.rename:
+            self.fs.mv(tmp, target)
+
+    def exists(self, name: str) -> bool:
+        return self.fs.exists(self.path(name))
+
+    def location(self, name: str) -> str:
+        return self.fs.unstrip_protocol(self.path(name))
+
+    def copy_from(self, location: str, name: str, size: int) -> bool:
+        """Cópia feita pelo servidor (`fs.copy`, ex.: copy blob no ADLS) quando a origem está no mesmo fs."""
+        fs, origem = fsspec.core.url_to_fs(location)
+        if fs.protocol != self.fs.protocol:
+            return False
+        try:
+            if self.fs.size(origem) != size:
+                return False
+        except FileNotFoundError:
+            return False
+        target = self.path(name)
+        if target == origem:
+            return True
+        self.fs.makedirs(target.rsplit("/", 1)[0], exist_ok=True)
+        tmp = target + ".part" if self.rename else target
+        try:
+            self.fs.copy(origem, tmp)
+        except BaseException:
+            with contextlib.suppress(Exception):
+                self.fs.rm(tmp)
+            raise
+        if self.rename:
+            self.fs.mv(tmp, target)
+        return True
+
+    def __repr__(self) -> str:
+        return f"FsspecSink({self.fs.protocol!r}, {self.root!r})"
+
+
+class MssparkutilsSink(Sink):
+    """
+    Datalake pelo `mssparkutils.fs` do Synapse/Fabric (abfss://...), com as
+    credenciais do linked service do pool, sem fsspec/adlfs. Como a API só
+    copia arquivos, cada membro é gravado num temporário local próprio (não há
+    pasta de staging com o ZIP inteiro), enviado com `fs.cp` para `<nome>.part`
+    e publicado com `fs.mv` (rename atômico no ADLS Gen2).
+    """
+
+    def __init__(self, url: str, fs) -> None:
+        self.fs = fs  # mssparkutils.fs (global do notebook)
+        self.root = str(url).rstrip("/")
+
+    def path(self, name: str) -> str:
+        return f"{self.root}/{name}"
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        target = self.path(name)
+        fd, local = tempfile.mkstemp(suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            self.fs.cp("file:" + Path(local).as_posix(), target + ".part")
+            self.fs.mv(target + ".part", target, True, True)
+        except BaseException:
+            with contextlib.suppress(Exception):
+                self.fs.rm(target + ".part")
+            raise
+        finally:
+            os.unlink(local)
+
+    def exists(self, name: str) -> bool:
+        return self.fs.exists(self.path(name))
+
+    def location(self, name: str) -> str:
+        return self.path(name)
+
+    def copy_from(self, location: str, name: str, size: int) -> bool:
+        """Cópia dentro do datalake (`fs.cp`), sem passar os bytes pelo driver."""
+        if location.split("://", 1)[0] != self.root.split("://", 1)[0]:
+            return False
+        try:
+            arquivos = self.fs.ls(location)
+        except Exception:  # origem apagada (o mssparkutils não tem exceção própria)
+            return False
+        if len(arquivos) != 1 or arquivos[0].size != size:
+            return False
+        target = self.path(name)
+        if target == location:
+            return True
+        self.fs.cp(location, target + ".part")
+        self.fs.mv(target + ".part", target, True, True)
+        return True
+
+    def __repr__(self) -> str:
+        return f"MssparkutilsSink({self.root!r})"
+
+
+class MemorySink(Sink):
+    """Destino em memória (testes): `files[nome]` só existe após a publicação."""
+
+    def __init__(self) -> None:
+        self.files: Dict[str, bytes] = {}
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        buf = io.BytesIO()
+        yield buf
+        self.files[name] = buf.getvalue()
+
+    def exists(self, name: str) -> bool:
+        return name in self.files
+
+    def location(self, name: str) -> str:
+        return f"memory:{id(self)}/{name}"
+
+    def copy_from(self, location: str, name: str, size: int) -> bool:
+        prefixo = f"memory:{id(self)}/"
+        origem = location[len(prefixo):] if location.startswith(prefixo) else None
+        if origem not in self.files or len(self.files[origem]) != size:
+            return False
+        self.files[name] = self.files[origem]
+        return True
+
+
+def sink_for(destino: Union[str, Path, Sink], *, fs=None, **storage_options) -> Sink:
+    """
+    `Sink` para `destino`: URL com protocolo (exceto file:) vira `FsspecSink`,
+    ou `MssparkutilsSink` se `fs` (o `mssparkutils.fs` do notebook) for dado; o
+    resto, `LocalSink`.
+    """
+    if isinstance(destino, Sink):
+        return destino
+    texto = str(destino)
+    if "://" in texto and not texto.startswith("file:"):
+        if fs is not None:
+            return MssparkutilsSink(texto, fs)
+        return FsspecSink(texto, **storage_options)
+    return LocalSink(texto)
+
+
+# =================== Membros repetidos entre competências ===================
+
+# AAAAMM logo antes da extensão: tbEstabelecimento202508.csv -> tbEstabelecimento.csv
+_COMPETENCIA_NO_NOME = re.compile(r"\d{6}(?=\.[^./]+$)")
+
+
+def member_key(info: zipfile.ZipInfo) -> str:
+    """
+    Chave do conteúdo de um membro pelo diretório central: nome sem a
+    competência, CRC-32 e tamanho descompactado. O nome entra sem o AAAAMM,
+    que muda todo mês mesmo quando o CSV é byte a byte igual.
+    """
+    nome = _COMPETENCIA_NO_NOME.sub("", info.filename)
+    return f"{nome}:{info.CRC:08x}:{info.file_size}"
+
+
+class ManifestEntry(NamedTuple):
+    """Cópia já publicada de um membro: onde está e de qual membro/ZIP veio."""
+
+    location: str
+    member: str
+    source: str
+
+
+class MemberManifest:
+    """
+    `member_key` -> `ManifestEntry` da primeira cópia publicada, em JSON num
+    caminho local ou URL fsspec (ex.: ao lado das pastas das competências no
+    datalake); com `fs` (`mssparkutils.fs`), lido e gravado por ele.
+    Thread-safe; `save()` grava tudo de uma vez (atômico no local).
+    """
+
+    def __init__(self, location: Union[str, Path], *, fs=None) -> None:
+        self.location = str(location)
+        self.entries: Dict[str, ManifestEntry] = {}
+        self._lock = threading.Lock()
+        self._fs = fs
+        self._remote = "://" in self.location and not self.location.startswith("file:")
+        if self._remote and fs is None and fsspec is None:
+            raise RuntimeError("fsspec não instalado: necessário para manifesto remoto.")
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            if self._fs is not None:
+                if not self._fs.exists(self.location):
+                    return
+                dados = json.loads(self._fs.head(self.location, 64 * 1024 * 1024))
+            elif self._remote:
+                with fsspec.open(self.location, "rb") as f:
+                    dados = json.loads(f.read().decode("utf-8"))
+            else:
+                dados = json.loads(Path(self.location).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return
+        self.entries = {k: ManifestEntry(**v) for k, v in dados.items()}
+
+    def lookup(self, info: zipfile.ZipInfo) -> Optional[ManifestEntry]:
+        with self._lock:
+            return self.entries.get(member_key(info))
+
+    def record(self, info: zipfile.ZipInfo, location: str, source: str = "") -> None:
+        with self._lock:
+            self.entries[member_key(info)] = ManifestEntry(location, info.filename, source)
+
+    def save(self) -> None:
+        with self._lock:
+            texto = json.dumps({k: e._asdict() for k, e in sorted(self.entries.items())}, indent=1)
+        if self._fs is not None:
+            self._fs.put(self.location, texto, True)
+            return
+        if self._remote:
+            with fsspec.open(self.location, "wb") as f:
+                f.write(texto.encode("utf-8"))
+            return
+        path = Path(self.location)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        tmp.write_text(texto, encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def reuse_member(
+    sink: Sink, info: zipfile.ZipInfo, name: str, manifest: Optional[MemberManifest]
+) -> bool:
+    """
+    Publica `info` em `name` a partir da cópia registrada no manifesto, sem
+    inflar nem reenviar. False se não há cópia utilizável: o chamador extrai e
+    chama `manifest.record`.
+    """
+    if manifest is None or info.is_dir():
+        return False
+    entry = manifest.lookup(info)
+    if entry is None or not sink.copy_from(entry.location, name, info.file_size):
+        return False
+    LOGGER.info("%s igual a %s (CRC %08x): reaproveitado.", info.filename, entry.location, info.CRC)
+    METRICS.inc("cnes_dedup_members_total", result="reused")
+    METRICS.inc("cnes_dedup_bytes_total", info.file_size)
+    return True
+
+
+# =================== Extração ===================
+
+
+def extract_to_sink(
+    zf: zipfile.ZipFile,
+    sink: Union[str, Path, Sink],
+    members: Optional[Iterable[str]] = None,
+    *,
+    prefix: str = "",
+    chunk_size: int = 1024 * 1024,
+    manifest: Optional[MemberManifest] = None,
+) -> List[str]:
+    """
+    Extrai `members` (padrão: todos) de `zf` direto para `sink`, em `prefix + nome`.
+    O CRC é conferido pelo `ZipExtFile` no fim de cada membro; membro corrompido
+    levanta `BadZipFile` e não é publicado. Com `manifest`, membros já
+    publicados antes com o mesmo CRC-32/tamanho são copiados da cópia anterior
+    (`reuse_member`) e os extraídos entram no manifesto. Retorna os nomes publicados.
+    """
+    sink = sink_for(sink)
+    nomes = list(members) if members is not None else zf.namelist()
+    publicados = []
+    with METRICS.phase("extract", label="Extraindo"):
+        for nome in nomes:
+            info = zf.getinfo(nome)
+            if info.is_dir():
+                continue
+            if reuse_member(sink, info, prefix + nome, manifest):
+                publicados.append(prefix + nome)
+                continue
+            LOGGER.info("Extraindo %s -> %s", nome, sink)
+            try:
+                with zf.open(info, "r") as src, sink.open_write(prefix + nome) as dst:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        METRICS.inc("cnes_bytes_total", len(chunk), phase="extract")
+            except (zipfile.BadZipFile, zlib.error) as exc:
+                raise zipfile.BadZipFile(f"Membro corrompido: {nome} ({exc})") from exc
+            publicados.append(prefix + nome)
+            if manifest is not None:
+                manifest.record(info, sink.location(prefix + nome), str(zf.filename or ""))
+                METRICS.inc("cnes_dedup_members_total", result="extracted")
+    if manifest is not None:
+        manifest.save()
+    return publicados
@@ -0,0 +1,469 @@
+# cnes_streaming.py
+# -*- coding: utf-8 -*-
+"""
+Extração enquanto o download acontece. O ZIP é lido do início conforme os bytes
+chegam ao disco (`on_write` do downloader): cada cabeçalho local
+(`PK\\x03\\x04`) é interpretado, e os dados do membro são inflados e gravados no
+destino à medida que chegam, com CRC conferido no fim. Assim o tempo de rede e o
+de CPU se sobrepõem. Quando o download termina, o diretório central valida o que
+foi extraído; membros que o streaming não consegue tratar (STORED com data
+descriptor, método não suportado, criptografia, divergência com o diretório
+central) são extraídos do arquivo completo, do jeito tradicional.
+"""
+
+from __future__ import annotations
+
+import logging
+import struct
+import threading
+import zipfile
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from cnes_downloader import DownloadResult, PinnedSession, download_with_resume_pigitnned
+from cnes_metrics import METRICS
+from cnes_sinks import Sink, extract_to_sink, sink_for
+
+LOGGER = logging.getLogger("CNES_STREAMING")
+
+_LOCAL = struct.Struct("<4sHHHHHIIIHH")  # cabeçalho local (30 bytes)
+_SIG_LOCAL = b"PK\x03\x04"
+_SIG_DESCRIPTOR = b"PK\x07\x08"
+_SIG_FIM = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06", b"PK\x06\x07")
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+# =================== Arquivo que ainda está chegando ===================
+
+
+class WrittenRanges:
+    """
+    Trechos do arquivo que já estão em disco, alimentado por `on_write(offset, n)`
+    do downloader (o segmentado grava fora de ordem). Quem lê espera pelo
+    prefixo contínuo (`prefix`); `finish(size)` encerra o arquivo, `fail(exc)`
+    propaga o erro do download para o leitor.
+    """
+
+    def __init__(self) -> None:
+        self.prefix = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._runs: Dict[int, int] = {}  # início -> fim, só depois do prefixo
+        self._ends: Dict[int, int] = {}  # fim -> início
+        self._writes = 0
+        self._cond = threading.Condition()
+
+    def add(self, offset: int, n: int) -> None:
+        end = offset + n
+        with self._cond:
+            if offset <= self.prefix:
+                self.prefix = max(self.prefix, end)
+            else:
+                start = self._ends.pop(offset, offset)  # trecho colado no fim de outro
+                if start in self._runs:
+                    end = max(end, self._runs[start])
+                self._runs[start] = end
+                self._ends[end] = start
+            while self.prefix in self._runs:
+                fim = self._runs.pop(self.prefix)
+                self._ends.pop(fim, None)
+                self.prefix = fim
+            self._writes += 1
+            self._cond.notify_all()
+
+    def finish(self, size: int) -> None:
+        with self._cond:
+            self.prefix = max(self.prefix, size)
+            self.done = True
+            self._writes += 1
+            self._cond.notify_all()
+
+    def fail(self, exc: BaseException) -> None:
+        with self._cond:
+            self.error = exc
+            self.done = True
+            self._cond.notify_all()
+
+    def wait_write(self, writes: int, timeout: Optional[float] = None) -> None:
+        """Espera qualquer escrita nova após `writes` (ou o fim)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._writes != writes or self.done, timeout)
+
+    def wait(self, pos: int, writes: int, timeout: Optional[float] = None) -> tuple:
+        """Espera o prefixo passar de `pos` (ou uma nova escrita após `writes`); devolve (prefixo, escritas, fim)."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.prefix > pos or self.done or self._writes != writes, timeout
+            )
+            if self.error is not None:
+                raise self.error
+            return self.prefix, self._writes, self.done
+
+
+class GrowingFile:
+    """Leitura sequencial de `path` que bloqueia até os bytes pedidos estarem em disco."""
+
+    def __init__(self, path: Union[str, Path], ranges: WrittenRanges) -> None:
+        self.path = Path(path)
+        self.ranges = ranges
+        self.pos = 0
+        self._f: Optional[BinaryIO] = None
+        self._writes = -1
+
+    def read(self, n: int) -> bytes:
+        while True:
+            prefix, self._writes, done = self.ranges.wait(self.pos, self._writes, timeout=1.0)
+            disponivel = prefix - self.pos
+            if disponivel <= 0:
+                if done:
+                    return b""
+                continue
+            if self._f is None:
+                try:
+                    self._f = self.path.open("rb")
+                except FileNotFoundError:
+                    continue
+            self._f.seek(self.pos)
+            data = self._f.read(min(n, disponivel))
+            if data:
+                self.pos += len(data)
+                return data
+            if done:
+                return b""
+            # Leitura curta: o downloader recomeçou o arquivo (servidor ignorou Range)
+            self.ranges.wait_write(self._writes, timeout=1.0)
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+
+
+class _Reader:
+    """Buffer com devolução (`unread`) sobre um arquivo de leitura sequencial."""
+
+    def __init__(self, raw, chunk_size: int) -> None:
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.offset = 0  # posição lógica no ZIP
+        self._buf = b""
+
+    def read_some(self, n: int) -> bytes:
+        if self._buf:
+            data, self._buf = self._buf[:n], self._buf[n:]
+        else:
+            data = self.raw.read(min(n, self.chunk_size))
+        self.offset += len(data)
+        return data
+
+    def read_exact(self, n: int) -> bytes:
+        partes, falta = [], n
+        while falta:
+            data = self.read_some(falta)
+            if not data:
+                raise EOFError(f"ZIP terminou no meio de uma estrutura (offset {self.offset}).")
+            partes.append(data)
+            falta -= len(data)
+        return b"".join(partes)
+
+    def unread(self, data: bytes) -> None:
+        self._buf = data + self._buf
+        self.offset -= len(data)
+
+
+# =================== Parser de cabeçalhos locais ===================
+
+
+class StreamedMember(NamedTuple):
+    """Membro visto no streaming: onde começa, o que o cabeçalho/descriptor declara e se foi publicado."""
+
+    name: str
+    header_offset: int
+    crc: int
+    compress_size: int
+    file_size: int
+    published: bool
+    error: Optional[str]
+
+
+class _Adiado(Exception):
+    """O streaming não sabe onde o membro termina: o resto fica para o diretório central."""
+
+
+def _zip64_sizes(extra: bytes) -> Optional[tuple]:
+    i = 0
+    while i + 4 <= len(extra):
+        tag, size = struct.unpack_from("<HH", extra, i)
+        if tag == 0x0001 and size >= 16:
+            return struct.unpack_from("<QQ", extra, i + 4)  # (descompactado, compactado)
+        i += 4 + size
+    return None
+
+
+class StreamingZipExtractor:
+    """
+    Percorre os cabeçalhos locais de `source` (qualquer objeto com `read(n)`) e
+    publica cada membro em `sink` conforme os dados chegam. `members` limita o
+    que é gravado (os demais são só atravessados). Para no diretório central ou
+    no primeiro membro cujo fim não dá para achar em streaming.
+    """
+
+    def __init__(
+        self,
+        source,
+        sink: Union[str, Path, Sink],
+        members: Optional[Iterable[str]] = None,
+        *,
+        prefix: str = "",
+        chunk_size: int = 1024 * 1024,
+    ) -> None:
+        self.reader = _Reader(source, chunk_size)
+        self.sink = sink_for(sink)
+        self.members = set(members) if members is not None else None
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.seen: Dict[str, StreamedMember] = {}
+        self.stopped: Optional[str] = None  # motivo da parada antes do diretório central
+
+    def run(self) -> Dict[str, StreamedMember]:
+        try:
+            while True:
+                sig = self.reader.read_some(4)
+                if not sig:
+                    self.stopped = "arquivo terminou sem diretório central"
+                    break
+                if len(sig) < 4:
+                    sig += self.reader.read_exact(4 - len(sig))
+                if sig in _SIG_FIM:
+                    break
+                if sig != _SIG_LOCAL:
+                    self.stopped = f"assinatura inesperada {sig!r} no offset {self.reader.offset - 4}"
+                    break
+                self._member(self.reader.offset - 4)
+        except _Adiado as exc:
+            self.stopped = str(exc)
+        except EOFError as exc:
+            self.stopped = str(exc)
+        if self.stopped:
+            LOGGER.info("Streaming interrompido (%s); o restante sai do diretório central.", self.stopped)
+        return self.seen
+
+    def _member(self, header_offset: int) -> None:
+        (_, _, flags, method, _, _, crc, csize, usize, name_len, extra_len) = _LOCAL.unpack(
+            _SIG_LOCAL + self.reader.read_exact(26)
+        )
+        raw_name = self.reader.read_exact(name_len)
+        extra = self.reader.read_exact(extra_len)
+        name = raw_name.decode("utf-8" if flags & _FLAG_UTF8 else "cp437")
+        zip64 = _zip64_sizes(extra)
+        if zip64 is not None and (csize == 0xFFFFFFFF or usize == 0xFFFFFFFF):
+            usize, csize = zip64
+        descriptor = bool(flags & _FLAG_DESCRIPTOR)
+
+        if flags & _FLAG_ENCRYPTED:
+            raise _Adiado(f"{name}: membro criptografado")
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            if descriptor:
+                raise _Adiado(f"{name}: método {method} com data descriptor")
+            self._skip(csize)
+            self.seen[name] = StreamedMember(name, header_offset, crc, csize, usize, False, f"método {method}")
+            return
+        if method == zipfile.ZIP_STORED and descriptor:
+            raise _Adiado(f"{name}: STORED com data descriptor")
+
+        gravar = not name.endswith("/") and (self.members is None or name in self.members)
+        erro = None
+        inicio_dados = self.reader.offset
+        consumido = False
+        try:
+            if gravar:
+                with self.sink.open_write(self.prefix + name) as dst:
+                    real_crc, real_size = self._copy(method, csize, descriptor, dst.write)
+                    crc, csize, usize = self._descriptor(descriptor, zip64, crc, csize, usize)
+                    consumido = True
+                    if real_crc != crc or real_size != usize:
+                        raise zipfile.BadZipFile(f"CRC/tamanho divergente em {name}")
+            else:
+                self._copy(method, csize, descriptor, None)
+                crc, csize, usize = self._descriptor(descriptor, zip64, crc, csize, usize)
+        except (zipfile.BadZipFile, zlib.error) as exc:
+            erro = str(exc)
+            LOGGER.warning("Membro %s descartado no streaming: %s", name, exc)
+            if not consumido:
+                if descriptor:
+                    raise _Adiado(f"{name}: {exc}") from exc
+                self._skip(inicio_dados + csize - self.reader.offset)
+        self.seen[name] = StreamedMember(name, header_offset, crc, csize, usize, gravar and erro is None, erro)
+
+    def _skip(self, n: int) -> None:
+        while n:
+            data = self.reader.read_some(min(n, self.chunk_size))
+            if not data:
+                raise EOFError("ZIP terminou no meio dos dados de um membro.")
+            n -= len(data)
+
+    def _copy(self, method: int, csize: int, descriptor: bool, write: Optional[Callable[[bytes], object]]):
+        """Copia/infla os dados do membro; devolve (crc, tamanho) do que saiu."""
+        crc = size = 0
+        falta = None if descriptor else csize
+        inflate = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+        while falta is None or falta > 0:
+            data = self.reader.read_some(self.chunk_size if falta is None else min(falta, self.chunk_size))
+            if not data:
+                raise EOFError("ZIP terminou no meio dos dados de um membro.")
+            if falta is not None:
+                falta -= len(data)
+            while True:
+                if inflate is not None:
+                    # Saída limitada por chamada: a memória não depende da taxa de compressão
+                    out = inflate.decompress(data, 4 * self.chunk_size)
+                    # após o fim do fluxo, o que sobrou fica em unused_data
+                    data = b"" if inflate.eof else inflate.unconsumed_tail
+                else:
+                    out, data = data, b""
+                if out:
+                    crc = zlib.crc32(out, crc)
+                    size += len(out)
+                    if write is not None:
+                        write(out)
+                        METRICS.inc("cnes_bytes_total", len(out), phase="extract")
+                # Entrada toda consumida não quer dizer saída toda entregue: com o
+                # limite por chamada, o zlib pode guardar saída pendente (membros
+                # muito compressíveis). Continua com b"" até o fim ou sem saída.
+                if not data and (inflate is None or inflate.eof or not out):
+                    break
+            if falta is None and inflate.eof:
+                # Com data descriptor, o fim do fluxo deflate é o fim do membro
+                if inflate.unused_data:
+                    self.reader.unread(inflate.unused_data)
+                break
+        if inflate is not None and not inflate.eof:
+            raise zipfile.BadZipFile("fluxo deflate incompleto")
+        return crc, size
+
+    def _descriptor(self, descriptor: bool, zip64, crc: int, csize: int, usize: int) -> tuple:
+        if not descriptor:
+            return crc, csize, usize
+        head = self.reader.read_exact(4)
+        if head == _SIG_DESCRIPTOR:
+            head = self.reader.read_exact(4)
+        crc = struct.unpack("<I", head)[0]
+        if zip64 is not None:
+            csize, usize = struct.unpack("<QQ", self.reader.read_exact(16))
+        else:
+            csize, usize = struct.unpack("<II", self.reader.read_exact(8))
+        return crc, csize, usize
+
+
+# =================== Validação pelo diretório central ===================
+
+
+class StreamExtractionReport(NamedTuple):
+    """`streamed`: publicados durante o download; `fallback`: extraídos do arquivo completo."""
+
+    download: DownloadResult
+    streamed: List[str]
+    fallback: List[str]
+    failed: Dict[str, str]
+
+
+def finish_from_central_directory(
+    zip_path: Union[str, Path],
+    sink: Union[str, Path, Sink],
+    seen: Dict[str, StreamedMember],
+    members: Optional[Iterable[str]] = None,
+    *,
+    prefix: str = "",
+) -> tuple:
+    """
+    Confere cada entrada do diretório central com o que o streaming publicou
+    (offset do cabeçalho, CRC e tamanhos); o que faltar ou divergir é extraído
+    de `zip_path` com `extract_to_sink`. Retorna (streamed, fallback, failed).
+    """
+    sink = sink_for(sink)
+    alvo = set(members) if members is not None else None
+    streamed, fallback, failed = [], [], {}
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        for info in zf.infolist():
+            if info.is_dir() or (alvo is not None and info.filename not in alvo):
+                continue
+            m = seen.get(info.filename)
+            if (
+                m is not None
+                and m.published
+                and m.header_offset == info.header_offset
+                and (m.crc, m.compress_size, m.file_size) == (info.CRC, info.compress_size, info.file_size)
+            ):
+                streamed.append(info.filename)
+                continue
+            try:
+                extract_to_sink(zf, sink, [info.filename], prefix=prefix)
+                fallback.append(info.filename)
+            except zipfile.BadZipFile as exc:
+                failed[info.filename] = str(exc)
+        for nome in set(seen) - set(zf.namelist()):
+            LOGGER.warning("%s tem cabeçalho local mas não está no diretório central.", nome)
+    return streamed, fallback, failed
+
+
+def download_and_extract(
+    url: str,
+    destino_zip: Union[str, Path],
+    destino: Union[str, Path, Sink],
+    *,
+    members: Optional[Iterable[str]] = None,
+    prefix: str = "",
+    pin_hex: Optional[str] = None,
+    proxy_url: Optional[str] = None,
+    opener: Optional[PinnedSession] = None,
+    **kwargs,
+) -> StreamExtractionReport:
+    """
+    Baixa `url` em `destino_zip` (`download_with_resume_pigitnned`, com retomada,
+    segmentos etc. via `kwargs`) e, numa thread em paralelo, extrai os membros
+    para `destino` à medida que chegam. No fim, o diretório central valida o
+    streaming e completa o que faltou.
+    """
+    destino_zip = Path(destino_zip)
+    members = list(members) if members is not None else None
+    sink = sink_for(destino)
+    if opener is None:
+        opener = PinnedSession(pin_hex, proxy_url=proxy_url)
+
+    ranges = WrittenRanges()
+    source = GrowingFile(destino_zip, ranges)
+    extractor = StreamingZipExtractor(source, sink, members, prefix=prefix)
+    falha: List[BaseException] = []
+
+    def _run() -> None:
+        try:
+            with METRICS.phase("extract", label="Extraindo"):
+                extractor.run()
+        except BaseException as exc:  # erro do download (via WrittenRanges) ou de gravação
+            falha.append(exc)
+
+    thread = threading.Thread(target=_run, name="cnes-stream-extract", daemon=True)
+    thread.start()
+    try:
+        result = download_with_resume_pigitnned(url, destino_zip, opener=opener, on_write=ranges.add, **kwargs)
+    except BaseException as exc:
+        ranges.fail(exc)
+        thread.join()
+        source.close()
+        raise
+    ranges.finish(result.path.stat().st_size)
+    thread.join()
+    source.close()
+    if falha and not isinstance(falha[0], (EOFError, zipfile.BadZipFile)):
+        raise falha[0]
+
+    streamed, fallback, failed = finish_from_central_directory(
+        result.path, sink, extractor.seen, members, prefix=prefix
+    )
+    LOGGER.info(
+        "Extração em streaming: %s membro(s) durante o download, %s pelo diretório central, %s falha(s).",
+        len(streamed), len(fallback), len(failed),
+    )
+    return StreamExtractionReport(result, streamed, fallback, failed)
@@ -1,291 +1,409 @@
 
-#!/usr/bin/env python
-# coding: utf-8
+#!/usr/bin/env python
+# coding: utf-8
 
-# ## CNES_Utils
-# 
-# 
-# 
+# ## CNES_Utils
+# 
+# 
+# 
 
-# ## Imports
+# ## Imports
 
-# In[1]:
+# In[1]:
 
 
-import zipfile as z
-import os
-import requests
-import json
-import re
+import zipfile as z
+import os
+import json
+import re
 
-# usado nos notebooks filhos (Servidores)
-from pyspark.sql.functions import lit, col, regexp_replace
-from datetime import datetime, timedelta
+from cnes_catalog import discover_catalog, latest
+from cnes_downloader import CnesDownloader
+from cnes_sinks import MemberManifest, extract_to_sink, sink_for
 
+# usado nos notebooks filhos (Servidores)
+from pyspark.sql.functions import lit, col, regexp_replace, input_file_name, element_at, split, when
+from pyspark.sql.types import StructType, StructField, StringType
+from datetime import datetime, timedelta
 
-# ### Criando pasta tmp para download
 
-# In[2]:
+# ### Criando pasta tmp para download
 
+# In[2]:
 
-def Download(origem,destino):
-   data= requests.get(origem)
-   with open(destino , 'wb') as file:
-       file.write(data.content)
 
+def Download(origem,destino):
+   # streaming direto para o disco, com retomada (sem carregar o ZIP em memória)
+   CnesDownloader.download_with_resume(origem, destino)
 
-# ### Obter arquivos zips da url
 
-# In[3]:
+# ### Obter arquivos zips da url
 
+# In[3]:
 
-def ObterArquivosCNES(url, htmlSTR):
-   # lógica para pegar os nomes que tem .zip no final
-   urls = []
-   _filter = r'<script>(.*?)</script>'
-   scripts = re.findall(_filter, htmlSTR, re.DOTALL)    
-   resultado = ([texto for texto in scripts if "var arquivos = []" in texto])[0]
 
-   _filter = r'arquivos.push\((.*?)\);'
+def ObterArquivosCNES(url):
+   """
+   URLs dos ZIPs do CNES da competência mais recente publicada na página url, e
+   o anoMes dela. A página é lida em streaming só até o fim da listagem
+   (arquivos.push ou href), com backoff limitado e memo em disco (cnes_catalog).
+   """
+   objetos = [item for item in discover_catalog(url) if "_CNES" in item.nome]
+   if not objetos:
+       raise ValueError(f"Nenhum arquivo do CNES encontrado em {url}")
 
-   resultado = re.findall(_filter, resultado)
-  
-   objetos = []
-   for t in resultado:
-       obj = json.loads(t)
-       objetos.append(obj)
-   
-   objetos = [obj for obj in objetos if "_CNES" in obj['origem']]
-   
-   maiorAno = max(objetos, key=lambda x: (int(x['ano']), int(x['mes'])))['ano']
-   maiorMes = max(objetos, key=lambda x: (int(x['ano']), int(x['mes'])))['mes']
-   # print(maiorAno)
-   # print(maiorMes)
+   # apenas os arquivos da competência mais recente
+   recentes = latest(objetos)
+   urls = [item.url for item in recentes]
+   anoMes = recentes[0].competencia
+   return (urls, anoMes)
 
-   # criar uma nova lista contendo apenas os objetos com o maior ano e o maior mês
-   objetos = [obj for obj in objetos if obj['ano'] == maiorAno and obj['mes'] == maiorMes]
-   
-   for obj in objetos:
-       urls.append(url + obj['ano'] + obj['mes'] + "_" + obj['origem'])
-       anoMes = obj['ano'] + obj['mes'] 
-   return  (urls, anoMes )
 
+# ### Download dos arquivos zips
 
-# ### Download dos arquivos zips
+# In[4]:
 
-# In[4]:
 
+def MoverArquivosParaHistorico(datalakeDestino):
 
-def MoverArquivosParaHistorico(datalakeDestino):
+   pathHistorico = datalakeDestino + '/Historico'
+   folders = mssparkutils.fs.ls(datalakeDestino)
+   for folder in folders:
 
-   pathHistorico = datalakeDestino + '/Historico'
-   folders = mssparkutils.fs.ls(datalakeDestino)
-   for folder in folders:
+       if(folder.name != 'Historico'):
+           pathComFolder = pathHistorico + '/' + folder.name
+           mssparkutils.fs.mv(folder.path ,pathComFolder, create_path=True, overwrite=True )
 
-       if(folder.name != 'Historico'):
-           pathComFolder = pathHistorico + '/' + folder.name
-           mssparkutils.fs.mv(folder.path ,pathComFolder, create_path=True, overwrite=True )
 
+def SalvarZipURLPortalDaTransparencia(url,tempDiretorio,datalakeDestino):
 
-def SalvarZipURLPortalDaTransparencia(url,tempDiretorio,datalakeDestino):
+   # realiza o arquivamento dos arquivos
+   #Se primeira carga comentar a chamada
+   # (com CarregarCompetenciasNovas o manifesto já ignora as pastas carregadas;
+   # arquivar em Historico deixou de ser necessário para a leitura)
+   #MoverArquivosParaHistorico(datalakeDestino)
 
-   # realiza o arquivamento dos arquivos
-   #Se primeira carga comentar a chamada
-   #MoverArquivosParaHistorico(datalakeDestino)
+   nameList = []
 
-   htmlSTR = libFuncoesETL.GetResponseBody(url)
-   print(htmlSTR)
-   nameList = []
+   # CSVs iguais (mesmo CRC-32 e tamanho) aos de uma competência já gravada
+   # viram cópia feita pelo próprio ADLS, sem inflar nem reenviar
+   manifestoMembros = MemberManifest(datalakeDestino + '_membros.json', fs=mssparkutils.fs)
 
-   # arquivos:
-   (itens, anoMes) = ObterArquivosCNES(url, htmlSTR)
-   # print(itens)
+   # arquivos:
+   (itens, anoMes) = ObterArquivosCNES(url)
+   # print(itens)
 
-   for i in range(len(itens)):
-       # removendo URL's Invalidas      
-       if (len(itens[i].split(">")) > 1) :
-           continue
-           
-       nomeArquivoZip = itens[i].split("/")[-1]
-       nomeArquivoList = nomeArquivoZip.split("_")
-       nomeArquivo = (nomeArquivoList)[1] + "_" + (nomeArquivoList)[2]
+   for i in range(len(itens)):
+       # removendo URL's Invalidas      
+       if (len(itens[i].split(">")) > 1) :
+           continue
+           
+       nomeArquivoZip = itens[i].split("/")[-1]
+       nomeArquivoList = nomeArquivoZip.split("_")
+       nomeArquivo = (nomeArquivoList)[1] + "_" + (nomeArquivoList)[2]
 
-       directoryZip = tempDiretorio + nomeArquivo + "/ZIP/" + (nomeArquivoList)[0]
-       directoryCSV = tempDiretorio + nomeArquivo + "/CSV/" + (nomeArquivoList)[0]
-       os.makedirs(directoryZip, exist_ok=True)
-       os.makedirs(directoryCSV, exist_ok=True)
+       directoryZip = tempDiretorio + nomeArquivo + "/ZIP/" + (nomeArquivoList)[0]
+       os.makedirs(directoryZip, exist_ok=True)
 
-       # print(directory)
-       # print(nomeArquivo)
-       Download(itens[i],directoryZip + nomeArquivo + ".zip")
-       root = z.ZipFile(directoryZip + nomeArquivo + ".zip")
-       root.extractall(directoryCSV)
-       root.close()  
-       
-       mssparkutils.fs.cp(
-         src='file:' + directoryCSV
-       , dest=datalakeDestino + nomeArquivo + '/'
-       , recurse=True
-       )
+       # print(directory)
+       # print(nomeArquivo)
+       Download(itens[i],directoryZip + nomeArquivo + ".zip")
 
-       nameList.append(nomeArquivo)
+       # extrai cada CSV direto no datalake (publicação atômica), sem a pasta CSV
+       # com o ZIP inteiro; fs=mssparkutils.fs usa as credenciais do pool (sem adlfs)
+       with z.ZipFile(directoryZip + nomeArquivo + ".zip") as root:
+          extract_to_sink(root, sink_for(datalakeDestino + nomeArquivo + '/', fs=mssparkutils.fs), manifest=manifestoMembros)
 
-   return anoMes   
+       nameList.append(nomeArquivo)
 
+   return anoMes   
 
-# ## APAGAR
 
-# In[5]:
+# ## APAGAR
 
+# In[5]:
 
-get_ipython().run_line_magic('run', '/Config_Utils')
 
+get_ipython().run_line_magic('run', '/Config_Utils')
 
-# In[6]:
 
+# In[6]:
 
-get_ipython().run_line_magic('run', '/ETL_Utils')
 
+get_ipython().run_line_magic('run', '/ETL_Utils')
 
-# In[7]:
 
+# In[7]:
 
-# obter a data e hora atuais
-now = datetime.now() - timedelta(hours=3)
 
-# formatar a data e hora no formato desejado
-dataHora = now.strftime('%Y/%m/%d/%H/%M')
+# obter a data e hora atuais
+now = datetime.now() - timedelta(hours=3)
 
+# formatar a data e hora no formato desejado
+dataHora = now.strftime('%Y/%m/%d/%H/%M')
 
-# In[14]:
 
-
-#impoortar
-url = 'https://cnes.datasus.gov.br/EstatisticasServlet?path=BASE_DE_DADOS_CNES_202508.ZIP'
-#diretorioTemp = '/tmp/EstatisticasServlet/'
-pathCSV = libConfig.camadasPath['stage'] + '/URL/CNES/Estabelecimentos/'
+# In[14]:
 
 
-# In[9]:
+#impoortar
+url = 'https://cnes.datasus.gov.br/EstatisticasServlet?path=BASE_DE_DADOS_CNES_202508.ZIP'
+#diretorioTemp = '/tmp/EstatisticasServlet/'
+pathCSV = libConfig.camadasPath['stage'] + '/URL/CNES/Estabelecimentos/'
 
 
-#anoMes = SalvarZipURLPortalDaTransparencia(url, diretorioTemp, pathCSV)
+# In[9]:
 
 
-# In[17]:
+#anoMes = SalvarZipURLPortalDaTransparencia(url, diretorioTemp, pathCSV)
 
 
-def GetResponseBody(dados):
-   """
-   Obtém e retorna o corpo HTML de uma página web
+# In[11]:
 
-   Parâmetros
-   ----------
-   dados : str
-       A URL ou o caminho dos dados a serem lidos
 
-   Retorna
-   -------
-   str
-       Uma string que representa o conteúdo HTML da página
-   """
-   
-   controle = False
-   print("inicio leitura html")
-   
+pathBR = libConfig.camadasPath['bronze'] + "/URL/CNES/Estabelecimentos/"
+pathSTG = libConfig.camadasPath['stage'] + "/URL/CNES/Estabelecimentos/"
+nameTable = "Estabelecimentos"
 
-   while(controle == False):
-       try:
-           rawHTML = ETL.request.urlopen(dados, timeout=30).read()
-           # ETL.request.urlopen(url, timeout=20) -> retorna o html da página para a leitura dos nomes dos arquivos
-           # timeout : limite em segundos para bloquear a operação
-           controle = True
-       except:
-           pass
 
-   pageItems = ETL.bs.BeautifulSoup(rawHTML, 'html.parser')  
-   # formata para um objeto BeautifulSoup que representa um documento com uma estrutura de dados aninhada
-   
-   htmlSTR = str(pageItems)
-   # passa o objeto BeautifulSoup para string
-   
+# In[12]:
 
 
-# In[18]:
+def CabecalhoCSV(path):
+   """
+   Lê só a primeira linha do CSV (sem disparar job no Spark) e devolve os nomes
+   das colunas.
+   """
+   primeiraLinha = mssparkutils.fs.head(path, 64 * 1024).splitlines()[0]
+   return tuple(coluna.strip().strip('"') for coluna in primeiraLinha.split(';'))
 
 
-htmlSTR = GetResponseBody(url)
+def UnirBalanceado(dfs):
+   """
+   unionByName em árvore balanceada: o plano fica com profundidade log2(n) em vez
+   de crescer a cada competência. Colunas ausentes de um lado viram null.
+   """
+   while len(dfs) > 1:
+       dfs = [
+           dfs[i].unionByName(dfs[i + 1], allowMissingColumns=True) if i + 1 < len(dfs) else dfs[i]
+           for i in range(0, len(dfs), 2)
+       ]
+   return dfs[0]
 
 
-# In[11]:
+def LerCSVs(caminhos, encoding="latin1"):
+   """
+   Lê os CSVs de caminhos: arquivos com o mesmo cabeçalho num único spark.read
+   com schema explícito (tudo string), e só os grupos de cabeçalhos diferentes
+   são unidos. 'dataImportacao' sai do nome do arquivo (input_file_name).
+   """
+   grupos = {}
+   for caminho in caminhos:
+      grupos.setdefault(CabecalhoCSV(caminho), []).append(caminho)
 
+   nomeArquivo = element_at(split(input_file_name(), '/'), -1)
 
-pathBR = libConfig.camadasPath['bronze'] + "/URL/CNES/Estabelecimentos/"
-pathSTG = libConfig.camadasPath['stage'] + "/URL/CNES/Estabelecimentos/"
-nameTable = "Estabelecimentos"
+   dfs = []
+   for colunas, grupo in grupos.items():
+      schema = StructType([StructField(coluna, StringType(), True) for coluna in colunas])
+      df = spark.read.format("csv")\
+      .option("header", "true")\
+      .option("delimiter", ";")\
+      .option("encoding", encoding)\
+      .schema(schema)\
+      .load(grupo)
 
+      dfs.append(df.select('*', split(nomeArquivo, '_').getItem(0).alias('dataImportacao')))
 
-# In[12]:
+   return UnirBalanceado(dfs)
 
 
-namePaths = mssparkutils.fs.ls(pathSTG)
-# print(namePaths)
+def ArquivosDaTabela(pathPasta, nameTable):
+   """CSVs <data>_<nameTable>*.csv de uma pasta de competência do stage."""
+   arquivos = []
+   for fileINFO in mssparkutils.fs.ls(pathPasta):
+      partes = fileINFO.name.split('_')
+      if(len(partes) > 1 and (partes[1].upper()).startswith((nameTable).upper())):
+         print(partes[1])
+         arquivos.append(fileINFO.path)
+   return arquivos
 
-dfs = []
-for namePath in namePaths:
 
-   if(namePath.name == 'Historico'):
-       print('Pasta de Historico')
-       continue
-   
-   pathTabela = mssparkutils.fs.ls(namePath.path)
-   
-   for fileINFO in pathTabela:
-       data = fileINFO.name.split('_')[0]
-       name = fileINFO.name.split('_')[1]
+def LerTabelaSTG(pathSTG, nameTable, encoding="latin1"):
+   """
+   Lê todos os CSVs <data>_<nameTable>*.csv das pastas de competência de pathSTG.
+   Com encoding="utf-8" (fatias geradas por cnes_shards), o Spark usa o leitor
+   de linhas padrão, mais rápido que o caminho de outras codificações.
 
-       if((name.upper()).startswith((nameTable).upper())):            
-           print(name)
-           df = spark.read.format("csv")\
-           .option("header", "true")\
-           .option("encoding", "UTF-8")\
-           .option("delimiter", ";")\
-           .option("encoding", "latin1")\
-           .option("inferSchema", "false")\
-           .load(fileINFO.path)
-           
-           df = df.withColumn(namePath.name, lit(True)) # adicionando a nova coluna
-           df = df.withColumn('dataImportacao', lit(data))
-           
-           dfs.append(df)
+   A coluna booleana de cada pasta de origem sai do caminho do arquivo
+   (input_file_name), sem um withColumn por arquivo. Relê todo o histórico a
+   cada execução: para a carga mensal, ver CarregarCompetenciasNovas.
+   """
+   arquivos = []  # (pasta, caminho)
+   for namePath in mssparkutils.fs.ls(pathSTG):
 
-# unir dataframes
-df1 = dfs[0]
-for i in range(1, len(dfs)):
-   df2 = dfs[i]
+      if(namePath.name == 'Historico'):
+         print('Pasta de Historico')
+         continue
 
-   # obtendo o número de colunas de cada dataframe
-   numColsDF1 = len(df1.columns)
-   numColsDF2 = len(df2.columns)
+      # _membros.json (manifesto de deduplicação) e afins
+      if(namePath.name.startswith('_')):
+         continue
 
-   # verificar se todas as colunas da df1 estão na df2
-   missingColsDF2 = [col for col in df1.columns if col not in df2.columns]
+      arquivos += [(namePath.name, caminho) for caminho in ArquivosDaTabela(namePath.path, nameTable)]
 
-   for col in missingColsDF2:
-       colType = df1.schema[col].dataType
-       df2 = df2.withColumn(col, lit(None).cast(colType))
-
-   # verificar se todas as colunas da df2 estão na df1
-   missingColsDF1 = [col for col in df2.columns if col not in df1.columns]
-   for col in missingColsDF1:
-       colType = df2.schema[col].dataType
-       df1 = df1.withColumn(col, lit(None).cast(colType))
-
-   
-   # unir dataframes
-   df1 = df1.unionByName(df2)
-
-dfFinal = df1
+   if not arquivos:
+      raise FileNotFoundError(f"Nenhum arquivo de {nameTable} em {pathSTG}")
+
+   pastas = sorted({pasta for pasta, caminho in arquivos})
+   pastaOrigem = element_at(split(input_file_name(), '/'), -2)
+
+   # uma coluna por pasta (True para as linhas vindas dela)
+   df = LerCSVs([caminho for pasta, caminho in arquivos], encoding)
+   return df.select('*', *[when(pastaOrigem == pasta, lit(True)).alias(pasta) for pasta in pastas])
+
+
+def AplicarDeltaCNES(dfBase, pathDelta, chave=('CO_UNIDADE',)):
+   """
+   Aplica sobre dfBase (snapshot da competência anterior) o delta gerado por
+   cnes_cdc.diff_zips: remove as chaves com CDC_OP I/U/D e acrescenta as linhas
+   I/U. Evita reler e unir o snapshot completo da competência nova.
+   """
+   delta = spark.read.format("csv")\
+   .option("header", "true")\
+   .option("delimiter", ";")\
+   .option("encoding", "latin1")\
+   .load(pathDelta)
+
+   colunas = [c for c in delta.columns if c != 'CDC_OP']
+   delta = delta.select('CDC_OP', *[col(c).cast(StringType()).alias(c) for c in colunas])
+
+   mantidos = dfBase.join(delta.select(*chave), on=list(chave), how='left_anti')
+   novos = delta.where(col('CDC_OP').isin('I', 'U')).drop('CDC_OP')
+   return mantidos.unionByName(novos, allowMissingColumns=True)
+
+
+# ### Tabela particionada por competência (carga incremental)
+
+# In[13]:
+
+
+def CompetenciaDoArquivo(nomePasta, nomeArquivo):
+   """
+   AAAAMM do arquivo do stage: o do nome da pasta ou, se ela não tiver (pastas
+   reaproveitadas todo mês), o do prefixo <data> do arquivo. Sem nenhum dos
+   dois, levanta ValueError: a partição não pode ganhar um nome qualquer.
+   """
+   for nome in (nomePasta, nomeArquivo.split('_')[0]):
+      m = re.search(r'(\d{6})', nome)
+      if m:
+         return m.group(1)
+   raise ValueError(f"Sem competência (AAAAMM) em {nomePasta}/{nomeArquivo}")
+
+
+def LerManifesto(pathTabela):
+   """
+   Competências já carregadas em pathTabela: {competencia: {pastas, arquivos,
+   dataCarga}}, com arquivos = [[pasta/arquivo, tamanho], ...]. O manifesto
+   fica em <pathTabela>/_manifesto.json (arquivos com '_' no início são
+   ignorados pelo leitor do Spark).
+   """
+   pathManifesto = pathTabela.rstrip('/') + '/_manifesto.json'
+   if not mssparkutils.fs.exists(pathManifesto):
+      return {}
+   return json.loads(mssparkutils.fs.head(pathManifesto, 64 * 1024 * 1024))
+
+
+def GravarManifesto(pathTabela, manifesto):
+   mssparkutils.fs.put(pathTabela.rstrip('/') + '/_manifesto.json', json.dumps(manifesto, indent=1, sort_keys=True), True)
+
+
+def GravarParticao(df, pathTabela, competencia, formato="delta"):
+   """
+   Grava df (uma competência) sobrescrevendo só a partição dela: replaceWhere no
+   Delta, overwrite dinâmico no Parquet. Repetir a carga de um mês não duplica
+   linhas nem toca nas outras partições.
+   """
+   escrita = df.write.format(formato).mode("overwrite").partitionBy('competencia')
+   if formato == "delta":
+      escrita = escrita.option("replaceWhere", f"competencia = '{competencia}'").option("mergeSchema", "true")
+   else:
+      escrita = escrita.option("partitionOverwriteMode", "dynamic")
+   escrita.save(pathTabela)
+
+
+def ArquivosPorCompetencia(pathSTG, nameTable):
+   """
+   {competencia: [FileInfo, ...]} com os CSVs <data>_<nameTable>*.csv de todas
+   as pastas de pathSTG (menos Historico e nomes com '_' no início).
+   """
+   grupos = {}
+   for namePath in mssparkutils.fs.ls(pathSTG):
+
+      if(namePath.name == 'Historico' or namePath.name.startswith('_') or not namePath.isDir):
+         continue
+
+      for fileINFO in mssparkutils.fs.ls(namePath.path):
+         partes = fileINFO.name.split('_')
+         if(len(partes) > 1 and (partes[1].upper()).startswith((nameTable).upper())):
+            competencia = CompetenciaDoArquivo(namePath.name, fileINFO.name)
+            grupos.setdefault(competencia, []).append((namePath.name, fileINFO))
+   return grupos
+
+
+def CarregarCompetenciasNovas(pathSTG, nameTable, pathTabela, encoding="latin1", formato="delta"):
+   """
+   Acrescenta à tabela particionada por 'competencia' em pathTabela só as
+   competências novas ou cujos arquivos mudaram (nomes e tamanhos diferentes
+   do manifesto): o custo da execução é o de um mês, não o do histórico
+   inteiro, e as pastas já carregadas não precisam ser movidas para Historico.
+   Todos os arquivos de uma competência, de qualquer pasta, vão numa única
+   GravarParticao (replaceWhere não deixa uma pasta apagar a outra). O
+   manifesto é atualizado depois de cada partição gravada; se a execução cair
+   no meio, a próxima regrava só o que faltou. Retorna as competências carregadas.
+   """
+   manifesto = LerManifesto(pathTabela)
+   carregadas = []
+   for competencia, arquivos in sorted(ArquivosPorCompetencia(pathSTG, nameTable).items()):
+
+      assinatura = sorted([pasta + '/' + fileINFO.name, fileINFO.size] for pasta, fileINFO in arquivos)
+      if manifesto.get(competencia, {}).get('arquivos') == assinatura:
+         continue
+
+      df = LerCSVs([fileINFO.path for pasta, fileINFO in arquivos], encoding).withColumn('competencia', lit(competencia))
+      GravarParticao(df, pathTabela, competencia, formato)
+
+      manifesto[competencia] = {
+         'pastas': sorted({pasta for pasta, fileINFO in arquivos}),
+         'arquivos': assinatura,
+         'dataCarga': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+      }
+      GravarManifesto(pathTabela, manifesto)
+      carregadas.append(competencia)
+
+   return carregadas
+
+
+def LerTabelaParticionada(pathTabela, competencias=None, formato="delta"):
+   """
+   Lê a tabela particionada; com competencias (lista de AAAAMM), o filtro na
+   coluna de partição faz o Spark listar e ler só essas pastas.
+   """
+   leitor = spark.read.format(formato)
+   if formato != "delta":
+      leitor = leitor.option("mergeSchema", "true")
+   df = leitor.load(pathTabela)
+   if competencias is not None:
+      df = df.where(col('competencia').isin([str(c) for c in competencias]))
+   return df
+
+
+# In[15]:
+
+
+pathTabela = pathBR + "Competencias/"
+print(CarregarCompetenciasNovas(pathSTG, nameTable, pathTabela))
+dfFinal = LerTabelaParticionada(pathTabela)
 
 
 #
\ No newline at end of file
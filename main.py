@@ -6,22 +6,39 @@
 # ## Imports
 import zipfile as z
 import os
-import requests
 from pathlib import Path
 from datetime import datetime, timedelta
-import re
 import certifi
-from urllib.parse import urljoin
+
+from cnes_catalog import parse_catalog
+from cnes_downloader import (
+    CnesDownloader,
+    DownloadCache,
+    RangeIgnorado,
+    TLSOptions,
+    head_request,
+    open_remote_zip,
+)
+from cnes_sinks import LocalSink, extract_to_sink, sink_for
+
+# Mesma confiança do `requests` (bundle do certifi) + cadeia em certificado/
+TLS = TLSOptions(cafile=certifi.where())
 
 
 # ### Criando pasta tmp para download
-def FazerDownload(origem, destino):
+def FazerDownload(origem, destino, cache=None):
     """
     Faz o download de um arquivo a partir de uma URL de origem para o caminho de destino.
+
+    O conteúdo vai por streaming direto para o disco, com retomada. Com `cache`
+    (DownloadCache), envia `If-None-Match`/`If-Modified-Since`; se o arquivo não
+    mudou, nada é transferido e o ZIP já baixado é reaproveitado. Sem `cache`, e
+    com `CNES_SHARED_CACHE` definido, jobs simultâneos pedindo a mesma competência
+    compartilham um único download (ver `SharedDownloadCache`).
+    Retorna o caminho do ZIP a ser usado.
     """
-    data = requests.get(origem, verify=True)
-    with open(destino, 'wb') as file:
-        file.write(data.content)
+    arquivo, _ = CnesDownloader.download_with_resume(origem, destino, tls=TLS, cache=cache)
+    return str(arquivo)
 
 def FormatarURL(url_base: str, data: datetime) -> str:
     """
@@ -46,6 +63,10 @@ def ObterArquivosCNES(url_base, html):
     """
     Extrai os links dos arquivos ZIP CNES a partir do bloco HTML da dropdown.
 
+    Usa a mesma varredura incremental de `cnes_catalog` (formatos `href` e
+    `arquivos.push`). Para buscar a página, prefira `discover_catalog`, que lê em
+    streaming só até o fim da listagem, com backoff e memo em disco.
+
     Parâmetros
     ----------
     url_base : str
@@ -58,36 +79,27 @@ def ObterArquivosCNES(url_base, html):
     tuple
         (lista_urls_completas, url_mais_recente, anoMes_mais_recente)
     """
-    pattern = r'href="(/EstatisticasServlet\?path=BASE_DE_DADOS_CNES_(\d{6})\.ZIP)"'
-    matches = re.findall(pattern, html)
-    print("[DEBUG] Matches encontrados:", matches)
-
-    if not matches:
+    itens = parse_catalog(html, url_base)
+    if not itens:
         raise ValueError("Nenhum arquivo ZIP CNES encontrado no HTML fornecido.")
 
-    urls_completas = [urljoin(url_base, m[0]) for m in matches]
-
-    matches.sort(key=lambda x: x[1], reverse=True)
-    anoMes_recente = matches[0][1]
-
-    url_mais_recente_relativa = next(m[0] for m in matches if m[1] == anoMes_recente)
-    url_mais_recente = urljoin(url_base, url_mais_recente_relativa)
-
-    return urls_completas, url_mais_recente, anoMes_recente
+    recente = itens[0]  # da competência mais recente para a mais antiga
+    return [i.url for i in itens], recente.url, recente.competencia
 
 def SalvarZipURLCNES(url, tempDiretorio, datalakeDestino, listZips, data):
     """
-    Faz o download de um arquivo ZIP CNES, extrai os arquivos relacionados a 'estabelecimentos'
-    e envia os CSVs extraídos para o destino especificado no datalake.
+    Faz o download de um arquivo ZIP CNES e extrai os arquivos relacionados a
+    'estabelecimentos' direto no destino especificado no datalake.
 
     Parâmetros
     ----------
     url : str
         URL base para formar o caminho do ZIP.
     tempDiretorio : str
-        Diretório temporário local para salvar e extrair os arquivos.
+        Diretório temporário local para o ZIP (quando baixado inteiro) e o cache.
     datalakeDestino : str
-        Caminho no datalake onde os arquivos CSV extraídos devem ser copiados.
+        Caminho no datalake onde os arquivos CSV devem ser gravados: pasta local
+        ou URL fsspec (ex.: abfss://...), ou um `Sink` (ver `cnes_sinks`).
     listZips : str
         Nome base do arquivo ZIP, sem extensão.
     data : str
@@ -98,51 +110,69 @@ def SalvarZipURLCNES(url, tempDiretorio, datalakeDestino, listZips, data):
 
     nomeArquivo = listZips
     diretorioZip = os.path.join(tempDiretorio, nomeArquivo, "ZIP")
-    diretorioCSV = os.path.join(tempDiretorio, nomeArquivo, "CSV")
-
     os.makedirs(diretorioZip, exist_ok=True)
-    os.makedirs(diretorioCSV, exist_ok=True)
 
     pathZip = os.path.join(diretorioZip, nomeArquivo + ".zip")
 
-    # Fazer o download do ZIP
-    FazerDownload(urlAtual, pathZip)
-
-    with z.ZipFile(pathZip, 'r') as root:
+    # Competência já processada e inalterada no servidor (ETag/Last-Modified/tamanho)?
+    cache = DownloadCache(os.path.join(tempDiretorio, ".cache"))
+    chaveCSV = urlAtual + "#CSV"
+    entrada = cache.lookup(chaveCSV)
+    # Uma sessão (keep-alive, certifi + certificado/) para o HEAD e as leituras por Range
+    sessao = CnesDownloader.session(TLS)
+    status, cabecalhos = head_request(
+        urlAtual, sessao, DownloadCache.conditional_headers(entrada)
+    )
+    if entrada is not None and cache.is_unchanged(entrada, status, cabecalhos):
+        print(f"[INFO] Competência inalterada; CSVs já em: {entrada.path}")
+        return
+
+    # Abre o ZIP remoto via HTTP Range: só o diretório central e os membros
+    # selecionados são baixados. Sem suporte a Range, baixa o ZIP inteiro.
+    # O HEAD condicional acima (200) já serve ao ZIP remoto: não há outro.
+    try:
+        root = open_remote_zip(
+            urlAtual, opener=sessao, head=cabecalhos if status == 200 else None
+        )
+    except RangeIgnorado as exc:
+        print(f"[INFO] Range indisponível ({exc}); baixando o ZIP completo.")
+        pathZip = FazerDownload(urlAtual, pathZip, cache)
+        root = z.ZipFile(pathZip, 'r')
+
+    with root:
         arquivos_zip = root.namelist()
         encontrados = [a for a in arquivos_zip if "tbestabelecimento" in a.lower()]
 
         if not encontrados:
             print("⚠️ Nenhum arquivo com 'estabelecimentos' encontrado no ZIP.")
         else:
+            # Direto no datalake: sem pasta CSV intermediária nem cópia posterior
+            destino = sink_for(datalakeDestino)
+            print(f"[INFO] Extraindo para: {destino}")
             for arquivo in encontrados:
                 print(f"🗂️ Extraindo: {arquivo}")
-                root.extract(arquivo, diretorioCSV)
-
-    # Copiar para datalake (assumindo ambiente mssparkutils)
-    print(f"[INFO] Copiando arquivos extraídos para: {datalakeDestino}")
-    #mssparkutils.fs.cp(
-    #    src='file:' + diretorioCSV,
-    #    dest=datalakeDestino,
-    #    recurse=True
-    #)
+                extract_to_sink(root, destino, [arquivo])
+            # O cache local só sabe conferir pastas locais
+            if status == 200 and isinstance(destino, LocalSink):
+                cache.store(chaveCSV, destino.root, cabecalhos)
 
 # ## APAGAR: Códigos auxiliares para execução interativa
 
 # ## Execução
-# Obter a data e hora atuais menos 1200 horas (~50 dias atrás)
-now = datetime.now() - timedelta(hours=1200)
-mesAno = now.strftime("%Y%m")
-
-urlBase = "https://cnes.datasus.gov.br/EstatisticasServlet?path="
-urlFinal = FormatarURL(urlBase, mesAno)
-print(urlFinal)
-
-# Definir caminhos
-pathCSV = "URL/CNES/Estabelecimentos/"
-pathTemp = '/tmp/CNES/'
-pathBR = 'URL/CNES/Estabelecimentos'
-listaArquivo = f'BASE_DE_DADOS_CNES_{mesAno}'
-
-# Executar processo
-SalvarZipURLCNES(urlBase, pathTemp, pathCSV, listaArquivo, mesAno)
+if __name__ == "__main__":
+    # Obter a data e hora atuais menos 1200 horas (~50 dias atrás)
+    now = datetime.now() - timedelta(hours=1200)
+    mesAno = now.strftime("%Y%m")
+
+    urlBase = "https://cnes.datasus.gov.br/EstatisticasServlet?path="
+    urlFinal = FormatarURL(urlBase, mesAno)
+    print(urlFinal)
+
+    # Definir caminhos
+    pathCSV = "URL/CNES/Estabelecimentos/"
+    pathTemp = '/tmp/CNES/'
+    pathBR = 'URL/CNES/Estabelecimentos'
+    listaArquivo = f'BASE_DE_DADOS_CNES_{mesAno}'
+
+    # Executar processo
+    SalvarZipURLCNES(urlBase, pathTemp, pathCSV, listaArquivo, mesAno)
@@ -1,7 +1,9 @@
-import requests
+import ssl
 import tempfile
 from pathlib import Path
 
+from cnes_downloader import CnesDownloader, TLSOptions
+
 url = "https://cnes.datasus.gov.br/EstatisticasServlet?path=BASE_DE_DADOS_CNES_202509.ZIP"
 cert_path = Path("E:/Estudos/CNES/certificado/cadeia_lets_encrypt.pem")
 certificado = """-----BEGIN CERTIFICATE-----
@@ -73,15 +75,22 @@ with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".pem") as temp_
 if not cert_path.exists():
     raise FileNotFoundError(f"Arquivo PEM não encontrado: {cert_path}")
 
+# Confia apenas na cadeia do PEM acima (sem a store do sistema)
+tls = TLSOptions(use_windows_store=False, extra_certs_pem=(), cafile=temp_cert_path)
+
 try:
-    response = requests.get(url, verify=temp_cert_path, timeout=15)
-    print("Status:", response.status_code)
-    with open("BASE_DE_DADOS_CNES_202508.ZIP", "wb") as f:
-        f.write(response.content)
-    print("Download concluído.")
-except requests.exceptions.Timeout:
-    print("Erro: Timeout – o servidor demorou demais para responder.")
-except requests.exceptions.SSLError as e:
+    arq, sha = CnesDownloader.download_with_resume(
+        url, "BASE_DE_DADOS_CNES_202508.ZIP", tls=tls, max_retries=1
+    )
+    print("Download concluído:", arq, "SHA-256:", sha)
+except ssl.SSLError as e:
     print("Erro SSL:", e)
+except RuntimeError as e:
+    if isinstance(e.__cause__, TimeoutError):
+        print("Erro: Timeout – o servidor demorou demais para responder.")
+    elif isinstance(e.__cause__, ssl.SSLError):
+        print("Erro SSL:", e.__cause__)
+    else:
+        print("Erro inesperado:", e)
 except Exception as e:
     print("Erro inesperado:", e)
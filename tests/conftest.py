@@ -0,0 +1,6 @@
+# conftest.py
+# Os módulos cnes_*.py ficam na raiz do repositório (sem pacote instalável)
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,81 @@
+# test_cdc.py
+# -*- coding: utf-8 -*-
+"""`diff_zips`: o delta em memória e o delta por partições em disco são o mesmo."""
+
+import csv
+import gzip
+import zipfile
+
+import pytest
+
+from cnes_cdc import diff_zips
+
+CABECALHO = ["CO_UNIDADE", "CO_CNES", "NO_FANTASIA", "TP_UNIDADE"]
+
+
+def _zip(path, competencia, linhas):
+    texto = "\n".join(";".join(l) for l in [CABECALHO, *linhas]) + "\n"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"tbEstabelecimento{competencia}.csv", texto.encode("latin1"))
+    return path
+
+
+def _linha(i, nome=None, tipo="05"):
+    return [f"355030{i:07d}", f"{i:07d}", nome or f"UNIDADE {i}", tipo]
+
+
+@pytest.fixture
+def competencias(tmp_path):
+    anteriores = [_linha(i) for i in range(50)]
+    atuais = [_linha(i) for i in range(50) if i % 7]  # múltiplos de 7: excluídos
+    atuais[3] = _linha(4, nome="UNIDADE 4 (REFORMADA)")  # alterada
+    atuais[10] = _linha(12, tipo="36")  # alterada
+    atuais += [_linha(i, nome="NOVA ÇÃO") for i in range(50, 55)]  # incluídas
+    return (
+        _zip(tmp_path / "202507.zip", "202507", anteriores),
+        _zip(tmp_path / "202508.zip", "202508", atuais),
+    )
+
+
+def _delta(path):
+    with gzip.open(path, "rt", encoding="latin1", newline="") as f:
+        cabecalho, *linhas = list(csv.reader(f, delimiter=";"))
+    return cabecalho, sorted(map(tuple, linhas))
+
+
+def test_delta_em_memoria(tmp_path, competencias):
+    report = diff_zips(*competencias, tmp_path / "delta.csv.gz")
+
+    assert report.key == ("CO_UNIDADE",)
+    assert (report.inserted, report.updated, report.deleted, report.partitions) == (5, 2, 8, 1)
+    assert report.unchanged == 50 - 8 - 2
+    cabecalho, linhas = _delta(report.path)
+    assert cabecalho == ["CDC_OP", *CABECALHO]
+    assert ("U", *_linha(4, nome="UNIDADE 4 (REFORMADA)")) in linhas
+    assert ("D", "3550300000007", "", "", "") in linhas
+    assert ("I", *_linha(52, nome="NOVA ÇÃO")) in linhas
+
+
+def test_particoes_em_disco_igual_a_memoria(tmp_path, competencias):
+    memoria = diff_zips(*competencias, tmp_path / "memoria.csv.gz")
+    disco = diff_zips(
+        *competencias, tmp_path / "disco.csv.gz", max_rows_in_memory=10, partitions=4, tmp_dir=tmp_path
+    )
+
+    assert disco.partitions == 4
+    assert disco[1:6] == memoria[1:6]
+    assert disco.unchanged == memoria.unchanged
+    assert _delta(disco.path) == _delta(memoria.path)
+    # os arquivos das partições não ficam para trás
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "202507.zip", "202508.zip", "disco.csv.gz", "memoria.csv.gz",
+    ]
+
+
+def test_competencias_iguais_delta_vazio(tmp_path, competencias):
+    anterior, _ = competencias
+
+    report = diff_zips(anterior, anterior, tmp_path / "d.csv.gz", max_rows_in_memory=1, partitions=3)
+
+    assert (report.inserted, report.updated, report.deleted, report.unchanged) == (0, 0, 0, 50)
+    assert _delta(report.path) == (["CDC_OP", *CABECALHO], [])
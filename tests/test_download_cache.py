@@ -0,0 +1,162 @@
+# test_download_cache.py
+# -*- coding: utf-8 -*-
+"""`DownloadCache` e `download_cached`: HEAD condicional, mudança e falha do HEAD."""
+
+import hashlib
+import threading
+
+import pytest
+
+import cnes_downloader
+from cnes_downloader import DownloadCache, DownloadResult, download_cached
+
+URL = "https://cnes.example/EstatisticasServlet?path=BASE_DE_DADOS_CNES_202508.ZIP"
+CONTEUDO = b"PK\x05\x06" + b"\x00" * 18
+SHA = hashlib.sha256(CONTEUDO).hexdigest()
+
+
+@pytest.fixture
+def baixado(tmp_path):
+    """Cache com uma competência já baixada (ETag "v1")."""
+    cache = DownloadCache(tmp_path / ".cache")
+    destino = tmp_path / "cnes.zip"
+    destino.write_bytes(CONTEUDO)
+    cache.store(URL, destino, {"ETag": '"v1"', "Content-Length": str(len(CONTEUDO))}, SHA)
+    return cache, destino
+
+
+def _head(monkeypatch, status, headers):
+    chamadas = []
+
+    def head(url, opener, headers_req=None):
+        chamadas.append(headers_req)
+        return status, headers
+
+    monkeypatch.setattr(cnes_downloader, "head_request", head)
+    return chamadas
+
+
+def _download(monkeypatch, conteudo=b"novo", falha=None):
+    chamadas = []
+
+    def download(url, destino, **kwargs):
+        chamadas.append(destino)
+        if falha is not None:
+            raise falha
+        destino.write_bytes(conteudo)
+        return DownloadResult(destino, hashlib.sha256(conteudo).hexdigest())
+
+    monkeypatch.setattr(cnes_downloader, "download_with_resume_pigitnned", download)
+    return chamadas
+
+
+def test_inalterado_usa_cache(monkeypatch, baixado):
+    cache, destino = baixado
+    heads = _head(monkeypatch, 304, {})
+    downloads = _download(monkeypatch)
+
+    result = download_cached(URL, destino, cache=cache, opener=object())
+
+    assert result == DownloadResult(destino.resolve(), SHA)
+    assert heads == [{"If-None-Match": '"v1"'}]
+    assert downloads == []
+
+
+def test_alterado_descarta_e_baixa(monkeypatch, baixado):
+    cache, destino = baixado
+    _head(monkeypatch, 200, {"ETag": '"v2"', "Content-Length": "4"})
+    downloads = _download(monkeypatch, b"novo")
+
+    result = download_cached(URL, destino, cache=cache, opener=object())
+
+    assert downloads == [destino]
+    assert destino.read_bytes() == b"novo"
+    assert cache.lookup(URL).etag == '"v2"'
+    assert cache.lookup(URL).sha256 == result.sha256
+
+
+def test_head_falhou_mantem_cache(monkeypatch, baixado):
+    cache, destino = baixado
+    journal = destino.with_name(destino.name + ".blocks")
+    journal.write_bytes(b"diario")
+    _head(monkeypatch, None, None)
+    downloads = _download(monkeypatch, falha=OSError("fora do ar"))
+
+    result = download_cached(URL, destino, cache=cache, opener=object())
+
+    assert result == DownloadResult(destino.resolve(), SHA)
+    assert downloads == []
+    assert destino.read_bytes() == CONTEUDO
+    assert journal.exists()
+
+
+def test_head_falhou_sem_sha256_levanta_sem_apagar(monkeypatch, tmp_path):
+    cache = DownloadCache(tmp_path / ".cache")
+    destino = tmp_path / "cnes.zip"
+    destino.write_bytes(CONTEUDO)
+    cache.store(URL, destino, {"ETag": '"v1"'})
+    _head(monkeypatch, None, None)
+    downloads = _download(monkeypatch)
+
+    with pytest.raises(ConnectionError):
+        download_cached(URL, destino, cache=cache, opener=object())
+
+    assert downloads == []
+    assert destino.read_bytes() == CONTEUDO
+
+
+def test_sem_entrada_baixa(monkeypatch, tmp_path):
+    cache = DownloadCache(tmp_path / ".cache")
+    destino = tmp_path / "cnes.zip"
+    heads = _head(monkeypatch, 200, {"ETag": '"v1"'})
+    _download(monkeypatch, CONTEUDO)
+
+    result = download_cached(URL, destino, cache=cache, opener=object())
+
+    assert heads == [{}]
+    assert result.sha256 == SHA
+    assert cache.lookup(URL).etag == '"v1"'
+
+
+def test_head_repassado_ao_download(monkeypatch, tmp_path):
+    """O HEAD condicional (200) é o único: seus cabeçalhos vão para o download."""
+    cache = DownloadCache(tmp_path / ".cache")
+    destino = tmp_path / "cnes.zip"
+    cabecalhos = {"ETag": '"v1"', "Content-Length": str(len(CONTEUDO)), "Accept-Ranges": "bytes"}
+    heads = _head(monkeypatch, 200, cabecalhos)
+    recebidos = []
+
+    def download(url, destino, head=None, **kwargs):
+        recebidos.append(head)
+        destino.write_bytes(CONTEUDO)
+        return DownloadResult(destino, SHA)
+
+    monkeypatch.setattr(cnes_downloader, "download_with_resume_pigitnned", download)
+
+    download_cached(URL, destino, cache=cache, opener=object())
+
+    assert len(heads) == 1
+    assert recebidos == [cabecalhos]
+
+
+def test_store_concorrente(tmp_path):
+    cache = DownloadCache(tmp_path / ".cache")
+    artefato = tmp_path / "cnes.zip"
+    artefato.write_bytes(CONTEUDO)
+    erros = []
+
+    def gravar(i):
+        try:
+            cache.store(f"{URL}&n={i}", artefato, {"ETag": f'"{i}"'}, SHA)
+        except Exception as exc:  # pragma: no cover - só em caso de regressão
+            erros.append(exc)
+
+    threads = [threading.Thread(target=gravar, args=(i,)) for i in range(64)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert erros == []
+    assert all(cache.lookup(f"{URL}&n={i}").etag == f'"{i}"' for i in range(64))
+    assert list((tmp_path / ".cache").glob("*.tmp")) == []
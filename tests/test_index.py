@@ -0,0 +1,70 @@
+# test_index.py
+# -*- coding: utf-8 -*-
+"""`build_index`/`CnesIndex`: intercalação de blocos ordenados e busca por código."""
+
+import os
+
+import pytest
+
+from cnes_index import CnesIndex, build_index
+
+CABECALHO = "CO_UNIDADE;CO_PROFISSIONAL_SUS;NO_OBS\n"
+
+
+def _csv(path, codigos):
+    linhas = [CABECALHO]
+    for n, codigo in enumerate(codigos):
+        obs = f'"linha {n};\nquebrada"' if n % 5 == 0 else f"obs {n} çã"
+        linhas.append(f"355030{codigo};{n:06d};{obs}\n")
+    linhas.append("\n")  # registro vazio é pulado
+    path.write_bytes("".join(linhas).encode("latin1"))
+    return path
+
+
+@pytest.fixture
+def vinculos(tmp_path):
+    # vários vínculos por estabelecimento, fora de ordem
+    codigos = [f"{(n * 37) % 11:07d}" for n in range(60)]
+    return _csv(tmp_path / "tbCargaHorariaSus202508.csv", codigos), codigos
+
+
+def test_intercalacao_igual_ao_bloco_unico(tmp_path, vinculos):
+    csv_path, _ = vinculos
+
+    unico = build_index(csv_path, tmp_path / "unico.idx")
+    blocos = build_index(csv_path, tmp_path / "blocos.idx", run_records=7, tmp_dir=tmp_path)
+
+    assert unico.records == blocos.records == 60
+    assert blocos.column == "CO_UNIDADE"
+    assert unico.path.read_bytes() == blocos.path.read_bytes()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "blocos.idx", "tbCargaHorariaSus202508.csv", "unico.idx",
+    ]
+
+
+def test_busca_devolve_todas_as_linhas_na_ordem_do_arquivo(tmp_path, vinculos):
+    csv_path, codigos = vinculos
+    build_index(csv_path, run_records=7, tmp_dir=tmp_path)
+
+    with CnesIndex(csv_path) as idx:
+        assert len(idx) == 60
+        for codigo in set(codigos):
+            esperadas = [f"{n:06d}" for n, c in enumerate(codigos) if c == codigo]
+            linhas = idx.find(codigo)
+            assert [l["CO_PROFISSIONAL_SUS"] for l in linhas] == esperadas
+        assert idx.get("0000000")["NO_OBS"] == "linha 0;\nquebrada"
+        assert idx.find("9999999") == []
+        assert idx.find("x" * 40) == []  # maior que a largura da chave
+
+
+def test_indice_desatualizado(tmp_path, vinculos):
+    csv_path, _ = vinculos
+    build_index(csv_path)
+    with csv_path.open("ab") as f:
+        f.write(b"3550300000001;999999;nova\n")
+    os.utime(csv_path, ns=(0, 0))
+
+    with pytest.raises(ValueError):
+        CnesIndex(csv_path)
+    with CnesIndex(csv_path, check=False) as idx:
+        assert len(idx) == 60
@@ -0,0 +1,112 @@
+# test_journal.py
+# -*- coding: utf-8 -*-
+"""`BlockJournal` e `download_segmented`: retomada só dos blocos ausentes ou corrompidos."""
+
+import os
+import re
+
+from cnes_downloader import BlockJournal, download_segmented
+
+BLOCO = 4096
+DADOS = os.urandom(BLOCO * 10 + 123)  # último bloco incompleto
+URL = "https://cnes.example/BASE_DE_DADOS_CNES_202508.ZIP"
+
+
+class _Resposta:
+    def __init__(self, dados, inicio, fim):
+        self.status = 206
+        self.headers = {"Content-Range": f"bytes {inicio}-{fim}/{len(dados)}"}
+        self._corpo = memoryview(dados)[inicio : fim + 1]
+
+    def readinto(self, b):
+        n = min(len(b), len(self._corpo))
+        b[:n] = self._corpo[:n]
+        self._corpo = self._corpo[n:]
+        return n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _Servidor:
+    """Opener em memória que responde a Range e anota as faixas pedidas."""
+
+    def __init__(self, dados):
+        self.dados = dados
+        self.faixas = []
+
+    def open(self, req, timeout=None):
+        inicio, fim = map(int, re.match(r"bytes=(\d+)-(\d+)", req.get_header("Range")).groups())
+        self.faixas.append((inicio, fim))
+        return _Resposta(self.dados, inicio, fim)
+
+
+def _baixar(destino, servidor, segments=3):
+    journal = BlockJournal.load(destino, len(DADOS), block_size=BLOCO, validator='"v1"')
+    download_segmented(
+        URL, destino, opener=servidor, total=len(DADOS), segments=segments, journal=journal
+    )
+    journal.save()
+    return journal
+
+
+def test_round_trip_segmentado(tmp_path):
+    destino = tmp_path / "cnes.zip"
+
+    journal = _baixar(destino, _Servidor(DADOS))
+
+    assert destino.read_bytes() == DADOS
+    assert sorted(journal.crcs) == list(range(journal.blocks))
+    assert BlockJournal.load(destino, len(DADOS), block_size=BLOCO).verify() == []
+
+
+def test_retomada_pede_so_blocos_ruins(tmp_path):
+    destino = tmp_path / "cnes.zip"
+    _baixar(destino, _Servidor(DADOS))
+    with destino.open("r+b") as f:
+        f.seek(3 * BLOCO + 10)
+        f.write(b"\xff" * 8)  # bloco 3 corrompido
+        f.seek(10 * BLOCO)
+        f.write(b"\x00" * 123)  # cauda zerada (pré-alocação)
+
+    servidor = _Servidor(DADOS)
+    _baixar(destino, servidor)
+
+    assert destino.read_bytes() == DADOS
+    assert sorted(servidor.faixas) == [(3 * BLOCO, 4 * BLOCO - 1), (10 * BLOCO, len(DADOS) - 1)]
+
+
+def test_retomada_sem_nada_a_baixar(tmp_path):
+    destino = tmp_path / "cnes.zip"
+    _baixar(destino, _Servidor(DADOS))
+
+    servidor = _Servidor(DADOS)
+    _baixar(destino, servidor)
+
+    assert servidor.faixas == []
+    assert destino.read_bytes() == DADOS
+
+
+def test_diario_de_outra_versao_e_descartado(tmp_path):
+    destino = tmp_path / "cnes.zip"
+    _baixar(destino, _Servidor(DADOS))
+
+    journal = BlockJournal.load(destino, len(DADOS), block_size=BLOCO, validator='"v2"')
+
+    assert journal.crcs == {}
+    assert journal.verify() == list(range(journal.blocks))
+
+
+def test_prefixo_valido(tmp_path):
+    destino = tmp_path / "cnes.zip"
+    _baixar(destino, _Servidor(DADOS))
+    with destino.open("r+b") as f:
+        f.seek(5 * BLOCO)
+        f.write(b"\x00" * BLOCO)
+
+    journal = BlockJournal.load(destino, len(DADOS), block_size=BLOCO)
+
+    assert journal.valid_prefix() == 5 * BLOCO
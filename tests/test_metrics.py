@@ -0,0 +1,43 @@
+# test_metrics.py
+# -*- coding: utf-8 -*-
+"""`MetricsRegistry.phase`: vazão de execuções simultâneas da mesma fase."""
+
+import threading
+import time
+
+from cnes_metrics import MetricsRegistry
+
+
+def test_execucoes_simultaneas_nao_multiplicam_a_vazao():
+    registry = MetricsRegistry(progress=False)
+
+    def job():
+        with registry.phase("download"):
+            registry.inc("cnes_bytes_total", 1_000_000, phase="download")
+            time.sleep(0.2)
+
+    threads = [threading.Thread(target=job) for _ in range(4)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    parede = time.perf_counter() - inicio
+
+    fase = registry.snapshot()["phases"]["download"]
+    gauge = registry.snapshot()["gauges"]["cnes_phase_throughput_bytes_per_second"][0]["value"]
+    esperado = 4_000_000 / parede
+    assert fase["bytes"] == 4_000_000
+    assert fase["seconds"] > 3 * fase["wall_seconds"]  # soma entre threads
+    assert 0.8 * esperado < fase["mb_per_s"] * 1e6 < 1.25 * esperado
+    assert 0.8 * esperado < gauge < 1.25 * esperado
+
+
+def test_fases_sequenciais():
+    registry = MetricsRegistry(progress=False)
+    for _ in range(2):
+        with registry.phase("hash"):
+            registry.inc("cnes_bytes_total", 500, phase="hash")
+    fase = registry.snapshot()["phases"]["hash"]
+    assert fase["bytes"] == 1000
+    assert abs(fase["seconds"] - fase["wall_seconds"]) < 0.01
@@ -0,0 +1,86 @@
+# test_parquet.py
+# -*- coding: utf-8 -*-
+"""Escritor Parquet em Python puro: arquivo válido, tipos e nulos preservados."""
+
+import struct
+import zipfile
+from datetime import date
+
+import pytest
+
+from cnes_parquet import convert_member_to_parquet
+
+MEMBRO = "tbEstabelecimento202508.csv"
+CABECALHO = "CO_UNIDADE;NO_FANTASIA;TP_UNIDADE;NU_LATITUDE;QT_LEITOS;TO_CHAR(DT_ATUALIZACAO,'DD/MM/YYYY')\n"
+LINHAS = [
+    "3550302077485;HOSPITAL SÃO JOSÉ;05;-23,5505;120;01/08/2025",
+    "3304550000001;UBS;2;-22.9;;2025-07-31",
+    "5300100000002;;x;;abc;31/02/2025",  # tipos inválidos viram nulo
+    "0011000000003;POSTO;1;1e2;7;",
+]
+
+
+def _zip(tmp_path, linhas):
+    path = tmp_path / "cnes.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(MEMBRO, (CABECALHO + "\n".join(linhas) + "\n").encode("latin1"))
+    return path
+
+
+def _converter(tmp_path, linhas=LINHAS, **kwargs):
+    with zipfile.ZipFile(_zip(tmp_path, linhas)) as zf:
+        return convert_member_to_parquet(zf, MEMBRO, tmp_path / "out.parquet", engine="python", **kwargs)
+
+
+def test_arquivo_parquet_bem_formado(tmp_path):
+    report = _converter(tmp_path, batch_rows=3)
+
+    dados = report.path.read_bytes()
+    assert dados[:4] == b"PAR1" and dados[-4:] == b"PAR1"
+    (rodape,) = struct.unpack("<I", dados[-8:-4])
+    assert 0 < rodape < len(dados) - 12
+    assert report.rows == len(LINHAS)
+    assert report.engine == "python"
+    assert report.invalid == {"TP_UNIDADE": 1, "QT_LEITOS": 1, "DT_ATUALIZACAO": 1}
+    assert not report.path.with_name(report.path.name + ".part").exists()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none"])
+def test_round_trip_com_pyarrow(tmp_path, compression):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    report = _converter(tmp_path, batch_rows=3, compression=compression)
+
+    arquivo = pq.ParquetFile(report.path)
+    assert arquivo.metadata.num_row_groups == 2
+    tabela = arquivo.read()
+    assert tabela.schema.names == [
+        "CO_UNIDADE", "NO_FANTASIA", "TP_UNIDADE", "NU_LATITUDE", "QT_LEITOS", "DT_ATUALIZACAO",
+    ]
+    assert [str(t) for t in tabela.schema.types] == ["string", "string", "int32", "double", "int64", "date32[day]"]
+    assert tabela.to_pydict() == {
+        "CO_UNIDADE": ["3550302077485", "3304550000001", "5300100000002", "0011000000003"],
+        "NO_FANTASIA": ["HOSPITAL SÃO JOSÉ", "UBS", None, "POSTO"],
+        "TP_UNIDADE": [5, 2, None, 1],
+        "NU_LATITUDE": [-23.5505, -22.9, None, 100.0],
+        "QT_LEITOS": [120, None, None, 7],
+        "DT_ATUALIZACAO": [date(2025, 8, 1), date(2025, 7, 31), None, None],
+    }
+
+
+def test_muitas_colunas_e_coluna_so_de_nulos(tmp_path):
+    """Mais de 14 colunas (lista thrift longa) e uma coluna só de nulos."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    nomes = [f"CO_C{i}" for i in range(20)]
+    path = tmp_path / "cnes.zip"
+    linhas = [";".join(str(i * j) if i else "" for i in range(20)) for j in range(5)]
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("tbLargo202508.csv", (";".join(nomes) + "\n" + "\n".join(linhas) + "\n").encode("latin1"))
+
+    with zipfile.ZipFile(path) as zf:
+        report = convert_member_to_parquet(zf, "tbLargo202508.csv", tmp_path / "l.parquet", engine="python")
+
+    tabela = pq.read_table(report.path)
+    assert tabela.column_names == nomes
+    assert tabela.column("CO_C0").to_pylist() == [None] * 5
+    assert tabela.column("CO_C19").to_pylist() == [str(19 * j) for j in range(5)]
@@ -0,0 +1,38 @@
+# test_retry.py
+# -*- coding: utf-8 -*-
+"""`is_retryable`: falhas transitórias sim; 4xx e falhas de confiança não."""
+
+import ssl
+from urllib import error
+
+import pytest
+
+from cnes_downloader import PinMismatch, is_retryable
+
+
+@pytest.mark.parametrize(
+    "exc",
+    [
+        PinMismatch("pin divergente"),
+        ssl.SSLCertVerificationError(1, "cadeia"),
+        error.URLError(ssl.SSLCertVerificationError(1, "cadeia")),
+        error.HTTPError("u", 404, "Not Found", {}, None),
+    ],
+)
+def test_nao_repete(exc):
+    assert not is_retryable(exc)
+
+
+@pytest.mark.parametrize(
+    "exc",
+    [
+        ssl.SSLError("EOF inesperado"),
+        ConnectionResetError(),
+        TimeoutError(),
+        error.URLError("timed out"),
+        error.HTTPError("u", 503, "Service Unavailable", {}, None),
+        error.HTTPError("u", 429, "Too Many Requests", {}, None),
+    ],
+)
+def test_repete(exc):
+    assert is_retryable(exc)
@@ -0,0 +1,70 @@
+# test_shards.py
+# -*- coding: utf-8 -*-
+"""`record_boundaries`/`shard_csvs`: cortes só entre registros e fatias que recompõem o CSV."""
+
+import pytest
+
+from cnes_shards import record_boundaries, shard_csvs
+
+CABECALHO = "CO_UNIDADE;NO_FANTASIA;DS_OBS\n".encode("latin1")
+
+
+def _registros(n):
+    for i in range(n):
+        # aspas com quebras de linha (e aspas escapadas) em boa parte dos registros
+        obs = f'"obs {i}\n""x""\n\n;fim"' if i % 3 else f"obs {i}"
+        yield f"{i:013d};SÃO JOÃO {i};{obs}\n".encode("latin1")
+
+
+@pytest.fixture
+def csv_grande(tmp_path):
+    registros = list(_registros(400))
+    path = tmp_path / "tbEstabelecimento202508.csv"
+    path.write_bytes(CABECALHO + b"".join(registros))
+    return path, registros
+
+
+@pytest.mark.parametrize("shards", [1, 2, 7, 64, 1000])
+def test_cortes_em_inicio_de_registro(csv_grande, shards):
+    path, registros = csv_grande
+    inicios = {len(CABECALHO)}
+    for r in registros:
+        inicios.add(max(inicios) + len(r))
+
+    header, cortes = record_boundaries(path, shards)
+
+    assert header == CABECALHO
+    assert cortes[0] == len(CABECALHO) and cortes[-1] == path.stat().st_size
+    assert cortes == sorted(set(cortes))
+    assert set(cortes) <= inicios
+    assert len(cortes) - 1 <= min(shards, len(registros))
+
+
+def test_fatias_recompoem_o_csv_em_utf8(tmp_path, csv_grande):
+    path, _ = csv_grande
+
+    (report,) = shard_csvs([path], tmp_path / "fatias", shards=5, workers=2)
+
+    assert len(report.shards) == 5
+    assert [p.name for p in report.shards] == [
+        f"tbEstabelecimento202508-{i:05d}-of-00005.csv" for i in range(5)
+    ]
+    corpo = b""
+    for fatia in report.shards:
+        dados = fatia.read_bytes()
+        cabecalho = CABECALHO.decode("latin1").encode("utf-8")
+        assert dados.startswith(cabecalho)
+        corpo += dados[len(cabecalho):]
+    assert corpo.decode("utf-8").encode("latin1") == path.read_bytes()[len(CABECALHO):]
+    assert report.bytes == path.stat().st_size
+    assert not list((tmp_path / "fatias").glob("*.part"))
+
+
+def test_csv_so_com_cabecalho(tmp_path):
+    path = tmp_path / "tbVazia202508.csv"
+    path.write_bytes(CABECALHO)
+
+    (report,) = shard_csvs([path], tmp_path / "fatias", shards=4, workers=1)
+
+    assert len(report.shards) == 1
+    assert report.shards[0].read_bytes() == CABECALHO
@@ -0,0 +1,64 @@
+# test_shared_cache.py
+# -*- coding: utf-8 -*-
+"""`SharedDownloadCache`: destinos materializados não alteram o objeto compartilhado."""
+
+import hashlib
+import os
+
+import cnes_downloader
+from cnes_downloader import SharedDownloadCache, _break_hardlink
+
+CONTEUDO = b"PK\x05\x06" + b"\x00" * 18 + b"zip compartilhado"
+SHA = hashlib.sha256(CONTEUDO).hexdigest()
+
+
+def _objeto(tmp_path):
+    objeto = tmp_path / "objects" / f"{SHA}.zip"
+    objeto.parent.mkdir()
+    objeto.write_bytes(CONTEUDO)
+    os.chmod(objeto, 0o444)
+    return objeto
+
+
+def test_materializar_e_escrever_nao_altera_o_objeto(tmp_path):
+    objeto = _objeto(tmp_path)
+    destino = tmp_path / "job" / "cnes.zip"
+
+    SharedDownloadCache._materialize(objeto, destino, SHA)
+    assert os.path.samefile(objeto, destino)
+
+    _break_hardlink(destino)
+    with open(destino, "r+b") as f:  # como download_segmented/repair_zip_members
+        f.write(b"XX")
+
+    assert not os.path.samefile(objeto, destino)
+    assert objeto.read_bytes() == CONTEUDO
+    assert destino.read_bytes() == b"XX" + CONTEUDO[2:]
+
+
+def test_arquivo_sem_link_fica_intacto(tmp_path):
+    destino = tmp_path / "cnes.zip"
+    destino.write_bytes(CONTEUDO)
+    inode = destino.stat().st_ino
+    _break_hardlink(destino)
+    _break_hardlink(tmp_path / "nao_existe.zip")
+    assert destino.stat().st_ino == inode
+
+
+def test_download_segmentado_quebra_o_link(tmp_path, monkeypatch):
+    objeto = _objeto(tmp_path)
+    destino = tmp_path / "cnes.zip"
+    SharedDownloadCache._materialize(objeto, destino, SHA)
+
+    # Reparo de todos os blocos: o "servidor" devolve zeros
+    def segmento(url, opener, fd, part, **kwargs):
+        os.pwrite(fd, b"\x00" * (part["end"] - part["start"] + 1), part["start"])
+        return part
+
+    monkeypatch.setattr(cnes_downloader, "_download_segment", segmento)
+    cnes_downloader.download_segmented(
+        "https://x/cnes.zip", destino, opener=object(), total=len(CONTEUDO), segments=1, missing=[0]
+    )
+
+    assert objeto.read_bytes() == CONTEUDO
+    assert destino.read_bytes() == b"\x00" * len(CONTEUDO)
@@ -0,0 +1,130 @@
+# test_sinks.py
+# -*- coding: utf-8 -*-
+"""Sinks e deduplicação de membros: local, memória e `mssparkutils.fs` (simulado)."""
+
+import os
+import shutil
+import zipfile
+from collections import namedtuple
+from pathlib import Path
+
+import pytest
+
+from cnes_sinks import LocalSink, MemberManifest, MemorySink, MssparkutilsSink, extract_to_sink, sink_for
+
+FileInfo = namedtuple("FileInfo", "name path size isDir")
+
+
+class FakeFs:
+    """O suficiente de `mssparkutils.fs` sobre uma pasta local (abfss://lake/ -> raiz)."""
+
+    def __init__(self, raiz: Path) -> None:
+        self.raiz = raiz
+        self.chamadas = []
+
+    def _local(self, url: str) -> Path:
+        if url.startswith("file:"):
+            return Path(url[len("file:"):])
+        return self.raiz / url.split("://", 1)[1]
+
+    def cp(self, src, dst):
+        self.chamadas.append(("cp", src, dst))
+        self._local(dst).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self._local(src), self._local(dst))
+
+    def mv(self, src, dst, create_path=False, overwrite=False):
+        self.chamadas.append(("mv", src, dst))
+        os.replace(self._local(src), self._local(dst))
+
+    def rm(self, path):
+        self._local(path).unlink()
+
+    def exists(self, path):
+        return self._local(path).exists()
+
+    def ls(self, path):
+        p = self._local(path)
+        if not p.exists():
+            raise FileNotFoundError(path)
+        return [FileInfo(p.name, path, p.stat().st_size, False)]
+
+    def head(self, path, max_bytes):
+        return self._local(path).read_text(encoding="utf-8")[:max_bytes]
+
+    def put(self, path, content, overwrite=False):
+        self._local(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local(path).write_text(content, encoding="utf-8")
+
+
+def _zips(tmp_path):
+    def mk(nome, mes, mudou):
+        with zipfile.ZipFile(tmp_path / nome, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(f"tbA{mes}.csv", b"a;b\n1;2\n" * 1000)
+            zf.writestr(f"tbB{mes}.csv", b"x;y\n" + (b"9;9\n" if mudou else b"1;1\n") * 500)
+        return zipfile.ZipFile(tmp_path / nome)
+
+    return mk("a.zip", "202507", False), mk("b.zip", "202508", True)
+
+
+def test_sink_for():
+    assert isinstance(sink_for("pasta"), LocalSink)
+    assert isinstance(sink_for("abfss://c@conta.dfs.core.windows.net/x", fs=object()), MssparkutilsSink)
+
+
+def test_local_hardlink_dos_membros_iguais(tmp_path):
+    a, b = _zips(tmp_path)
+    manifesto = MemberManifest(tmp_path / "_membros.json")
+    extract_to_sink(a, tmp_path / "202507", manifest=manifesto)
+    extract_to_sink(b, tmp_path / "202508", manifest=MemberManifest(tmp_path / "_membros.json"))
+
+    assert os.path.samefile(tmp_path / "202507/tbA202507.csv", tmp_path / "202508/tbA202508.csv")
+    assert not os.path.samefile(tmp_path / "202507/tbB202507.csv", tmp_path / "202508/tbB202508.csv")
+    assert (tmp_path / "202508/tbB202508.csv").read_bytes().startswith(b"x;y\n9;9\n")
+
+
+def test_origem_apagada_extrai_de_novo(tmp_path):
+    a, b = _zips(tmp_path)
+    manifesto = MemberManifest(tmp_path / "_membros.json")
+    extract_to_sink(a, tmp_path / "202507", manifest=manifesto)
+    (tmp_path / "202507/tbA202507.csv").unlink()
+    extract_to_sink(b, tmp_path / "202508", manifest=manifesto)
+    assert (tmp_path / "202508/tbA202508.csv").read_bytes() == b"a;b\n1;2\n" * 1000
+
+
+def test_memoria(tmp_path):
+    a, b = _zips(tmp_path)
+    sink, manifesto = MemorySink(), MemberManifest(tmp_path / "m.json")
+    extract_to_sink(a, sink, prefix="07/", manifest=manifesto)
+    extract_to_sink(b, sink, prefix="08/", manifest=manifesto)
+    assert sink.files["08/tbA202508.csv"] is sink.files["07/tbA202507.csv"]
+    assert sink.files["08/tbB202508.csv"] != sink.files["07/tbB202507.csv"]
+
+
+def test_mssparkutils_publica_e_reaproveita(tmp_path):
+    a, b = _zips(tmp_path)
+    fs = FakeFs(tmp_path)
+    manifesto = MemberManifest("abfss://lake/_membros.json", fs=fs)
+    extract_to_sink(a, sink_for("abfss://lake/202507/", fs=fs), manifest=manifesto)
+
+    manifesto = MemberManifest("abfss://lake/_membros.json", fs=fs)
+    assert len(manifesto.entries) == 2
+    fs.chamadas.clear()
+    extract_to_sink(b, sink_for("abfss://lake/202508/", fs=fs), manifest=manifesto)
+
+    lake = tmp_path / "lake"
+    assert (lake / "202508/tbA202508.csv").read_bytes() == b"a;b\n1;2\n" * 1000
+    assert (lake / "202508/tbB202508.csv").read_bytes().startswith(b"x;y\n9;9\n")
+    # tbA: cópia dentro do lake; tbB: enviado de um temporário local
+    assert ("cp", "abfss://lake/202507/tbA202507.csv", "abfss://lake/202508/tbA202508.csv.part") in fs.chamadas
+    assert any(c[0] == "cp" and c[1].startswith("file:") for c in fs.chamadas)
+    assert not list(lake.rglob("*.part"))
+
+
+def test_mssparkutils_erro_nao_publica(tmp_path):
+    fs = FakeFs(tmp_path)
+    sink = MssparkutilsSink("abfss://lake/x", fs)
+    with pytest.raises(RuntimeError):
+        with sink.open_write("tb.csv") as f:
+            f.write(b"metade")
+            raise RuntimeError("falhou no meio")
+    assert not sink.exists("tb.csv")
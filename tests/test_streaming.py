@@ -0,0 +1,85 @@
+# test_streaming.py
+# -*- coding: utf-8 -*-
+"""`StreamingZipExtractor`: membros publicados durante a leitura sequencial do ZIP."""
+
+import io
+import zipfile
+
+import pytest
+
+from cnes_sinks import MemorySink
+from cnes_streaming import StreamingZipExtractor, finish_from_central_directory
+
+CHUNK = 1024 * 1024  # limite de saída por chamada = 4 * CHUNK
+
+
+def _zip(path, membros, compression=zipfile.ZIP_DEFLATED):
+    with zipfile.ZipFile(path, "w", compression) as zf:
+        for nome, dados in membros.items():
+            zf.writestr(nome, dados)
+    return path
+
+
+def _stream(path, chunk_size=CHUNK):
+    sink = MemorySink()
+    with open(path, "rb") as f:
+        extractor = StreamingZipExtractor(f, sink, chunk_size=chunk_size)
+        seen = extractor.run()
+    return sink, extractor, seen
+
+
+def test_membro_maior_que_o_limite_sai_no_streaming(tmp_path):
+    # Zeros comprimem para poucos KB: a entrada acaba antes da saída (4 MiB + 1)
+    dados = b"\x00" * (4 * CHUNK + 1)
+    path = _zip(tmp_path / "z.zip", {"tbZeros202508.csv": dados, "tbB202508.csv": b"a;b\n1;2\n"})
+
+    sink, extractor, seen = _stream(path)
+
+    assert extractor.stopped is None
+    assert seen["tbZeros202508.csv"].published
+    assert sink.files["tbZeros202508.csv"] == dados
+    streamed, fallback, failed = finish_from_central_directory(path, sink, seen)
+    assert sorted(streamed) == ["tbB202508.csv", "tbZeros202508.csv"]
+    assert fallback == [] and failed == {}
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_round_trip_em_chunks_pequenos(tmp_path, compression):
+    membros = {f"tb{i}202508.csv": bytes(range(256)) * (i * 300 + 1) for i in range(4)}
+    path = _zip(tmp_path / "z.zip", membros, compression)
+
+    sink, _, seen = _stream(path, chunk_size=4096)
+
+    assert sink.files == membros
+    streamed, fallback, failed = finish_from_central_directory(path, sink, seen)
+    assert sorted(streamed) == sorted(membros) and fallback == [] and failed == {}
+
+
+def test_data_descriptor(tmp_path):
+    # Gravado num arquivo sem seek: o zipfile usa data descriptor (flag 0x08)
+    buf = io.BytesIO()
+    raw = type("SemSeek", (), {"write": buf.write, "flush": buf.flush, "tell": buf.tell})()
+    with zipfile.ZipFile(raw, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("tbD202508.csv", "w") as f:
+            f.write(b"x;y\n" * 50000)
+    path = tmp_path / "d.zip"
+    path.write_bytes(buf.getvalue())
+
+    sink, _, seen = _stream(path)
+
+    assert sink.files["tbD202508.csv"] == b"x;y\n" * 50000
+    assert finish_from_central_directory(path, sink, seen)[0] == ["tbD202508.csv"]
+
+
+def test_crc_corrompido_vai_para_o_fallback_e_falha(tmp_path):
+    path = _zip(tmp_path / "z.zip", {"tbC202508.csv": b"conteudo " * 1000}, zipfile.ZIP_STORED)
+    dados = bytearray(path.read_bytes())
+    dados[30 + len("tbC202508.csv") + 5] ^= 0xFF  # dentro dos dados do membro
+    path.write_bytes(bytes(dados))
+
+    sink, _, seen = _stream(path)
+
+    assert not seen["tbC202508.csv"].published
+    assert "tbC202508.csv" not in sink.files
+    streamed, fallback, failed = finish_from_central_directory(path, sink, seen)
+    assert streamed == [] and list(failed) == ["tbC202508.csv"]